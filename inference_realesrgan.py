@@ -2,11 +2,157 @@ import argparse
 import cv2
 import glob
 import os
+import queue
+import time
 from basicsr.archs.rrdbnet_arch import RRDBNet
 from basicsr.utils.download_util import load_file_from_url
 
-from realesrgan import RealESRGANer
+from realesrgan import IOConsumer, PrefetchReader, RealESRGANer
 from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+from realesrgan.large_image import LARGE_IMAGE_EXTENSIONS, create_large_image, open_large_image
+from realesrgan.manifest import Manifest, in_shard, params_fingerprint
+
+# parameters that change the output images; a change invalidates the manifest records
+FINGERPRINT_KEYS = [
+    'model_name', 'model_path', 'denoise_strength', 'outscale', 'tile', 'tile_pad', 'tile_blend', 'pre_pad',
+    'face_enhance', 'fp32', 'alpha_upsampler', 'ext', 'suffix', 'large_image'
+]
+
+
+def get_save_path(args, path, img_mode):
+    imgname, extension = os.path.splitext(os.path.basename(path))
+    if args.ext == 'auto':
+        extension = extension[1:]
+    else:
+        extension = args.ext
+    if img_mode == 'RGBA':  # RGBA images should be saved in png format
+        extension = 'png'
+    if args.suffix == '':
+        return os.path.join(args.output, f'{imgname}.{extension}')
+    return os.path.join(args.output, f'{imgname}_{args.suffix}.{extension}')
+
+
+def inference_batch(args, paths, upsampler, face_enhancer=None, on_saved=None):
+    """Batch mode: overlap image decoding, inference and encoding.
+
+    A PrefetchReader thread decodes the next images while the current ones are upsampled, and a pool of IOConsumer
+    threads encodes and writes the results. cv2 releases the GIL while decoding and encoding, so the threads run in
+    parallel with the inference. With ``--batch_size`` > 1, consecutive images of the same size are upsampled
+    together with ``enhance_batch``. ``on_saved(path, save_path)`` is called by the writer threads once an image
+    has been written.
+    """
+    start_time = time.time()
+    reader = PrefetchReader(paths, num_prefetch_queue=args.num_prefetch)
+    reader.start()
+    save_queue = queue.Queue(maxsize=args.num_writers * 4)
+    writers = [IOConsumer(args, save_queue, qid) for qid in range(args.num_writers)]
+    for writer in writers:
+        writer.start()
+    params = [] if args.png_compression is None else [cv2.IMWRITE_PNG_COMPRESSION, args.png_compression]
+
+    num_done = 0
+
+    def run_group(group):
+        nonlocal num_done
+        imgs = [img for _, img in group]
+        try:
+            if face_enhancer is not None:
+                results = []
+                for img in imgs:
+                    _, _, output = face_enhancer.enhance(
+                        img, has_aligned=False, only_center_face=False, paste_back=True)
+                    results.append((output, 'RGBA' if img.ndim == 3 and img.shape[2] == 4 else None))
+            else:
+                results = upsampler.enhance_batch(imgs, outscale=args.outscale, alpha_upsampler=args.alpha_upsampler)
+        except RuntimeError as error:
+            print('Error', error)
+            print('If you encounter CUDA out of memory, try to set --tile with a smaller number.')
+            return
+        for (path, _), (output, img_mode) in zip(group, results):
+            save_path = get_save_path(args, path, img_mode)
+            msg = {'output': output, 'save_path': save_path, 'params': params}
+            if on_saved is not None:
+                msg['on_saved'] = lambda path=path, save_path=save_path: on_saved(path, save_path)
+            save_queue.put(msg)
+            num_done += 1
+
+    group = []
+    for idx, (path, img) in enumerate(zip(paths, reader)):
+        print('Testing', idx, os.path.splitext(os.path.basename(path))[0])
+        if img is None:
+            print(f'\tCannot read {path}, skipped.')
+            continue
+        if group and (len(group) == args.batch_size or img.shape != group[0][1].shape):
+            run_group(group)
+            group = []
+        group.append((path, img))
+    if group:
+        run_group(group)
+
+    for _ in writers:
+        save_queue.put('quit')
+    for writer in writers:
+        writer.join()
+    total_time = time.time() - start_time
+    print(f'Processed {num_done} images in {total_time:.1f}s ({num_done / max(total_time, 1e-6):.2f} images/s)')
+
+
+def inference_large(args, paths, upsampler, on_saved=None):
+    """Large-image mode: stream memory-mapped TIFF / .npy inputs tile by tile into memory-mapped outputs.
+
+    The output keeps the input format and is written at the network scale.
+    """
+    for idx, path in enumerate(paths):
+        imgname, extension = os.path.splitext(os.path.basename(path))
+        if extension.lower() not in LARGE_IMAGE_EXTENSIONS:
+            print(f'Skipping {path}: large-image mode supports {" | ".join(LARGE_IMAGE_EXTENSIONS)}')
+            continue
+        print('Testing', idx, imgname)
+        img = open_large_image(path)
+        save_path = os.path.splitext(get_save_path(args, path, None))[0] + extension
+        output_shape = (img.shape[0] * upsampler.scale, img.shape[1] * upsampler.scale) + img.shape[2:]
+        output = create_large_image(save_path, output_shape, img.dtype)
+        try:
+            upsampler.enhance_large(img, output, tile_size=args.tile or 512)
+        except RuntimeError as error:
+            print('Error', error)
+            print('If you encounter CUDA out of memory, try to set --tile with a smaller number.')
+            saved = False
+        else:
+            output.flush()
+            saved = True
+        del output  # closes the memory map
+        if not saved:
+            os.remove(save_path)
+        elif on_saved is not None:
+            on_saved(path, save_path)
+
+
+def inference_serial(args, paths, upsampler, face_enhancer=None, on_saved=None):
+    """Serial mode: read, upsample and write the images one at a time."""
+    params = [] if args.png_compression is None else [cv2.IMWRITE_PNG_COMPRESSION, args.png_compression]
+    for idx, path in enumerate(paths):
+        imgname = os.path.splitext(os.path.basename(path))[0]
+        print('Testing', idx, imgname)
+
+        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if len(img.shape) == 3 and img.shape[2] == 4:
+            img_mode = 'RGBA'
+        else:
+            img_mode = None
+
+        try:
+            if args.face_enhance:
+                _, _, output = face_enhancer.enhance(img, has_aligned=False, only_center_face=False, paste_back=True)
+            else:
+                output, _ = upsampler.enhance(img, outscale=args.outscale)
+        except RuntimeError as error:
+            print('Error', error)
+            print('If you encounter CUDA out of memory, try to set --tile with a smaller number.')
+        else:
+            save_path = get_save_path(args, path, img_mode)
+            if cv2.imwrite(save_path, output, params) and on_saved is not None:
+                on_saved(path, save_path)
 
 
 def main():
@@ -35,6 +181,12 @@ def main():
     parser.add_argument('--suffix', type=str, default='out', help='Suffix of the restored image')
     parser.add_argument('-t', '--tile', type=int, default=0, help='Tile size, 0 for no tile during testing')
     parser.add_argument('--tile_pad', type=int, default=10, help='Tile padding')
+    parser.add_argument(
+        '--tile_blend',
+        type=str,
+        default='none',
+        choices=['none', 'linear', 'cosine'],
+        help='How tiles are merged: none keeps the tile centres, linear | cosine feather the tile_pad overlap')
     parser.add_argument('--pre_pad', type=int, default=0, help='Pre padding size at each border')
     parser.add_argument('--face_enhance', action='store_true', help='Use GFPGAN to enhance face')
     parser.add_argument(
@@ -51,6 +203,36 @@ def main():
         help='Image extension. Options: auto | jpg | png, auto means using the same extension as inputs')
     parser.add_argument(
         '-g', '--gpu-id', type=int, default=None, help='gpu device to use (default=None) can be 0,1,2 for multi-gpu')
+    parser.add_argument(
+        '--large_image',
+        action='store_true',
+        help=('Stream uncompressed TIFF / .npy images tile by tile through memory maps (--tile, default 512), so '
+              'gigapixel scans fit in memory. Outputs keep the input format, at the network scale'))
+    parser.add_argument(
+        '--batch_mode',
+        action='store_true',
+        help='Read and write images on background threads, overlapping with the inference. Reports images/s')
+    parser.add_argument(
+        '--batch_size', type=int, default=1, help='[Batch mode] Upsample up to this many same-size images at once')
+    parser.add_argument('--num_prefetch', type=int, default=8, help='[Batch mode] Number of images read ahead')
+    parser.add_argument('--num_writers', type=int, default=2, help='[Batch mode] Number of image writer threads')
+    parser.add_argument(
+        '--png_compression',
+        type=int,
+        default=None,
+        choices=range(10),
+        help='[Option] PNG compression level 0-9; lower is faster to write but larger. Default: the cv2 default')
+    parser.add_argument(
+        '--manifest',
+        action='store_true',
+        help='Record processed images in a SQLite manifest in the output folder and skip up-to-date ones on reruns')
+    parser.add_argument(
+        '--manifest_path', type=str, default=None, help='[Option] Manifest path. Default: <output>/manifest.db')
+    parser.add_argument(
+        '--shard',
+        type=str,
+        default=None,
+        help='Only process shard K of N (e.g. 0/4), split by the hash of the path relative to the input folder')
 
     args = parser.parse_args()
 
@@ -111,6 +293,7 @@ def main():
         model=model,
         tile=args.tile,
         tile_pad=args.tile_pad,
+        tile_blend=args.tile_blend,
         pre_pad=args.pre_pad,
         half=not args.fp32,
         gpu_id=args.gpu_id)
@@ -123,6 +306,8 @@ def main():
             arch='clean',
             channel_multiplier=2,
             bg_upsampler=upsampler)
+    else:
+        face_enhancer = None
     os.makedirs(args.output, exist_ok=True)
 
     if os.path.isfile(args.input):
@@ -130,36 +315,38 @@ def main():
     else:
         paths = sorted(glob.glob(os.path.join(args.input, '*')))
 
-    for idx, path in enumerate(paths):
-        imgname, extension = os.path.splitext(os.path.basename(path))
-        print('Testing', idx, imgname)
+    # manifest keys are relative to the input folder, so that machines with different mounts agree on them
+    input_root = args.input if os.path.isdir(args.input) else os.path.dirname(args.input)
+    keys = {path: os.path.relpath(path, input_root) for path in paths}
+    if args.shard is not None:
+        shard_index, num_shards = map(int, args.shard.split('/'))
+        paths = [path for path in paths if in_shard(keys[path], shard_index, num_shards)]
+        print(f'Shard {shard_index}/{num_shards}: {len(paths)} images')
+    manifest = None
+    if args.manifest:
+        manifest_path = args.manifest_path or os.path.join(args.output, 'manifest.db')
+        manifest = Manifest(manifest_path, params_fingerprint({k: getattr(args, k) for k in FINGERPRINT_KEYS}))
+        num_paths = len(paths)
+        paths = [path for path in paths if not manifest.is_up_to_date(keys[path], path)]
+        print(f'Manifest {manifest_path}: {num_paths - len(paths)} images up to date, {len(paths)} to process')
 
-        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
-        if len(img.shape) == 3 and img.shape[2] == 4:
-            img_mode = 'RGBA'
-        else:
-            img_mode = None
+        def on_saved(path, save_path):
+            manifest.record(keys[path], path, save_path)
+    else:
+        on_saved = None
 
-        try:
-            if args.face_enhance:
-                _, _, output = face_enhancer.enhance(img, has_aligned=False, only_center_face=False, paste_back=True)
-            else:
-                output, _ = upsampler.enhance(img, outscale=args.outscale)
-        except RuntimeError as error:
-            print('Error', error)
-            print('If you encounter CUDA out of memory, try to set --tile with a smaller number.')
+    try:
+        if args.large_image:
+            if args.face_enhance or args.outscale != netscale:
+                print(f'Large-image mode writes at the network scale ({netscale}x) without face enhancement.')
+            inference_large(args, paths, upsampler, on_saved)
+        elif args.batch_mode:
+            inference_batch(args, paths, upsampler, face_enhancer, on_saved)
         else:
-            if args.ext == 'auto':
-                extension = extension[1:]
-            else:
-                extension = args.ext
-            if img_mode == 'RGBA':  # RGBA images should be saved in png format
-                extension = 'png'
-            if args.suffix == '':
-                save_path = os.path.join(args.output, f'{imgname}.{extension}')
-            else:
-                save_path = os.path.join(args.output, f'{imgname}_{args.suffix}.{extension}')
-            cv2.imwrite(save_path, output)
+            inference_serial(args, paths, upsampler, face_enhancer, on_saved)
+    finally:
+        if manifest is not None:
+            manifest.close()
 
 
 if __name__ == '__main__':
@@ -5,7 +5,7 @@ import mimetypes
 import numpy as np
 import os
 import shutil
-import subprocess
+import time
 import torch
 from basicsr.archs.rrdbnet_arch import RRDBNet
 from basicsr.utils.download_util import load_file_from_url
@@ -14,6 +14,8 @@ from tqdm import tqdm
 
 from realesrgan import RealESRGANer
 from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+from realesrgan.interpolation import INTERPOLATORS, build_interpolator
+from realesrgan.video_io import FFmpegProcess, read_frame_into, run_ffmpeg, write_frame
 
 try:
     import ffmpeg
@@ -45,12 +47,12 @@ def get_sub_video(args, num_process, process_idx):
     print(f'duration: {duration}, part_time: {part_time}')
     os.makedirs(osp.join(args.output, f'{args.video_name}_inp_tmp_videos'), exist_ok=True)
     out_path = osp.join(args.output, f'{args.video_name}_inp_tmp_videos', f'{process_idx:03d}.mp4')
-    cmd = [
-        args.ffmpeg_bin, f'-i {args.input}', '-ss', f'{part_time * process_idx}',
-        f'-to {part_time * (process_idx + 1)}' if process_idx != num_process - 1 else '', '-async 1', out_path, '-y'
-    ]
+    cmd = [args.ffmpeg_bin, '-i', args.input, '-ss', f'{part_time * process_idx}']
+    if process_idx != num_process - 1:
+        cmd += ['-to', f'{part_time * (process_idx + 1)}']
+    cmd += ['-async', '1', out_path, '-y']
     print(' '.join(cmd))
-    subprocess.call(' '.join(cmd), shell=True)
+    run_ffmpeg(cmd)
     return out_path
 
 
@@ -61,14 +63,15 @@ class Reader:
         input_type = mimetypes.guess_type(args.input)[0]
         self.input_type = 'folder' if input_type is None else input_type
         self.paths = []  # for image&folder type
+        self.frame = None  # reused buffer for video streams
         self.audio = None
         self.input_fps = None
         if self.input_type.startswith('video'):
             video_path = get_sub_video(args, total_workers, worker_idx)
-            self.stream_reader = (
+            self.stream_reader = FFmpegProcess(
                 ffmpeg.input(video_path).output('pipe:', format='rawvideo', pix_fmt='bgr24',
-                                                loglevel='error').run_async(
-                                                    pipe_stdin=True, pipe_stdout=True, cmd=args.ffmpeg_bin))
+                                                loglevel='error').compile(cmd=args.ffmpeg_bin),
+                pipe_stdout=True)
             meta = get_video_meta_info(video_path)
             self.width = meta['width']
             self.height = meta['height']
@@ -109,11 +112,15 @@ class Reader:
         return self.nb_frames
 
     def get_frame_from_stream(self):
-        img_bytes = self.stream_reader.stdout.read(self.width * self.height * 3)  # 3 bytes for one pixel
-        if not img_bytes:
+        """Read the next frame into a reused buffer.
+
+        The returned array is overwritten by the next call, so copy it if it has to outlive the current frame.
+        """
+        if self.frame is None:
+            self.frame = np.empty((self.height, self.width, 3), dtype=np.uint8)  # 3 bytes for one pixel
+        if not read_frame_into(self.stream_reader.stdout, self.frame):
             return None
-        img = np.frombuffer(img_bytes, np.uint8).reshape([self.height, self.width, 3])
-        return img
+        return self.frame
 
     def get_frame_from_list(self):
         if self.idx >= self.nb_frames:
@@ -130,8 +137,35 @@ class Reader:
 
     def close(self):
         if self.input_type.startswith('video'):
-            self.stream_reader.stdin.close()
-            self.stream_reader.wait()
+            returncode = self.stream_reader.close()
+            if returncode != 0:
+                raise RuntimeError(f'ffmpeg reader exited with {returncode}:\n{self.stream_reader.stderr_tail()}')
+
+
+# Encoder profiles for the Writer. Explicit --vcodec/--preset/--crf/... arguments override the profile values.
+#   default:      ffmpeg's own libx264 defaults (CRF 23, preset medium), as before profiles existed.
+#   archival:     final-quality chunks, same settings as the RIFE reassembly encode in video_upscale_pipeline.py.
+#   intermediate: fast lossless encode for chunks that are decoded again (e.g. to PNG frames for RIFE).
+ENCODER_PROFILES = {
+    'default': dict(vcodec='libx264', pix_fmt='yuv420p'),
+    'archival': dict(vcodec='libx264', pix_fmt='yuv420p', preset='fast', crf=14),
+    'intermediate': dict(vcodec='libx264', pix_fmt='yuv444p', preset='ultrafast', qp=0),
+}
+
+
+def get_encoder_options(args):
+    """Resolve the ffmpeg output options of the Writer from the encoder profile and explicit overrides."""
+    profile = getattr(args, 'encoder_profile', 'default')
+    options = dict(ENCODER_PROFILES[profile])
+    for key in ['vcodec', 'pix_fmt', 'preset', 'crf', 'qp']:
+        value = getattr(args, key, None)
+        if value is not None:
+            options[key] = value
+    if getattr(args, 'encoder_threads', None) is not None:
+        options['threads'] = args.encoder_threads
+    if getattr(args, 'x264_params', None) is not None:
+        options['x264-params'] = args.x264_params
+    return options
 
 
 class Writer:
@@ -142,32 +176,40 @@ class Writer:
             print('You are generating video that is larger than 4K, which will be very slow due to IO speed.',
                   'We highly recommend to decrease the outscale(aka, -s).')
 
+        self.profile = getattr(args, 'encoder_profile', 'default')
+        encoder_options = get_encoder_options(args)
+        print(f'Encoder profile {self.profile}: {encoder_options}')
+
+        video_input = ffmpeg.input('pipe:', format='rawvideo', pix_fmt='bgr24', s=f'{out_width}x{out_height}',
+                                   framerate=fps)
         if audio is not None:
-            self.stream_writer = (
-                ffmpeg.input('pipe:', format='rawvideo', pix_fmt='bgr24', s=f'{out_width}x{out_height}',
-                             framerate=fps).output(
-                                 audio,
-                                 video_save_path,
-                                 pix_fmt='yuv420p',
-                                 vcodec='libx264',
-                                 loglevel='error',
-                                 acodec='copy').overwrite_output().run_async(
-                                     pipe_stdin=True, pipe_stdout=True, cmd=args.ffmpeg_bin))
+            stream = video_input.output(audio, video_save_path, loglevel='error', acodec='copy', **encoder_options)
         else:
-            self.stream_writer = (
-                ffmpeg.input('pipe:', format='rawvideo', pix_fmt='bgr24', s=f'{out_width}x{out_height}',
-                             framerate=fps).output(
-                                 video_save_path, pix_fmt='yuv420p', vcodec='libx264',
-                                 loglevel='error').overwrite_output().run_async(
-                                     pipe_stdin=True, pipe_stdout=True, cmd=args.ffmpeg_bin))
+            stream = video_input.output(video_save_path, loglevel='error', **encoder_options)
+        self.stream_writer = FFmpegProcess(stream.overwrite_output().compile(cmd=args.ffmpeg_bin), pipe_stdin=True)
+
+        # encoder throughput: time blocked on the encoder pipe, and wall time from the first frame to the end
+        self.num_frames = 0
+        self.write_time = 0
+        self.start_time = None
 
     def write_frame(self, frame):
-        frame = frame.astype(np.uint8).tobytes()
-        self.stream_writer.stdin.write(frame)
+        if self.start_time is None:
+            self.start_time = time.time()
+        start = time.time()
+        write_frame(self.stream_writer.stdin, frame)
+        self.write_time += time.time() - start
+        self.num_frames += 1
 
     def close(self):
-        self.stream_writer.stdin.close()
-        self.stream_writer.wait()
+        returncode = self.stream_writer.close()
+        if returncode != 0:
+            raise RuntimeError(f'ffmpeg writer exited with {returncode}:\n{self.stream_writer.stderr_tail()}')
+        if self.start_time is not None:
+            total_time = time.time() - self.start_time
+            print(f'Encoder profile {self.profile}: {self.num_frames} frames in {total_time:.2f}s '
+                  f'({self.num_frames / max(total_time, 1e-6):.2f} fps), '
+                  f'{self.write_time:.2f}s blocked on the encoder pipe.')
 
 
 def inference_video(args, video_save_path, device=None, total_workers=1, worker_idx=0):
@@ -225,6 +267,7 @@ def inference_video(args, video_save_path, device=None, total_workers=1, worker_
         model=model,
         tile=args.tile,
         tile_pad=args.tile_pad,
+        tile_blend=args.tile_blend,
         pre_pad=args.pre_pad,
         half=not args.fp32,
         device=device,
@@ -250,7 +293,12 @@ def inference_video(args, video_save_path, device=None, total_workers=1, worker_
     audio = reader.get_audio()
     height, width = reader.get_resolution()
     fps = reader.get_fps()
-    writer = Writer(args, audio, height, width, video_save_path, fps)
+    if args.interpolate != 'none':
+        interpolator = build_interpolator(args.interpolate, fps=fps, ffmpeg_bin=args.ffmpeg_bin)
+        writer = Writer(args, audio, height, width, video_save_path, fps * 2)
+    else:
+        interpolator = None
+        writer = Writer(args, audio, height, width, video_save_path, fps)
 
     pbar = tqdm(total=len(reader), unit='frame', desc='inference')
     while True:
@@ -267,11 +315,18 @@ def inference_video(args, video_save_path, device=None, total_workers=1, worker_
             print('Error', error)
             print('If you encounter CUDA out of memory, try to set --tile with a smaller number.')
         else:
-            writer.write_frame(output)
+            if interpolator is None:
+                writer.write_frame(output)
+            else:
+                for frame in interpolator.push(output):
+                    writer.write_frame(frame)
 
         torch.cuda.synchronize(device)
         pbar.update(1)
 
+    if interpolator is not None:
+        for frame in interpolator.flush(drop_last=args.interpolate_drop_last):
+            writer.write_frame(frame)
     reader.close()
     writer.close()
 
@@ -283,7 +338,10 @@ def run(args):
     if args.extract_frame_first:
         tmp_frames_folder = osp.join(args.output, f'{args.video_name}_inp_tmp_frames')
         os.makedirs(tmp_frames_folder, exist_ok=True)
-        os.system(f'ffmpeg -i {args.input} -qscale:v 1 -qmin 1 -qmax 1 -vsync 0  {tmp_frames_folder}/frame%08d.png')
+        run_ffmpeg([
+            args.ffmpeg_bin, '-i', args.input, '-qscale:v', '1', '-qmin', '1', '-qmax', '1', '-vsync', '0',
+            f'{tmp_frames_folder}/frame%08d.png'
+        ])
         args.input = tmp_frames_folder
 
     num_gpus = torch.cuda.device_count()
@@ -291,6 +349,10 @@ def run(args):
     if num_process == 1:
         inference_video(args, video_save_path)
         return
+    if args.interpolate != 'none':
+        # a part does not see the first frame of the next one, so every seam would get a repeated frame
+        raise ValueError(f'--interpolate needs a single process, but got {num_process} '
+                         '(number of GPUs x --num_process_per_gpu).')
 
     ctx = torch.multiprocessing.get_context('spawn')
     pool = ctx.Pool(num_process)
@@ -316,7 +378,7 @@ def run(args):
         'copy', f'{video_save_path}'
     ]
     print(' '.join(cmd))
-    subprocess.call(cmd)
+    run_ffmpeg(cmd)
     shutil.rmtree(osp.join(args.output, f'{args.video_name}_out_tmp_videos'))
     if osp.exists(osp.join(args.output, f'{args.video_name}_inp_tmp_videos')):
         shutil.rmtree(osp.join(args.output, f'{args.video_name}_inp_tmp_videos'))
@@ -350,14 +412,45 @@ def main():
     parser.add_argument('--suffix', type=str, default='out', help='Suffix of the restored video')
     parser.add_argument('-t', '--tile', type=int, default=0, help='Tile size, 0 for no tile during testing')
     parser.add_argument('--tile_pad', type=int, default=10, help='Tile padding')
+    parser.add_argument(
+        '--tile_blend',
+        type=str,
+        default='none',
+        choices=['none', 'linear', 'cosine'],
+        help='How tiles are merged: none keeps the tile centres, linear | cosine feather the tile_pad overlap')
     parser.add_argument('--pre_pad', type=int, default=0, help='Pre padding size at each border')
     parser.add_argument('--face_enhance', action='store_true', help='Use GFPGAN to enhance face')
     parser.add_argument(
         '--fp32', action='store_true', help='Use fp32 precision during inference. Default: fp16 (half precision).')
     parser.add_argument('--fps', type=float, default=None, help='FPS of the output video')
     parser.add_argument('--ffmpeg_bin', type=str, default='ffmpeg', help='The path to ffmpeg')
+    parser.add_argument(
+        '--encoder_profile',
+        type=str,
+        default='default',
+        choices=list(ENCODER_PROFILES.keys()),
+        help='Encoder profile of the output video. Options: default | archival | intermediate. Default: default')
+    parser.add_argument('--vcodec', type=str, default=None, help='[Option] Override the video codec of the profile')
+    parser.add_argument('--preset', type=str, default=None, help='[Option] Override the encoder preset')
+    parser.add_argument('--crf', type=int, default=None, help='[Option] Override the CRF of the profile')
+    parser.add_argument('--qp', type=int, default=None, help='[Option] Override the constant QP of the profile')
+    parser.add_argument('--pix_fmt', type=str, default=None, help='[Option] Override the output pixel format')
+    parser.add_argument('--encoder_threads', type=int, default=None, help='[Option] Encoder thread number')
+    parser.add_argument('--x264_params', type=str, default=None, help='[Option] Extra x264 params, e.g. "ref=1"')
     parser.add_argument('--extract_frame_first', action='store_true')
     parser.add_argument('--num_process_per_gpu', type=int, default=1)
+    parser.add_argument(
+        '--interpolate',
+        type=str,
+        default='none',
+        choices=['none'] + list(INTERPOLATORS.keys()),
+        help='Double the frame rate of the output with an in-process interpolation stage, in a single process. '
+        'Options: none | blend | flow (motion-compensated, CPU) | minterpolate (ffmpeg, streamed through pipes)')
+    parser.add_argument(
+        '--interpolate_drop_last',
+        action='store_true',
+        help='The last input frame is only context for the interpolation (e.g. the first frame of the next chunk) '
+        'and is not written')
 
     parser.add_argument(
         '--alpha_upsampler',
@@ -381,7 +474,7 @@ def main():
 
     if is_video and args.input.endswith('.flv'):
         mp4_path = args.input.replace('.flv', '.mp4')
-        os.system(f'ffmpeg -i {args.input} -codec copy {mp4_path}')
+        run_ffmpeg([args.ffmpeg_bin, '-i', args.input, '-codec', 'copy', mp4_path])
         args.input = mp4_path
 
     if args.extract_frame_first and not is_video:
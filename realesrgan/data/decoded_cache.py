@@ -0,0 +1,95 @@
+import hashlib
+import numpy as np
+import os
+
+
+class DecodedImageCache():
+    """A cache of decoded images, shared by the data loader workers through the file system.
+
+    Every image is stored as a .npy file in ``cache_dir`` (named after the hash of its key) and memory-mapped when it
+    is read again, so it is decoded once per run, by whichever worker reads it first. Put ``cache_dir`` on a tmpfs
+    such as /dev/shm to keep the cache in shared memory. Files are written under a temporary name and renamed, so
+    concurrent workers never see a partial file.
+
+    With ``max_bytes``, the least recently used images are evicted when a worker sees that the cache has grown over
+    the budget. Each worker only counts its own writes between two scans of the folder, so the budget may be exceeded
+    by the writes of the other workers in the meantime.
+
+    The cache persists across runs and only knows the images by their keys: a key must change with its image (e.g.
+    include the file size and mtime), or the folder must be cleared when the data changes.
+
+    Args:
+        cache_dir (str): Folder of the cache. It is created if it does not exist.
+        max_bytes (int): Size budget of the cache in bytes. Default: None (unlimited).
+    """
+
+    def __init__(self, cache_dir, max_bytes=None):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.num_bytes = None  # estimated size of the cache, counted on the first write
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npy')
+
+    def get(self, key, decode):
+        """Returns the image of ``key``, read from the cache or decoded with ``decode()`` and cached.
+
+        Args:
+            key (str): Key of the image, e.g. its path.
+            decode (callable): Decodes the image, returning an ndarray.
+
+        Returns:
+            ndarray: The image, read-only memory-mapped when it comes from the cache.
+        """
+        path = self._path(key)
+        try:
+            img = np.load(path, mmap_mode='r')
+        except FileNotFoundError:
+            img = decode()
+            self._put(path, img)
+            return img
+        if self.max_bytes is not None:
+            try:
+                os.utime(path)  # mark as recently used
+            except FileNotFoundError:  # evicted by another worker, but the image is already memory-mapped
+                pass
+        return img
+
+    def _put(self, path, img):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, img)
+        os.replace(tmp_path, path)
+        if self.max_bytes is None:
+            return
+        if self.num_bytes is None:
+            self.num_bytes = self._scan()[1]
+        else:
+            self.num_bytes += os.path.getsize(path)
+        if self.num_bytes > self.max_bytes:
+            self._evict()
+
+    def _scan(self):
+        """Returns the (mtime, size, path) of the cached files, and their total size."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.npy'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # evicted by another worker
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries, sum(size for _, size, _ in entries)
+
+    def _evict(self):
+        """Delete the least recently used files until the cache is within 90% of the budget."""
+        entries, self.num_bytes = self._scan()
+        for _, size, path in sorted(entries):
+            if self.num_bytes <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.num_bytes -= size
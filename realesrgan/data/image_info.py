@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+
+def read_image_size(path, full_check=False):
+    """Returns the size of an image, reading only its header.
+
+    Args:
+        path (str): Image path. .npy arrays are supported too.
+        full_check (bool): Decode the whole image with cv2, as the data loaders do, which also catches truncated or
+            corrupted image data. Default: False.
+
+    Returns:
+        tuple | None: (height, width), or None if the image cannot be read.
+    """
+    try:
+        if full_check:
+            img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+            return None if img is None else tuple(img.shape[:2])
+        if os.path.splitext(path)[1].lower() == '.npy':
+            return tuple(np.load(path, mmap_mode='r').shape[:2])
+        with Image.open(path) as img:
+            width, height = img.size
+        return height, width
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+
+class ImageInfoCache():
+    """SQLite cache of image sizes, so that regenerating the meta information of a large dataset only reads the
+    images that are new or changed.
+
+    One row per image: its absolute path, file size, mtime, whether it was fully decoded, and its height and width
+    (NULL when it could not be read). A row is valid while the file size and mtime match. The rows are loaded in
+    memory when the cache is opened, and the new ones are written by :meth:`close`.
+
+    Args:
+        db_path (str): Path to the SQLite file. It is created if it does not exist.
+    """
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS images ('
+                          'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, full_check INTEGER, height INTEGER, '
+                          'width INTEGER)')
+        self.rows = {row[0]: row[1:] for row in self.conn.execute('SELECT * FROM images')}
+        self.updates = []
+
+    def get(self, path, stat, full_check):
+        """Returns the cached size of ``path`` (None if it could not be read), or False if it must be read again."""
+        row = self.rows.get(path)
+        if row is None:
+            return False
+        size, mtime_ns, row_full_check, height, width = row
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            return False
+        # a header read does not prove that the image data can be decoded
+        if full_check and not row_full_check:
+            return False
+        return None if height is None else (height, width)
+
+    def put(self, path, stat, full_check, img_size):
+        height, width = (None, None) if img_size is None else img_size
+        row = (stat.st_size, stat.st_mtime_ns, int(full_check), height, width)
+        self.rows[path] = row
+        self.updates.append((path, ) + row)
+
+    def close(self):
+        self.conn.executemany('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)', self.updates)
+        self.conn.commit()
+        self.conn.close()
+        self.updates = []
+
+
+def scan_image_sizes(paths, num_threads=16, cache=None, full_check=False, callback=None, chunk_size=10000):
+    """Read the sizes of images with a thread pool, skipping the images whose size is in the cache.
+
+    Args:
+        paths (list[str]): Image paths.
+        num_threads (int): Number of threads. Default: 16.
+        cache (ImageInfoCache): Cache of the sizes, updated with the images that are read. Default: None.
+        full_check (bool): Decode the whole images, see :func:`read_image_size`. Default: False.
+        callback (callable): Called after each image, e.g. to update a progress bar. Default: None.
+        chunk_size (int): Number of images submitted to the thread pool at a time. Default: 10000.
+
+    Returns:
+        list: (height, width) of each image, or None for the images that cannot be read, in the order of ``paths``.
+    """
+
+    def worker(path):
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None, None, None
+        img_size = False if cache is None else cache.get(path, stat, full_check)
+        if img_size is not False:
+            return img_size, None, None
+        return read_image_size(path, full_check), path, stat
+
+    img_sizes = []
+    with ThreadPoolExecutor(num_threads) as executor:
+        # in chunks, so that a million paths do not make a million pending futures
+        for start in range(0, len(paths), chunk_size):
+            # the cache is only updated from this thread
+            for img_size, path, stat in executor.map(worker, paths[start:start + chunk_size]):
+                if cache is not None and stat is not None:
+                    cache.put(path, stat, full_check, img_size)
+                img_sizes.append(img_size)
+                if callback is not None:
+                    callback()
+    return img_sizes
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import math
+import numpy as np
+import os
+import random
+from basicsr.data.degradations import circular_lowpass_kernel, random_mixed_kernels
+from basicsr.utils import get_root_logger
+
+
+def random_blur_kernel(kernel_list, kernel_prob, blur_sigma, betag_range, betap_range, kernel_range, sinc=False):
+    """Generate one random blur kernel of the Real-ESRGAN degradations, padded to the largest kernel size.
+
+    Args:
+        kernel_list (list[str]): Kernel types of ``random_mixed_kernels``.
+        kernel_prob (list[float]): Probability of each kernel type.
+        blur_sigma (list[float]): Range of the Gaussian sigma.
+        betag_range (list[float]): Range of beta for generalized Gaussian kernels.
+        betap_range (list[float]): Range of beta for plateau kernels.
+        kernel_range (list[int]): Odd kernel sizes to choose from, e.g. 7 to 21.
+        sinc (bool): Generate a sinc (circular low-pass) kernel instead. Default: False.
+
+    Returns:
+        ndarray: float32 kernel of shape (max(kernel_range), max(kernel_range)).
+    """
+    kernel_size = random.choice(kernel_range)
+    if sinc:
+        # this sinc filter setting is for kernels ranging from [7, 21]
+        if kernel_size < 13:
+            omega_c = np.random.uniform(np.pi / 3, np.pi)
+        else:
+            omega_c = np.random.uniform(np.pi / 5, np.pi)
+        kernel = circular_lowpass_kernel(omega_c, kernel_size, pad_to=False)
+    else:
+        kernel = random_mixed_kernels(
+            kernel_list,
+            kernel_prob,
+            kernel_size,
+            blur_sigma,
+            blur_sigma, [-math.pi, math.pi],
+            betag_range,
+            betap_range,
+            noise_range=None)
+    # pad kernel
+    pad_size = (max(kernel_range) - kernel_size) // 2
+    return np.pad(kernel, ((pad_size, pad_size), (pad_size, pad_size))).astype(np.float32)
+
+
+def random_final_sinc_kernel(kernel_range):
+    """Generate the final sinc kernel of the Real-ESRGAN degradations, padded to the largest kernel size."""
+    kernel_size = random.choice(kernel_range)
+    omega_c = np.random.uniform(np.pi / 3, np.pi)
+    return circular_lowpass_kernel(omega_c, kernel_size, pad_to=max(kernel_range)).astype(np.float32)
+
+
+class KernelBank():
+    """Pools of precomputed degradation kernels, so that samples draw a kernel instead of generating one.
+
+    Every pool holds ``size`` kernels generated by :func:`random_blur_kernel` / :func:`random_final_sinc_kernel`
+    with the settings of one degradation stage, so a uniformly drawn kernel follows the same distribution as an
+    on-the-fly one (the sizes and kernel types are mixed in the pool in their sampling proportions). The sinc
+    probabilities are still decided per sample.
+
+    The pools are saved to ``cache_path`` (.npz) together with a hash of the settings, and loaded from it when the
+    settings match.
+
+    Args:
+        stages (dict): Blur settings per stage name, each a dict of the keyword arguments of
+            :func:`random_blur_kernel` except ``kernel_range`` and ``sinc``.
+        kernel_range (list[int]): Odd kernel sizes to choose from.
+        size (int): Number of kernels per pool. Default: 4096.
+        cache_path (str): Path of the .npz cache. Default: None (no cache).
+    """
+
+    def __init__(self, stages, kernel_range, size=4096, cache_path=None):
+        self.kernel_range = list(kernel_range)
+        self.size = size
+        settings = json.dumps({'stages': stages, 'kernel_range': self.kernel_range, 'size': size}, sort_keys=True)
+        self.settings_hash = hashlib.sha256(settings.encode()).hexdigest()
+
+        self.pools = None
+        if cache_path is not None and os.path.isfile(cache_path):
+            with np.load(cache_path) as cache:
+                if str(cache['settings_hash']) == self.settings_hash:
+                    self.pools = {key: cache[key] for key in cache.files if key != 'settings_hash'}
+        logger = get_root_logger()
+        if self.pools is not None:
+            logger.info(f'Loaded the degradation kernel bank from {cache_path}.')
+            return
+
+        logger.info(f'Generating the degradation kernel bank ({size} kernels per pool)...')
+        self.pools = {'final_sinc': np.stack([random_final_sinc_kernel(self.kernel_range) for _ in range(size)])}
+        for name, stage in stages.items():
+            for sinc in (False, True):
+                kernels = [random_blur_kernel(kernel_range=self.kernel_range, sinc=sinc, **stage) for _ in range(size)]
+                self.pools[f'{name}_sinc' if sinc else name] = np.stack(kernels)
+        if cache_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            np.savez(cache_path, settings_hash=self.settings_hash, **self.pools)
+            logger.info(f'Saved the degradation kernel bank to {cache_path}.')
+
+    def _draw(self, pool):
+        return self.pools[pool][np.random.randint(self.size)].copy()
+
+    def draw(self, stage, sinc_prob):
+        """Draw a blur kernel of ``stage``, a sinc kernel with probability ``sinc_prob``."""
+        if np.random.uniform() < sinc_prob:
+            return self._draw(f'{stage}_sinc')
+        return self._draw(stage)
+
+    def draw_final_sinc(self):
+        """Draw a final sinc kernel."""
+        return self._draw('final_sinc')
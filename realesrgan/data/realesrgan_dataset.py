@@ -1,17 +1,28 @@
 import cv2
-import math
 import numpy as np
 import os
 import os.path as osp
 import random
 import time
 import torch
-from basicsr.data.degradations import circular_lowpass_kernel, random_mixed_kernels
-from basicsr.data.transforms import augment
 from basicsr.utils import FileClient, get_root_logger, imfrombytes, img2tensor
 from basicsr.utils.registry import DATASET_REGISTRY
 from torch.utils import data as data
 
+from realesrgan.data.kernel_bank import KernelBank, random_blur_kernel, random_final_sinc_kernel
+from realesrgan.large_image import LARGE_IMAGE_EXTENSIONS, open_large_image
+
+
+def flip_rotate(img, hflip, vflip, rot90):
+    """Apply the flips and rotation of basicsr.data.transforms.augment to an image of shape (h, w, c)."""
+    if hflip:
+        img = img[:, ::-1]
+    if vflip:
+        img = img[::-1]
+    if rot90:
+        img = img.transpose(1, 0, 2)
+    return np.ascontiguousarray(img)
+
 
 @DATASET_REGISTRY.register()
 class RealESRGANDataset(data.Dataset):
@@ -19,16 +30,23 @@ class RealESRGANDataset(data.Dataset):
     Real-ESRGAN: Training Real-World Blind Super-Resolution with Pure Synthetic Data.
 
     It loads gt (Ground-Truth) images, and augments them.
+    The crop window is chosen before the image is read: GT images stored as .npy arrays or uncompressed TIFF files
+    (RGB, see :func:`open_large_image`) are memory-mapped, so only the cropped region is read, and other formats
+    are decoded to uint8 and cropped before the conversion to float32.
     It also generates blur kernels and sinc kernels for generating low-quality images.
     Note that the low-quality images are processed in tensors on GPUS for faster processing.
 
     Args:
         opt (dict): Config for train datasets. It contains the following keys:
-            dataroot_gt (str): Data root path for gt.
+            dataroot_gt (str | list[str]): Data root path for gt. For the lmdb backend, a list of databases is read
+                as shards of one dataset, e.g. those written by scripts/extract_subimages.py --lmdb --num_shards.
             meta_info (str): Path for meta information file.
             io_backend (dict): IO backend type and other kwarg.
             use_hflip (bool): Use horizontal flips.
             use_rot (bool): Use rotation (use vertical flip and transposing h and w for implementation).
+            kernel_bank_size (int): Draw the kernels from pools of this many precomputed kernels per stage instead of
+                generating them per sample, see :class:`KernelBank`. 0 generates them per sample. Default: 0.
+            kernel_bank_cache (str): .npz file the kernel bank is saved to and loaded from. Default: None.
             Please see more options in the codes.
     """
 
@@ -37,16 +55,24 @@ class RealESRGANDataset(data.Dataset):
         self.opt = opt
         self.file_client = None
         self.io_backend_opt = opt['io_backend']
+        self.io_backend_type = self.io_backend_opt['type']  # popped from io_backend_opt by the file client
         self.gt_folder = opt['dataroot_gt']
 
         # file client (lmdb io backend)
+        self.client_keys = None
         if self.io_backend_opt['type'] == 'lmdb':
-            self.io_backend_opt['db_paths'] = [self.gt_folder]
-            self.io_backend_opt['client_keys'] = ['gt']
-            if not self.gt_folder.endswith('.lmdb'):
-                raise ValueError(f"'dataroot_gt' should end with '.lmdb', but received {self.gt_folder}")
-            with open(osp.join(self.gt_folder, 'meta_info.txt')) as fin:
-                self.paths = [line.split('.')[0] for line in fin]
+            db_paths = self.gt_folder if isinstance(self.gt_folder, list) else [self.gt_folder]
+            self.io_backend_opt['db_paths'] = db_paths
+            self.io_backend_opt['client_keys'] = ['gt'] + [f'gt_{i}' for i in range(1, len(db_paths))]
+            self.paths = []
+            self.client_keys = []
+            for db_path, client_key in zip(db_paths, self.io_backend_opt['client_keys']):
+                if not db_path.endswith('.lmdb'):
+                    raise ValueError(f"'dataroot_gt' should end with '.lmdb', but received {db_path}")
+                with open(osp.join(db_path, 'meta_info.txt')) as fin:
+                    keys = [line.split('.')[0] for line in fin]
+                self.paths.extend(keys)
+                self.client_keys.extend([client_key] * len(keys))
         else:
             # disk backend with meta_info
             # Each line in the meta_info describes the relative path to an image
@@ -80,18 +106,106 @@ class RealESRGANDataset(data.Dataset):
         self.pulse_tensor = torch.zeros(21, 21).float()  # convolving with pulse tensor brings no blurry effect
         self.pulse_tensor[10, 10] = 1
 
+        self.blur_settings = {
+            'kernel1': {
+                'kernel_list': self.kernel_list,
+                'kernel_prob': self.kernel_prob,
+                'blur_sigma': self.blur_sigma,
+                'betag_range': self.betag_range,
+                'betap_range': self.betap_range
+            },
+            'kernel2': {
+                'kernel_list': self.kernel_list2,
+                'kernel_prob': self.kernel_prob2,
+                'blur_sigma': self.blur_sigma2,
+                'betag_range': self.betag_range2,
+                'betap_range': self.betap_range2
+            }
+        }
+        self.kernel_bank = None
+        if opt.get('kernel_bank_size', 0) > 0:
+            self.kernel_bank = KernelBank(self.blur_settings, self.kernel_range, opt['kernel_bank_size'],
+                                          opt.get('kernel_bank_cache'))
+
+    def random_kernel(self, stage, sinc_prob):
+        """A blur kernel of the first ('kernel1') or second ('kernel2') degradation, a sinc kernel with probability
+        ``sinc_prob``, padded to 21."""
+        if self.kernel_bank is not None:
+            return self.kernel_bank.draw(stage, sinc_prob)
+        sinc = np.random.uniform() < sinc_prob
+        return random_blur_kernel(kernel_range=self.kernel_range, sinc=sinc, **self.blur_settings[stage])
+
+    def read_gt(self, gt_path, client_key):
+        """Read a GT image: memory-mapped for .npy and uncompressed TIFF files on disk, otherwise decoded to uint8.
+
+        Returns:
+            ndarray: uint8 or uint16 image of shape (h, w, 3), channel order BGR, or (h, w, 1) for gray images.
+        """
+        if self.io_backend_type == 'disk' and gt_path.lower().endswith(LARGE_IMAGE_EXTENSIONS):
+            try:
+                img = open_large_image(gt_path)
+            except (ImportError, ValueError):  # tifffile is not installed, or e.g. a compressed TIFF: decoded below
+                pass
+            else:
+                # views of the memory map: RGB(A) to BGR, gray to (h, w, 1)
+                return img[..., None] if img.ndim == 2 else img[..., 2::-1]
+        return imfrombytes(self.file_client.get(gt_path, client_key), float32=False)
+
+    def augment_crop(self, img, crop_pad_size):
+        """Flip / rotate (use_hflip, use_rot), and randomly crop or pad to ``crop_pad_size``.
+
+        Equivalent to augmenting the whole image and then cropping it, with the same random numbers, but only the
+        cropped region of ``img`` is read (and copied) when the image is large enough not to need padding.
+        """
+        # same draws as basicsr.data.transforms.augment
+        hflip = self.opt['use_hflip'] and random.random() < 0.5
+        vflip = self.opt['use_rot'] and random.random() < 0.5
+        rot90 = self.opt['use_rot'] and random.random() < 0.5
+
+        h, w = img.shape[0:2]
+        aug_h, aug_w = (w, h) if rot90 else (h, w)
+        if aug_h < crop_pad_size or aug_w < crop_pad_size:
+            # pad the augmented image
+            img = flip_rotate(np.ascontiguousarray(img), hflip, vflip, rot90)
+            pad_h = max(0, crop_pad_size - aug_h)
+            pad_w = max(0, crop_pad_size - aug_w)
+            img = cv2.copyMakeBorder(img, 0, pad_h, 0, pad_w, cv2.BORDER_REFLECT_101)
+            if img.ndim == 2:  # cv2 drops the channel axis of gray images
+                img = img[..., None]
+            aug_h, aug_w = img.shape[0:2]
+            if aug_h > crop_pad_size or aug_w > crop_pad_size:
+                top = random.randint(0, aug_h - crop_pad_size)
+                left = random.randint(0, aug_w - crop_pad_size)
+                img = img[top:top + crop_pad_size, left:left + crop_pad_size, ...]
+            return img
+
+        top, left = 0, 0
+        if aug_h > crop_pad_size or aug_w > crop_pad_size:
+            # randomly choose top and left coordinates in the augmented image
+            top = random.randint(0, aug_h - crop_pad_size)
+            left = random.randint(0, aug_w - crop_pad_size)
+        # the window in the flipped (not yet rotated) image, then in the original image
+        if rot90:
+            top, left = left, top
+        if vflip:
+            top = h - top - crop_pad_size
+        if hflip:
+            left = w - left - crop_pad_size
+        img = np.ascontiguousarray(img[top:top + crop_pad_size, left:left + crop_pad_size, ...])
+        return flip_rotate(img, hflip, vflip, rot90)
+
     def __getitem__(self, index):
         if self.file_client is None:
             self.file_client = FileClient(self.io_backend_opt.pop('type'), **self.io_backend_opt)
 
         # -------------------------------- Load gt images -------------------------------- #
-        # Shape: (h, w, c); channel order: BGR; image range: [0, 1], float32.
+        # Shape: (h, w, c); channel order: BGR; uint8, or a memory-mapped array to crop from.
         gt_path = self.paths[index]
         # avoid errors caused by high latency in reading files
         retry = 3
         while retry > 0:
             try:
-                img_bytes = self.file_client.get(gt_path, 'gt')
+                img_gt = self.read_gt(gt_path, 'gt' if self.client_keys is None else self.client_keys[index])
             except (IOError, OSError) as e:
                 logger = get_root_logger()
                 logger.warn(f'File client error: {e}, remaining retry times: {retry - 1}')
@@ -103,79 +217,27 @@ class RealESRGANDataset(data.Dataset):
                 break
             finally:
                 retry -= 1
-        img_gt = imfrombytes(img_bytes, float32=True)
 
-        # -------------------- Do augmentation for training: flip, rotation -------------------- #
-        img_gt = augment(img_gt, self.opt['use_hflip'], self.opt['use_rot'])
-
-        # crop or pad to 400
+        # ----------- Do augmentation for training: flip, rotation, and crop or pad to 400 ----------- #
         # TODO: 400 is hard-coded. You may change it accordingly
-        h, w = img_gt.shape[0:2]
-        crop_pad_size = 400
-        # pad
-        if h < crop_pad_size or w < crop_pad_size:
-            pad_h = max(0, crop_pad_size - h)
-            pad_w = max(0, crop_pad_size - w)
-            img_gt = cv2.copyMakeBorder(img_gt, 0, pad_h, 0, pad_w, cv2.BORDER_REFLECT_101)
-        # crop
-        if img_gt.shape[0] > crop_pad_size or img_gt.shape[1] > crop_pad_size:
-            h, w = img_gt.shape[0:2]
-            # randomly choose top and left coordinates
-            top = random.randint(0, h - crop_pad_size)
-            left = random.randint(0, w - crop_pad_size)
-            img_gt = img_gt[top:top + crop_pad_size, left:left + crop_pad_size, ...]
+        img_gt = self.augment_crop(img_gt, 400)
+        if img_gt.shape[2] == 1:
+            img_gt = img_gt.repeat(3, axis=2)
+        # Shape: (h, w, c); channel order: BGR; image range: [0, 1], float32.
+        img_gt = img_gt.astype(np.float32) / np.iinfo(img_gt.dtype).max
 
         # ------------------------ Generate kernels (used in the first degradation) ------------------------ #
-        kernel_size = random.choice(self.kernel_range)
-        if np.random.uniform() < self.opt['sinc_prob']:
-            # this sinc filter setting is for kernels ranging from [7, 21]
-            if kernel_size < 13:
-                omega_c = np.random.uniform(np.pi / 3, np.pi)
-            else:
-                omega_c = np.random.uniform(np.pi / 5, np.pi)
-            kernel = circular_lowpass_kernel(omega_c, kernel_size, pad_to=False)
-        else:
-            kernel = random_mixed_kernels(
-                self.kernel_list,
-                self.kernel_prob,
-                kernel_size,
-                self.blur_sigma,
-                self.blur_sigma, [-math.pi, math.pi],
-                self.betag_range,
-                self.betap_range,
-                noise_range=None)
-        # pad kernel
-        pad_size = (21 - kernel_size) // 2
-        kernel = np.pad(kernel, ((pad_size, pad_size), (pad_size, pad_size)))
+        kernel = self.random_kernel('kernel1', self.opt['sinc_prob'])
 
         # ------------------------ Generate kernels (used in the second degradation) ------------------------ #
-        kernel_size = random.choice(self.kernel_range)
-        if np.random.uniform() < self.opt['sinc_prob2']:
-            if kernel_size < 13:
-                omega_c = np.random.uniform(np.pi / 3, np.pi)
-            else:
-                omega_c = np.random.uniform(np.pi / 5, np.pi)
-            kernel2 = circular_lowpass_kernel(omega_c, kernel_size, pad_to=False)
-        else:
-            kernel2 = random_mixed_kernels(
-                self.kernel_list2,
-                self.kernel_prob2,
-                kernel_size,
-                self.blur_sigma2,
-                self.blur_sigma2, [-math.pi, math.pi],
-                self.betag_range2,
-                self.betap_range2,
-                noise_range=None)
-
-        # pad kernel
-        pad_size = (21 - kernel_size) // 2
-        kernel2 = np.pad(kernel2, ((pad_size, pad_size), (pad_size, pad_size)))
+        kernel2 = self.random_kernel('kernel2', self.opt['sinc_prob2'])
 
         # ------------------------------------- the final sinc kernel ------------------------------------- #
         if np.random.uniform() < self.opt['final_sinc_prob']:
-            kernel_size = random.choice(self.kernel_range)
-            omega_c = np.random.uniform(np.pi / 3, np.pi)
-            sinc_kernel = circular_lowpass_kernel(omega_c, kernel_size, pad_to=21)
+            if self.kernel_bank is not None:
+                sinc_kernel = self.kernel_bank.draw_final_sinc()
+            else:
+                sinc_kernel = random_final_sinc_kernel(self.kernel_range)
             sinc_kernel = torch.FloatTensor(sinc_kernel)
         else:
             sinc_kernel = self.pulse_tensor
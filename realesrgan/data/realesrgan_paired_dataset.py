@@ -1,3 +1,4 @@
+import numpy as np
 import os
 from basicsr.data.data_util import paired_paths_from_folder, paired_paths_from_lmdb
 from basicsr.data.transforms import augment, paired_random_crop
@@ -6,6 +7,8 @@ from basicsr.utils.registry import DATASET_REGISTRY
 from torch.utils import data as data
 from torchvision.transforms.functional import normalize
 
+from realesrgan.data.decoded_cache import DecodedImageCache
+
 
 @DATASET_REGISTRY.register()
 class RealESRGANPairedDataset(data.Dataset):
@@ -33,6 +36,12 @@ class RealESRGANPairedDataset(data.Dataset):
             use_hflip (bool): Use horizontal flips.
             use_rot (bool): Use rotation (use vertical flip and transposing h
                 and w for implementation).
+            decoded_cache_dir (str): Cache the decoded images in this folder (e.g. under /dev/shm), shared by the
+                data loader workers, so that every image is decoded once per run. See :class:`DecodedImageCache`.
+                Images on disk are cached with their file size and mtime; clear the folder when the lmdb databases
+                are rewritten. Default: None (decode on every access).
+            decoded_cache_bytes (int): Size budget of the decoded-image cache in bytes, the least recently used
+                images are evicted beyond it. Default: None (unlimited).
 
             scale (bool): Scale, which will be added automatically.
             phase (str): 'train' or 'val'.
@@ -72,6 +81,28 @@ class RealESRGANPairedDataset(data.Dataset):
             # it will be time-consuming for folders with too many files. It is recommended using an extra meta txt file
             self.paths = paired_paths_from_folder([self.lq_folder, self.gt_folder], ['lq', 'gt'], self.filename_tmpl)
 
+        self.decoded_cache = None
+        if opt.get('decoded_cache_dir') is not None:
+            max_bytes = opt.get('decoded_cache_bytes')
+            max_bytes = None if max_bytes is None else int(max_bytes)
+            self.decoded_cache = DecodedImageCache(opt['decoded_cache_dir'], max_bytes)
+
+    def read_image(self, path, client_key):
+        """Read and decode an image to uint8, through the decoded-image cache if enabled."""
+
+        def decode():
+            return imfrombytes(self.file_client.get(path, client_key), float32=False)
+
+        if self.decoded_cache is None:
+            return decode()
+        # lmdb keys are only unique within their database
+        key = f'{client_key}:{path}'
+        if self.file_client.backend == 'disk':
+            # a changed image gets a new key, instead of its stale decoded image
+            stat = os.stat(path)
+            key = f'{key}:{stat.st_size}:{stat.st_mtime_ns}'
+        return self.decoded_cache.get(key, decode)
+
     def __getitem__(self, index):
         if self.file_client is None:
             self.file_client = FileClient(self.io_backend_opt.pop('type'), **self.io_backend_opt)
@@ -79,22 +110,25 @@ class RealESRGANPairedDataset(data.Dataset):
         scale = self.opt['scale']
 
         # Load gt and lq images. Dimension order: HWC; channel order: BGR;
-        # image range: [0, 1], float32.
+        # image range: [0, 255], uint8. They are converted to float32 after cropping.
         gt_path = self.paths[index]['gt_path']
-        img_bytes = self.file_client.get(gt_path, 'gt')
-        img_gt = imfrombytes(img_bytes, float32=True)
+        img_gt = self.read_image(gt_path, 'gt')
         lq_path = self.paths[index]['lq_path']
-        img_bytes = self.file_client.get(lq_path, 'lq')
-        img_lq = imfrombytes(img_bytes, float32=True)
+        img_lq = self.read_image(lq_path, 'lq')
 
         # augmentation for training
         if self.opt['phase'] == 'train':
             gt_size = self.opt['gt_size']
             # random crop
             img_gt, img_lq = paired_random_crop(img_gt, img_lq, gt_size, scale, gt_path)
+            # copy the patches, cached images are read-only and augment flips in place
+            img_gt, img_lq = img_gt.copy(), img_lq.copy()
             # flip, rotation
             img_gt, img_lq = augment([img_gt, img_lq], self.opt['use_hflip'], self.opt['use_rot'])
 
+        # image range: [0, 1], float32
+        img_gt = img_gt.astype(np.float32) / 255.
+        img_lq = img_lq.astype(np.float32) / 255.
         # BGR to RGB, HWC to CHW, numpy to tensor
         img_gt, img_lq = img2tensor([img_gt, img_lq], bgr2rgb=True, float32=True)
         # normalize
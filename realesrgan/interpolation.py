@@ -0,0 +1,211 @@
+import cv2
+import numpy as np
+import queue
+import threading
+
+from realesrgan.video_io import FFmpegProcess, read_frame_into, write_frame
+
+
+class FrameInterpolator():
+    """Base class of the frame interpolation stages, which double the frame rate of a stream of frames.
+
+    Frames are pushed one at a time in display order, and every call returns the output frames that are ready,
+    so an interpolator can sit directly in a frame loop between the upsampler and the writer. N input frames give
+    2N output frames: each input frame followed by the frame halfway to its successor. The last input frame has
+    no successor and is repeated, unless ``flush(drop_last=True)`` is used because the last frame is only context
+    (e.g. the first frame of the next chunk) and must not be output itself.
+
+    All frames are uint8 BGR arrays of shape (h, w, 3).
+    """
+
+    def push(self, frame):
+        """Add the next input frame.
+
+        Returns:
+            list[ndarray]: Output frames that are ready, in display order.
+        """
+        raise NotImplementedError
+
+    def flush(self, drop_last=False):
+        """Signal the end of the input.
+
+        Args:
+            drop_last (bool): Do not output the last input frame (and the frame after it). Default: False.
+
+        Returns:
+            list[ndarray]: The remaining output frames.
+        """
+        raise NotImplementedError
+
+
+class PairInterpolator(FrameInterpolator):
+    """Frame interpolator that synthesizes the middle frame of each pair of neighbouring frames.
+
+    Subclasses implement :meth:`interpolate`.
+    """
+
+    def __init__(self):
+        self.prev = None
+
+    def interpolate(self, frame0, frame1):
+        """Returns the frame halfway between frame0 and frame1."""
+        raise NotImplementedError
+
+    def push(self, frame):
+        prev, self.prev = self.prev, frame
+        if prev is None:
+            return []
+        return [prev, self.interpolate(prev, frame)]
+
+    def flush(self, drop_last=False):
+        last, self.prev = self.prev, None
+        if last is None or drop_last:
+            return []
+        return [last, last]
+
+
+class BlendInterpolator(PairInterpolator):
+    """Averages the two neighbouring frames. Cheapest option, but moving edges are doubled."""
+
+    def interpolate(self, frame0, frame1):
+        return cv2.addWeighted(frame0, 0.5, frame1, 0.5, 0)
+
+
+class FlowInterpolator(PairInterpolator):
+    """Motion-compensated blending with dense optical flow (Farneback), CPU only.
+
+    The flow from frame0 to frame1 is estimated on a downscaled grayscale copy, both frames are warped half way
+    along it, and the warped frames are averaged.
+
+    Args:
+        flow_width (int): Width at which the flow is estimated. Larger is slower but follows finer motion.
+            Default: 960.
+    """
+
+    def __init__(self, flow_width=960):
+        super(FlowInterpolator, self).__init__()
+        self.flow_width = flow_width
+        self.grid = None
+
+    def interpolate(self, frame0, frame1):
+        h, w = frame0.shape[:2]
+        scale = min(1.0, self.flow_width / w)
+        gray0 = cv2.cvtColor(frame0, cv2.COLOR_BGR2GRAY)
+        gray1 = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
+        if scale < 1:
+            size = (round(w * scale), round(h * scale))
+            gray0 = cv2.resize(gray0, size, interpolation=cv2.INTER_AREA)
+            gray1 = cv2.resize(gray1, size, interpolation=cv2.INTER_AREA)
+        flow = cv2.calcOpticalFlowFarneback(gray0, gray1, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+        if scale < 1:
+            flow = cv2.resize(flow, (w, h), interpolation=cv2.INTER_LINEAR) / scale
+
+        if self.grid is None or self.grid.shape[:2] != (h, w):
+            grid_x, grid_y = np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32))
+            self.grid = np.stack([grid_x, grid_y], axis=-1)
+        half_flow = 0.5 * flow
+        map0 = self.grid - half_flow
+        map1 = self.grid + half_flow
+        warped0 = cv2.remap(frame0, map0[..., 0], map0[..., 1], cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        warped1 = cv2.remap(frame1, map1[..., 0], map1[..., 1], cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        return cv2.addWeighted(warped0, 0.5, warped1, 0.5, 0)
+
+
+class MinterpolateInterpolator(FrameInterpolator):
+    """Streams the frames through ffmpeg's ``minterpolate`` filter.
+
+    ffmpeg is started on the first frame with rawvideo on both pipes; a thread reads the output frames, so
+    :meth:`push` never blocks on the output pipe. The number of output frames is made exactly 2N (or 2N - 2 with
+    ``drop_last``), so that the result lines up with the other interpolators.
+
+    Args:
+        fps (float): Frame rate of the input frames.
+        mi_mode (str): minterpolate mode. Options: mci (motion compensated) | blend | dup. Default: mci.
+        ffmpeg_bin (str): The path to ffmpeg. Default: ffmpeg.
+    """
+
+    def __init__(self, fps, mi_mode='mci', ffmpeg_bin='ffmpeg'):
+        self.fps = fps
+        self.mi_mode = mi_mode
+        self.ffmpeg_bin = ffmpeg_bin
+        self.process = None
+        self.outputs = queue.Queue()
+        self.num_in = 0
+        self.num_out = 0
+        self.last = None
+
+    def _start(self, frame):
+        h, w = frame.shape[:2]
+        cmd = [
+            self.ffmpeg_bin, '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{w}x{h}',
+            '-framerate',
+            str(self.fps), '-i', 'pipe:', '-vf', f'minterpolate=fps={2 * self.fps}:mi_mode={self.mi_mode}', '-f',
+            'rawvideo', '-pix_fmt', 'bgr24', 'pipe:'
+        ]
+        self.process = FFmpegProcess(cmd, pipe_stdin=True, pipe_stdout=True)
+        self.reader = threading.Thread(target=self._read, args=(frame.shape, ), daemon=True)
+        self.reader.start()
+
+    def _read(self, shape):
+        while True:
+            frame = np.empty(shape, dtype=np.uint8)
+            if not read_frame_into(self.process.stdout, frame):
+                break
+            self.outputs.put(frame)
+
+    def _ready(self, limit):
+        frames = []
+        while self.num_out < limit:
+            try:
+                frames.append(self.outputs.get_nowait())
+            except queue.Empty:
+                break
+            self.num_out += 1
+        return frames
+
+    def push(self, frame):
+        if self.process is None:
+            self._start(frame)
+        write_frame(self.process.stdin, frame)
+        self.num_in += 1
+        self.last = frame
+        return self._ready(2 * self.num_in)
+
+    def flush(self, drop_last=False):
+        if self.process is None:
+            return []
+        returncode = self.process.close()
+        self.reader.join()
+        if returncode != 0:
+            raise RuntimeError(f'ffmpeg minterpolate exited with {returncode}:\n{self.process.stderr_tail()}')
+        num_total = 2 * (self.num_in - 1) if drop_last else 2 * self.num_in
+        frames = self._ready(num_total)
+        # minterpolate may stop one frame short at the end of the stream
+        frames += [self.last] * (num_total - self.num_out)
+        self.num_out = num_total
+        return frames
+
+
+INTERPOLATORS = {
+    'blend': BlendInterpolator,
+    'flow': FlowInterpolator,
+    'minterpolate': MinterpolateInterpolator,
+}
+
+
+def build_interpolator(name, fps=None, ffmpeg_bin='ffmpeg'):
+    """Create an interpolation stage by name.
+
+    Args:
+        name (str): One of ``INTERPOLATORS``: blend | flow | minterpolate.
+        fps (float): Frame rate of the input frames, needed by minterpolate.
+        ffmpeg_bin (str): The path to ffmpeg, used by minterpolate. Default: ffmpeg.
+
+    Returns:
+        FrameInterpolator: The interpolation stage.
+    """
+    if name not in INTERPOLATORS:
+        raise ValueError(f'Unknown interpolator {name}. Options: {" | ".join(INTERPOLATORS.keys())}')
+    if name == 'minterpolate':
+        return MinterpolateInterpolator(fps, ffmpeg_bin=ffmpeg_bin)
+    return INTERPOLATORS[name]()
@@ -0,0 +1,57 @@
+import numpy as np
+import os
+
+# formats that can be memory-mapped: uncompressed TIFF and raw arrays in .npy files
+LARGE_IMAGE_EXTENSIONS = ('.tif', '.tiff', '.npy')
+
+
+def _import_tifffile():
+    try:
+        import tifffile
+    except ImportError:
+        raise ImportError('Large-image mode needs tifffile for TIFF files: pip install tifffile')
+    return tifffile
+
+
+def open_large_image(path):
+    """Memory-map an image for reading, so that only the tiles that are accessed are loaded.
+
+    Args:
+        path (str): An uncompressed, contiguous TIFF (e.g. a scanner export), or a .npy array of shape (h, w, 3) in
+            RGB order or (h, w).
+
+    Returns:
+        ndarray: A read-only memory-mapped array of shape (h, w, 3) or (h, w).
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        return np.load(path, mmap_mode='r')
+    if extension in ('.tif', '.tiff'):
+        tifffile = _import_tifffile()
+        try:
+            return tifffile.memmap(path, mode='r')
+        except ValueError as error:
+            raise ValueError(f'{path} cannot be memory-mapped ({error}). Large-image mode needs an uncompressed '
+                             'TIFF, e.g. convert it with: tiffcp -c none input.tif output.tif')
+    raise ValueError(f'Unsupported large-image format: {path}. Options: {" | ".join(LARGE_IMAGE_EXTENSIONS)}')
+
+
+def create_large_image(path, shape, dtype):
+    """Create a memory-mapped output image, written tile by tile without holding it in memory.
+
+    Args:
+        path (str): Output path, .tif / .tiff (uncompressed, BigTIFF when needed) or .npy.
+        shape (tuple): (h, w, 3) or (h, w).
+        dtype (np.dtype): uint8 or uint16.
+
+    Returns:
+        ndarray: A writable memory-mapped array. Call ``flush()`` (or delete it) to finish the file.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    if extension in ('.tif', '.tiff'):
+        tifffile = _import_tifffile()
+        photometric = 'rgb' if len(shape) == 3 else 'minisblack'
+        return tifffile.memmap(path, shape=shape, dtype=dtype, photometric=photometric)
+    raise ValueError(f'Unsupported large-image format: {path}. Options: {" | ".join(LARGE_IMAGE_EXTENSIONS)}')
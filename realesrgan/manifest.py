@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Returns the hex sha256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def params_fingerprint(params):
+    """Returns a short hash of the parameters that determine an output image, e.g. model name and outscale.
+
+    Args:
+        params (dict): JSON-serialisable parameters.
+    """
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def in_shard(key, shard_index, num_shards):
+    """Whether ``key`` falls in the hash range of shard ``shard_index`` of ``num_shards``.
+
+    The sha1 of the key is mapped to [0, 2**32) and split into ``num_shards`` equal ranges, so every machine that
+    uses the same key (e.g. the path relative to the input folder) agrees on the assignment.
+    """
+    value = int(hashlib.sha1(key.encode()).hexdigest()[:8], 16)
+    return value * num_shards >> 32 == shard_index
+
+
+class Manifest():
+    """SQLite record of the images of a folder that have been upsampled, for resumable and incremental runs.
+
+    One row per input: its key (path relative to the input folder), size, mtime, sha256, the fingerprint of the
+    parameters it was processed with, and the output path. An input is up to date when its size, mtime and
+    fingerprint match the row and the output exists, which only needs ``os.stat`` calls. When only the mtime
+    changed (e.g. the file was copied), the content hash decides, and the row is refreshed.
+
+    Rows are committed in groups of ``commit_every``, so a crash loses at most that many records (those images are
+    simply processed again). :meth:`record` may be called from several threads.
+
+    Args:
+        db_path (str): Path to the SQLite file. It is created if it does not exist.
+        fingerprint (str): Fingerprint of the current parameters, see :func:`params_fingerprint`.
+        commit_every (int): Number of records between commits. Default: 50.
+    """
+
+    def __init__(self, db_path, fingerprint, commit_every=50):
+        self.db_path = db_path
+        self.fingerprint = fingerprint
+        self.commit_every = commit_every
+        self.num_pending = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS images ('
+                          'key TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT, fingerprint TEXT, '
+                          'output_path TEXT, done_at REAL)')
+        self.conn.commit()
+
+    def is_up_to_date(self, key, path):
+        """Whether the input ``path`` (recorded as ``key``) was already processed with the current parameters."""
+        with self.lock:
+            row = self.conn.execute('SELECT size, mtime_ns, sha256, fingerprint, output_path FROM images WHERE key = ?',
+                                    (key, )).fetchone()
+        if row is None:
+            return False
+        size, mtime_ns, sha256, fingerprint, output_path = row
+        stat = os.stat(path)
+        if fingerprint != self.fingerprint or stat.st_size != size or not os.path.exists(output_path):
+            return False
+        if stat.st_mtime_ns == mtime_ns:
+            return True
+        if file_sha256(path) != sha256:
+            return False
+        with self.lock:
+            self.conn.execute('UPDATE images SET mtime_ns = ? WHERE key = ?', (stat.st_mtime_ns, key))
+            self._count_pending()
+        return True
+
+    def record(self, key, path, output_path):
+        """Record that the input ``path`` (as ``key``) was upsampled to ``output_path``."""
+        stat = os.stat(path)
+        sha256 = file_sha256(path)
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (key, stat.st_size, stat.st_mtime_ns, sha256, self.fingerprint, output_path, time.time()))
+            self._count_pending()
+
+    def _count_pending(self):
+        self.num_pending += 1
+        if self.num_pending >= self.commit_every:
+            self.conn.commit()
+            self.num_pending = 0
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,232 @@
+import numpy as np
+import random
+import torch
+from basicsr.data.degradations import (random_add_gaussian_noise_pt, random_add_poisson_noise_pt,
+                                       random_generate_gaussian_noise_pt, random_generate_poisson_noise_pt)
+from basicsr.utils.img_process_util import filter2D
+from collections import defaultdict
+from torch.nn import functional as F
+
+RESIZE_MODES = ['area', 'bilinear', 'bicubic']
+
+
+def random_resize_scale(resize_prob, resize_range):
+    """Draw a resize scale: up in (1, resize_range[1]), down in (resize_range[0], 1) or keep (1).
+
+    Args:
+        resize_prob (list[float]): Probabilities of up, down and keep.
+        resize_range (list[float]): Range of the scale.
+    """
+    updown_type = random.choices(['up', 'down', 'keep'], resize_prob)[0]
+    if updown_type == 'up':
+        return np.random.uniform(1, resize_range[1])
+    if updown_type == 'down':
+        return np.random.uniform(resize_range[0], 1)
+    return 1
+
+
+def second_order_degradation(img, kernel1, kernel2, sinc_kernel, opt, jpeger):
+    """The second-order degradation of Real-ESRGAN, with the random parameters drawn once per batch.
+
+    Every sample has its own blur kernels, noise sigma and JPEG quality, but the resize scales and modes, the noise
+    types, whether the second blur is applied and the order of the final JPEG compression and sinc filter are
+    shared by the whole batch.
+
+    Args:
+        img (Tensor): GT images of shape (b, c, h, w), range [0, 1].
+        kernel1 (Tensor): Blur kernels of the first degradation, shape (b, k, k).
+        kernel2 (Tensor): Blur kernels of the second degradation, shape (b, k, k).
+        sinc_kernel (Tensor): Final sinc kernels, shape (b, k, k).
+        opt (dict): Degradation options, e.g. resize_prob, noise_range and jpeg_range (see the training options).
+        jpeger (DiffJPEG): JPEG compression module.
+
+    Returns:
+        Tensor: LQ images of shape (b, c, h // scale, w // scale), rounded to 8 bits.
+    """
+    ori_h, ori_w = img.size()[2:4]
+
+    # ----------------------- The first degradation process ----------------------- #
+    # blur
+    out = filter2D(img, kernel1)
+    # random resize
+    scale = random_resize_scale(opt['resize_prob'], opt['resize_range'])
+    mode = random.choice(RESIZE_MODES)
+    out = F.interpolate(out, scale_factor=scale, mode=mode)
+    # add noise
+    gray_noise_prob = opt['gray_noise_prob']
+    if np.random.uniform() < opt['gaussian_noise_prob']:
+        out = random_add_gaussian_noise_pt(
+            out, sigma_range=opt['noise_range'], clip=True, rounds=False, gray_prob=gray_noise_prob)
+    else:
+        out = random_add_poisson_noise_pt(
+            out, scale_range=opt['poisson_scale_range'], gray_prob=gray_noise_prob, clip=True, rounds=False)
+    # JPEG compression
+    jpeg_p = out.new_zeros(out.size(0)).uniform_(*opt['jpeg_range'])
+    out = torch.clamp(out, 0, 1)  # clamp to [0, 1], otherwise JPEGer will result in unpleasant artifacts
+    out = jpeger(out, quality=jpeg_p)
+
+    # ----------------------- The second degradation process ----------------------- #
+    # blur
+    if np.random.uniform() < opt['second_blur_prob']:
+        out = filter2D(out, kernel2)
+    # random resize
+    scale = random_resize_scale(opt['resize_prob2'], opt['resize_range2'])
+    mode = random.choice(RESIZE_MODES)
+    out = F.interpolate(out, size=(int(ori_h / opt['scale'] * scale), int(ori_w / opt['scale'] * scale)), mode=mode)
+    # add noise
+    gray_noise_prob = opt['gray_noise_prob2']
+    if np.random.uniform() < opt['gaussian_noise_prob2']:
+        out = random_add_gaussian_noise_pt(
+            out, sigma_range=opt['noise_range2'], clip=True, rounds=False, gray_prob=gray_noise_prob)
+    else:
+        out = random_add_poisson_noise_pt(
+            out, scale_range=opt['poisson_scale_range2'], gray_prob=gray_noise_prob, clip=True, rounds=False)
+
+    # JPEG compression + the final sinc filter
+    # We also need to resize images to desired sizes. We group [resize back + sinc filter] together
+    # as one operation.
+    # We consider two orders:
+    #   1. [resize back + sinc filter] + JPEG compression
+    #   2. JPEG compression + [resize back + sinc filter]
+    # Empirically, we find other combinations (sinc + JPEG + Resize) will introduce twisted lines.
+    if np.random.uniform() < 0.5:
+        # resize back + the final sinc filter
+        mode = random.choice(RESIZE_MODES)
+        out = F.interpolate(out, size=(ori_h // opt['scale'], ori_w // opt['scale']), mode=mode)
+        out = filter2D(out, sinc_kernel)
+        # JPEG compression
+        jpeg_p = out.new_zeros(out.size(0)).uniform_(*opt['jpeg_range2'])
+        out = torch.clamp(out, 0, 1)
+        out = jpeger(out, quality=jpeg_p)
+    else:
+        # JPEG compression
+        jpeg_p = out.new_zeros(out.size(0)).uniform_(*opt['jpeg_range2'])
+        out = torch.clamp(out, 0, 1)
+        out = jpeger(out, quality=jpeg_p)
+        # resize back + the final sinc filter
+        mode = random.choice(RESIZE_MODES)
+        out = F.interpolate(out, size=(ori_h // opt['scale'], ori_w // opt['scale']), mode=mode)
+        out = filter2D(out, sinc_kernel)
+
+    # clamp and round
+    return torch.clamp((out * 255.0).round(), 0, 255) / 255.
+
+
+def resize_per_sample(img, sizes, out_sizes, modes):
+    """Resize every sample of a batch to its own size with its own interpolation mode.
+
+    The samples are stored top-left aligned in a canvas of the largest size, the rest of the canvas replicates their
+    borders, so that the element-wise and block-wise operations between two resizes (noise, JPEG, blur) can still
+    run on the whole batch at once. Samples that share the mode and both sizes are resized in one call.
+
+    Args:
+        img (Tensor): Canvas of shape (b, c, h, w).
+        sizes (list[tuple[int]]): Size (h, w) of every sample in ``img``.
+        out_sizes (list[tuple[int]]): Output size (h, w) of every sample.
+        modes (list[str]): Interpolation mode of every sample.
+
+    Returns:
+        Tensor: Canvas of shape (b, c, max output h, max output w).
+    """
+    groups = defaultdict(list)
+    for idx, key in enumerate(zip(sizes, out_sizes, modes)):
+        groups[key].append(idx)
+    canvas_h = max(h for h, _ in out_sizes)
+    canvas_w = max(w for _, w in out_sizes)
+    out = img.new_empty(img.size(0), img.size(1), canvas_h, canvas_w)
+    for ((h, w), (out_h, out_w), mode), idx in groups.items():
+        resized = F.interpolate(img[idx, :, :h, :w], size=(out_h, out_w), mode=mode)
+        out[idx] = F.pad(resized, (0, canvas_w - out_w, 0, canvas_h - out_h), mode='replicate')
+    return out
+
+
+def add_noise_per_sample(img, gaussian_prob, sigma_range, poisson_scale_range, gray_prob):
+    """Add Gaussian noise to a random subset of the batch (chosen with ``gaussian_prob``) and Poisson noise to the
+    rest. The sigma / scale and gray noise are drawn per sample. The output is clipped to [0, 1]."""
+    gaussian = torch.from_numpy(np.random.uniform(size=img.size(0)) < gaussian_prob).to(img.device)
+    noise = torch.empty_like(img)
+    if gaussian.any():
+        noise[gaussian] = random_generate_gaussian_noise_pt(img[gaussian], sigma_range, gray_prob)
+    if not gaussian.all():
+        noise[~gaussian] = random_generate_poisson_noise_pt(img[~gaussian], poisson_scale_range, gray_prob)
+    return torch.clamp(img + noise, 0, 1)
+
+
+def second_order_degradation_per_sample(img, kernel1, kernel2, sinc_kernel, opt, jpeger):
+    """The second-order degradation of Real-ESRGAN, with every random parameter drawn per sample.
+
+    The resize scales and modes, the noise types, whether the second blur is applied and the order of the final JPEG
+    compression and sinc filter are drawn for every sample, so a batch is as diverse as the samples of a training
+    pair pool. The resizes run per group of samples with the same mode and sizes (see :func:`resize_per_sample`);
+    the blurs, noise and JPEG compression run on the whole batch (or the half of it in one final order).
+
+    Args:
+        img (Tensor): GT images of shape (b, c, h, w), range [0, 1].
+        kernel1 (Tensor): Blur kernels of the first degradation, shape (b, k, k).
+        kernel2 (Tensor): Blur kernels of the second degradation, shape (b, k, k).
+        sinc_kernel (Tensor): Final sinc kernels, shape (b, k, k).
+        opt (dict): Degradation options, e.g. resize_prob, noise_range and jpeg_range (see the training options).
+        jpeger (DiffJPEG): JPEG compression module.
+
+    Returns:
+        Tensor: LQ images of shape (b, c, h // scale, w // scale), rounded to 8 bits.
+    """
+    b = img.size(0)
+    ori_h, ori_w = img.size()[2:4]
+    lq_h, lq_w = ori_h // opt['scale'], ori_w // opt['scale']
+
+    # ----------------------- The first degradation process ----------------------- #
+    # blur
+    out = filter2D(img, kernel1)
+    # random resize
+    sizes = [(ori_h, ori_w)] * b
+    scales = [random_resize_scale(opt['resize_prob'], opt['resize_range']) for _ in range(b)]
+    out_sizes = [(int(ori_h * scale), int(ori_w * scale)) for scale in scales]
+    out = resize_per_sample(out, sizes, out_sizes, [random.choice(RESIZE_MODES) for _ in range(b)])
+    sizes = out_sizes
+    # add noise
+    out = add_noise_per_sample(out, opt['gaussian_noise_prob'], opt['noise_range'], opt['poisson_scale_range'],
+                               opt['gray_noise_prob'])
+    # JPEG compression
+    out = jpeger(out, quality=out.new_zeros(b).uniform_(*opt['jpeg_range']))
+
+    # ----------------------- The second degradation process ----------------------- #
+    # blur
+    blur = np.flatnonzero(np.random.uniform(size=b) < opt['second_blur_prob']).tolist()
+    if blur:
+        out[blur] = filter2D(out[blur], kernel2[blur])
+    # random resize
+    scales = [random_resize_scale(opt['resize_prob2'], opt['resize_range2']) for _ in range(b)]
+    out_sizes = [(int(lq_h * scale), int(lq_w * scale)) for scale in scales]
+    out = resize_per_sample(out, sizes, out_sizes, [random.choice(RESIZE_MODES) for _ in range(b)])
+    sizes = out_sizes
+    # add noise
+    out = add_noise_per_sample(out, opt['gaussian_noise_prob2'], opt['noise_range2'], opt['poisson_scale_range2'],
+                               opt['gray_noise_prob2'])
+
+    # JPEG compression + the final sinc filter, in a random order per sample
+    modes = [random.choice(RESIZE_MODES) for _ in range(b)]
+    sinc_first = np.random.uniform(size=b) < 0.5
+    lq = out.new_empty(b, out.size(1), lq_h, lq_w)
+    for order in (True, False):
+        idx = np.flatnonzero(sinc_first == order).tolist()
+        if not idx:
+            continue
+        part = out[idx]
+        part_sizes = [sizes[i] for i in idx]
+        part_modes = [modes[i] for i in idx]
+        jpeg_p = part.new_zeros(len(idx)).uniform_(*opt['jpeg_range2'])
+        if order:
+            # resize back + the final sinc filter + JPEG compression
+            part = resize_per_sample(part, part_sizes, [(lq_h, lq_w)] * len(idx), part_modes)
+            part = filter2D(part, sinc_kernel[idx])
+            part = jpeger(torch.clamp(part, 0, 1), quality=jpeg_p)
+        else:
+            # JPEG compression + resize back + the final sinc filter
+            part = jpeger(part, quality=jpeg_p)
+            part = resize_per_sample(part, part_sizes, [(lq_h, lq_w)] * len(idx), part_modes)
+            part = filter2D(part, sinc_kernel[idx])
+        lq[idx] = part
+
+    # clamp and round
+    return torch.clamp((lq * 255.0).round(), 0, 255) / 255.
@@ -0,0 +1,40 @@
+import torch
+
+PRECISIONS = {'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+
+class MixedPrecision():
+    """Autocast mixed precision and channels_last memory format for the training steps.
+
+    The forward passes and the losses run under :meth:`autocast`, the backward passes and the optimizer steps go
+    through the gradient scalers of :meth:`grad_scaler`. Gradient scaling is only enabled for fp16: bf16 has the
+    exponent range of fp32, so its gradients do not underflow. Without ``mixed_precision``, autocast and the scalers
+    are no-ops and the training steps run in fp32 as before.
+
+    Args:
+        train_opt (dict): Training options, with
+            mixed_precision (str): Autocast dtype, 'fp16' (CUDA only) or 'bf16' (CUDA or CPU). Default: None (fp32).
+            channels_last (bool): Use the channels_last (NHWC) memory format for the networks, the perceptual loss
+                network and the batches. Default: False.
+        device (torch.device): Training device.
+    """
+
+    def __init__(self, train_opt, device):
+        precision = train_opt.get('mixed_precision')
+        if precision and precision not in PRECISIONS:
+            raise ValueError(f'mixed_precision must be one of {list(PRECISIONS)}, but got {precision}.')
+        self.dtype = PRECISIONS.get(precision) if precision else None
+        if self.dtype == torch.float16 and device.type != 'cuda':
+            raise ValueError('fp16 mixed precision needs CUDA, use bf16 on the CPU.')
+        self.device_type = device.type
+        self.channels_last = train_opt.get('channels_last', False)
+
+    def autocast(self):
+        return torch.autocast(self.device_type, dtype=self.dtype, enabled=self.dtype is not None)
+
+    def grad_scaler(self):
+        return torch.cuda.amp.GradScaler(enabled=self.dtype == torch.float16)
+
+    def memory_format(self, x):
+        """Convert a network or a batch to the channels_last memory format if it is enabled."""
+        return x.to(memory_format=torch.channels_last) if self.channels_last else x
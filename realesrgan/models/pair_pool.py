@@ -0,0 +1,54 @@
+import torch
+
+
+class TrainingPairPool():
+    """The training pair pool for increasing the diversity in a batch.
+
+    Batch processing limits the diversity of synthetic degradations in a batch. For example, samples in a batch could
+    not have different resize scaling factors. Therefore, we employ this training pair pool to increase the
+    degradation diversity in a batch.
+
+    The pool is filled with the first batches, which are returned unchanged. Once it is full, every batch swaps
+    places with ``b`` randomly chosen slots of the pool: the pairs in those slots are returned and the new pairs take
+    their slots. This draws the same samples as shuffling the whole pool and taking its first ``b`` pairs, but only
+    the ``b`` slots involved are copied.
+
+    Args:
+        size (int): Number of pairs in the pool. It should be divisible by the batch size.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.pool_lq = None
+        self.pool_gt = None
+        self.ptr = 0
+
+    @torch.no_grad()
+    def dequeue_and_enqueue(self, lq, gt):
+        """Put a batch of pairs in the pool and take one out.
+
+        Args:
+            lq (Tensor): LQ images of shape (b, c, h, w).
+            gt (Tensor): GT images of shape (b, c, h * scale, w * scale).
+
+        Returns:
+            tuple[Tensor]: LQ and GT images of the same shapes, the input batch itself while the pool is filling.
+        """
+        b = lq.size(0)
+        if self.pool_lq is None:
+            assert self.size % b == 0, f'queue size {self.size} should be divisible by batch size {b}'
+            self.pool_lq = lq.new_zeros(self.size, *lq.size()[1:])
+            self.pool_gt = gt.new_zeros(self.size, *gt.size()[1:])
+        if self.ptr < self.size:
+            # only do enqueue
+            self.pool_lq[self.ptr:self.ptr + b] = lq
+            self.pool_gt[self.ptr:self.ptr + b] = gt
+            self.ptr += b
+            return lq, gt
+        # swap the batch with b random slots of the pool
+        idx = torch.randperm(self.size, device=self.pool_lq.device)[:b]
+        lq_dequeue = self.pool_lq[idx]
+        gt_dequeue = self.pool_gt[idx]
+        self.pool_lq[idx] = lq
+        self.pool_gt[idx] = gt
+        return lq_dequeue, gt_dequeue
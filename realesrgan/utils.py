@@ -11,6 +11,11 @@ from torch.nn import functional as F
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
+def is_oom_error(error):
+    """Whether a RuntimeError is a failed device memory allocation."""
+    return isinstance(error, getattr(torch.cuda, 'OutOfMemoryError', ())) or 'out of memory' in str(error)
+
+
 class RealESRGANer():
     """A helper class for upsampling images with RealESRGAN.
 
@@ -24,6 +29,13 @@ class RealESRGANer():
         tile_pad (int): The pad size for each tile, to remove border artifacts. Default: 10.
         pre_pad (int): Pad the input images to avoid border artifacts. Default: 10.
         half (float): Whether to use half precision during inference. Default: False.
+        downsample_mode (str): Interpolation used to shrink the network output on the device when ``outscale`` is
+            smaller than ``scale``. Options: 'bicubic' | 'bilinear' (both antialiased) | 'area'. Default: 'bicubic'.
+        tile_blend (str): How tiles are merged. 'none' keeps the centre of each tile and discards the ``tile_pad``
+            border. 'linear' and 'cosine' feather neighbouring tiles over their overlap (2 * ``tile_pad``), which
+            removes the seams of small tiles. Default: 'none'.
+        min_tile_size (int): On an out-of-memory error, tiles are split into quadrants down to this size before the
+            error is raised. Default: 32.
     """
 
     def __init__(self,
@@ -36,13 +48,23 @@ class RealESRGANer():
                  pre_pad=10,
                  half=False,
                  device=None,
-                 gpu_id=None):
+                 gpu_id=None,
+                 downsample_mode='bicubic',
+                 tile_blend='none',
+                 min_tile_size=32):
         self.scale = scale
         self.tile_size = tile
         self.tile_pad = tile_pad
         self.pre_pad = pre_pad
         self.mod_scale = None
         self.half = half
+        if downsample_mode not in ('bicubic', 'bilinear', 'area'):
+            raise ValueError(f'Unknown downsample_mode {downsample_mode}. Options: bicubic | bilinear | area')
+        self.downsample_mode = downsample_mode
+        if tile_blend not in ('none', 'linear', 'cosine'):
+            raise ValueError(f'Unknown tile_blend {tile_blend}. Options: none | linear | cosine')
+        self.tile_blend = tile_blend
+        self.min_tile_size = min_tile_size
 
         # initialize model
         if gpu_id:
@@ -92,7 +114,10 @@ class RealESRGANer():
         self.img = img.unsqueeze(0).to(self.device)
         if self.half:
             self.img = self.img.half()
+        self.pad_input()
 
+    def pad_input(self):
+        """Pre-pad and mod pad ``self.img`` (b, c, h, w) in place."""
         # pre_pad
         if self.pre_pad != 0:
             self.img = F.pad(self.img, (0, self.pre_pad, 0, self.pre_pad), 'reflect')
@@ -114,6 +139,121 @@ class RealESRGANer():
         # model inference
         self.output = self.model(self.img)
 
+    def run_model(self):
+        """Run the model on ``self.img``, in tiles when ``self.tile_size`` is set.
+
+        Without tiles, an out-of-memory error switches to tiles of about half the larger image side (split further
+        if needed, see :meth:`split_box`). The tile size is kept, so the following images start with it.
+        """
+        if self.tile_size == 0:
+            self.output = None
+            try:
+                self.process()
+            except RuntimeError as error:
+                if not is_oom_error(error):
+                    raise
+            if self.output is not None:
+                return
+            torch.cuda.empty_cache()
+            _, _, height, width = self.img.shape
+            self.tile_size = max(self.min_tile_size, 1 << ((max(height, width, 2) - 1).bit_length() - 1))
+            print(f'\tOut of memory, switching to tiles of {self.tile_size}')
+        self.tile_process()
+
+    def grid_boxes(self, height, width, tile_size=None):
+        """Split an input of (height, width) into tiles of ``tile_size`` (default: ``self.tile_size``).
+
+        Yields:
+            tuple: The input area (y0, y1, x0, x1) of each tile, without padding.
+        """
+        tile_size = tile_size or self.tile_size
+        tiles_x = math.ceil(width / tile_size)
+        tiles_y = math.ceil(height / tile_size)
+        for y in range(tiles_y):
+            for x in range(tiles_x):
+                # input tile area on total image
+                input_start_x = x * tile_size
+                input_end_x = min(input_start_x + tile_size, width)
+                input_start_y = y * tile_size
+                input_end_y = min(input_start_y + tile_size, height)
+                yield (input_start_y, input_end_y, input_start_x, input_end_x)
+
+    def pad_box(self, box, height, width):
+        """Add ``self.tile_pad`` context to the input area ``box`` (y0, y1, x0, x1) of an input of (height, width).
+
+        Returns:
+            tuple: (input_box, output_box, crop_box), each box as (y0, y1, x0, x1). input_box is the padded input
+                tile, output_box its area on the output image, and crop_box the area of the upsampled padded tile
+                that goes there.
+        """
+        input_start_y, input_end_y, input_start_x, input_end_x = box
+
+        # input tile area on total image with padding
+        input_start_x_pad = max(input_start_x - self.tile_pad, 0)
+        input_end_x_pad = min(input_end_x + self.tile_pad, width)
+        input_start_y_pad = max(input_start_y - self.tile_pad, 0)
+        input_end_y_pad = min(input_end_y + self.tile_pad, height)
+
+        # output tile area without padding
+        output_start_x_tile = (input_start_x - input_start_x_pad) * self.scale
+        output_end_x_tile = output_start_x_tile + (input_end_x - input_start_x) * self.scale
+        output_start_y_tile = (input_start_y - input_start_y_pad) * self.scale
+        output_end_y_tile = output_start_y_tile + (input_end_y - input_start_y) * self.scale
+
+        return ((input_start_y_pad, input_end_y_pad, input_start_x_pad, input_end_x_pad),
+                (input_start_y * self.scale, input_end_y * self.scale, input_start_x * self.scale,
+                 input_end_x * self.scale), (output_start_y_tile, output_end_y_tile, output_start_x_tile,
+                                             output_end_x_tile))
+
+    def split_box(self, box):
+        """Split the input area of a tile that ran out of memory into quadrants.
+
+        Frees the cached device memory and lowers ``self.tile_size`` to the quadrant size, so later tiles and
+        images do not fail again.
+
+        Raises:
+            RuntimeError: When the tile is already no larger than ``min_tile_size``.
+        """
+        y0, y1, x0, x1 = box
+        size = max(y1 - y0, x1 - x0)
+        if size <= self.min_tile_size:
+            raise RuntimeError(f'Still out of memory on a tile of {size} pixels (min_tile_size: {self.min_tile_size})')
+        torch.cuda.empty_cache()
+        half = max(math.ceil(size / 2), self.min_tile_size)
+        if half < self.tile_size or self.tile_size == 0:
+            self.tile_size = half
+            print(f'\tOut of memory, splitting the tile and continuing with tiles of {self.tile_size}')
+        y_mid, x_mid = y0 + math.ceil((y1 - y0) / 2), x0 + math.ceil((x1 - x0) / 2)
+        quadrants = [(y0, y_mid, x0, x_mid), (y0, y_mid, x_mid, x1), (y_mid, y1, x0, x_mid), (y_mid, y1, x_mid, x1)]
+        return [q for q in quadrants if q[1] > q[0] and q[3] > q[2]]
+
+    def blend_weights(self, tile_height, tile_width, crop_box):
+        """Feathering weights (1, 1, h, w) of an upsampled padded tile for ``tile_blend``.
+
+        The weights ramp up over twice the padding on each side that has a neighbouring tile (``crop_box`` is the
+        area without padding), so they are complementary to the ramps of the neighbours. Image borders are not
+        feathered.
+        """
+
+        def ramp(length, start_pad, end_pad):
+            weights = torch.ones(length, device=self.device)
+            for pad, flip in ((start_pad, False), (end_pad, True)):
+                n = min(2 * pad, length)
+                if n == 0:
+                    continue
+                t = (torch.arange(n, device=self.device, dtype=torch.float32) + 0.5) / n
+                if self.tile_blend == 'cosine':
+                    t = 0.5 - 0.5 * torch.cos(math.pi * t)
+                if flip:
+                    weights[length - n:] *= t.flip(0)
+                else:
+                    weights[:n] *= t
+            return weights
+
+        weights_y = ramp(tile_height, crop_box[0], tile_height - crop_box[1])
+        weights_x = ramp(tile_width, crop_box[2], tile_width - crop_box[3])
+        return (weights_y[:, None] * weights_x[None, :])[None, None]
+
     def tile_process(self):
         """It will first crop input images to tiles, and then process each tile.
         Finally, all the processed tiles are merged into one images.
@@ -127,57 +267,52 @@ class RealESRGANer():
 
         # start with black image
         self.output = self.img.new_zeros(output_shape)
-        tiles_x = math.ceil(width / self.tile_size)
-        tiles_y = math.ceil(height / self.tile_size)
+        num_tiles = math.ceil(width / self.tile_size) * math.ceil(height / self.tile_size)
+        weight_sum = None
+        if self.tile_blend != 'none':
+            # weighted sums of the padded tiles, accumulated in float32
+            self.output = self.output.float()
+            weight_sum = self.img.new_zeros((1, 1, output_height, output_width), dtype=torch.float32)
 
         # loop over all tiles
-        for y in range(tiles_y):
-            for x in range(tiles_x):
-                # extract tile from input image
-                ofs_x = x * self.tile_size
-                ofs_y = y * self.tile_size
-                # input tile area on total image
-                input_start_x = ofs_x
-                input_end_x = min(ofs_x + self.tile_size, width)
-                input_start_y = ofs_y
-                input_end_y = min(ofs_y + self.tile_size, height)
-
-                # input tile area on total image with padding
-                input_start_x_pad = max(input_start_x - self.tile_pad, 0)
-                input_end_x_pad = min(input_end_x + self.tile_pad, width)
-                input_start_y_pad = max(input_start_y - self.tile_pad, 0)
-                input_end_y_pad = min(input_end_y + self.tile_pad, height)
-
-                # input tile dimensions
-                input_tile_width = input_end_x - input_start_x
-                input_tile_height = input_end_y - input_start_y
-                tile_idx = y * tiles_x + x + 1
-                input_tile = self.img[:, :, input_start_y_pad:input_end_y_pad, input_start_x_pad:input_end_x_pad]
-
-                # upscale tile
-                try:
-                    with torch.no_grad():
-                        output_tile = self.model(input_tile)
-                except RuntimeError as error:
-                    print('Error', error)
-                print(f'\tTile {tile_idx}/{tiles_x * tiles_y}')
-
-                # output tile area on total image
-                output_start_x = input_start_x * self.scale
-                output_end_x = input_end_x * self.scale
-                output_start_y = input_start_y * self.scale
-                output_end_y = input_end_y * self.scale
-
-                # output tile area without padding
-                output_start_x_tile = (input_start_x - input_start_x_pad) * self.scale
-                output_end_x_tile = output_start_x_tile + input_tile_width * self.scale
-                output_start_y_tile = (input_start_y - input_start_y_pad) * self.scale
-                output_end_y_tile = output_start_y_tile + input_tile_height * self.scale
-
-                # put tile into output image
-                self.output[:, :, output_start_y:output_end_y,
-                            output_start_x:output_end_x] = output_tile[:, :, output_start_y_tile:output_end_y_tile,
-                                                                       output_start_x_tile:output_end_x_tile]
+        for tile_idx, box in enumerate(self.grid_boxes(height, width), 1):
+            self.process_tile(box, weight_sum)
+            print(f'\tTile {tile_idx}/{num_tiles}')
+        if weight_sum is not None:
+            self.output /= weight_sum
+
+    def process_tile(self, box, weight_sum=None):
+        """Upsample the input area ``box`` of ``self.img`` into ``self.output``, split on out-of-memory errors."""
+        _, _, height, width = self.img.shape
+        input_box, output_box, crop_box = self.pad_box(box, height, width)
+        # extract tile from input image
+        input_tile = self.img[:, :, input_box[0]:input_box[1], input_box[2]:input_box[3]]
+
+        # upscale tile
+        output_tile = None
+        try:
+            with torch.no_grad():
+                output_tile = self.model(input_tile)
+        except RuntimeError as error:
+            if not is_oom_error(error):
+                raise
+        if output_tile is None:
+            for sub_box in self.split_box(box):
+                self.process_tile(sub_box, weight_sum)
+            return
+
+        if weight_sum is not None:
+            # add the whole padded tile, feathered, at its padded position
+            tile_height, tile_width = output_tile.shape[2:]
+            weights = self.blend_weights(tile_height, tile_width, crop_box)
+            y0, x0 = input_box[0] * self.scale, input_box[2] * self.scale
+            self.output[:, :, y0:y0 + tile_height, x0:x0 + tile_width] += output_tile.float() * weights
+            weight_sum[:, :, y0:y0 + tile_height, x0:x0 + tile_width] += weights
+            return
+
+        # put tile into output image
+        self.output[:, :, output_box[0]:output_box[1],
+                    output_box[2]:output_box[3]] = output_tile[:, :, crop_box[0]:crop_box[1], crop_box[2]:crop_box[3]]
 
     def post_process(self):
         # remove extra pad
@@ -190,6 +325,18 @@ class RealESRGANer():
             self.output = self.output[:, :, 0:h - self.pre_pad * self.scale, 0:w - self.pre_pad * self.scale]
         return self.output
 
+    def downsample(self, output, out_h, out_w):
+        """Shrink the network output to the final size before it leaves the device.
+
+        Used when ``outscale`` is smaller than the network scale, so that the full netscale image is never
+        copied to the host, converted to numpy and resized there with Lanczos.
+        """
+        output = output.float()
+        if self.downsample_mode == 'area':
+            return F.interpolate(output, size=(out_h, out_w), mode='area')
+        return F.interpolate(
+            output, size=(out_h, out_w), mode=self.downsample_mode, align_corners=False, antialias=True)
+
     @torch.no_grad()
     def enhance(self, img, outscale=None, alpha_upsampler='realesrgan'):
         h_input, w_input = img.shape[0:2]
@@ -215,13 +362,17 @@ class RealESRGANer():
             img_mode = 'RGB'
             img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
+        # shrink on the device when the requested scale is below the network scale
+        downsample = outscale is not None and outscale < float(self.scale)
+        if downsample:
+            out_h, out_w = int(h_input * outscale), int(w_input * outscale)
+
         # ------------------- process image (without the alpha channel) ------------------- #
         self.pre_process(img)
-        if self.tile_size > 0:
-            self.tile_process()
-        else:
-            self.process()
+        self.run_model()
         output_img = self.post_process()
+        if downsample:
+            output_img = self.downsample(output_img, out_h, out_w)
         output_img = output_img.data.squeeze().float().cpu().clamp_(0, 1).numpy()
         output_img = np.transpose(output_img[[2, 1, 0], :, :], (1, 2, 0))
         if img_mode == 'L':
@@ -231,17 +382,19 @@ class RealESRGANer():
         if img_mode == 'RGBA':
             if alpha_upsampler == 'realesrgan':
                 self.pre_process(alpha)
-                if self.tile_size > 0:
-                    self.tile_process()
-                else:
-                    self.process()
+                self.run_model()
                 output_alpha = self.post_process()
+                if downsample:
+                    output_alpha = self.downsample(output_alpha, out_h, out_w)
                 output_alpha = output_alpha.data.squeeze().float().cpu().clamp_(0, 1).numpy()
                 output_alpha = np.transpose(output_alpha[[2, 1, 0], :, :], (1, 2, 0))
                 output_alpha = cv2.cvtColor(output_alpha, cv2.COLOR_BGR2GRAY)
             else:  # use the cv2 resize for alpha channel
                 h, w = alpha.shape[0:2]
-                output_alpha = cv2.resize(alpha, (w * self.scale, h * self.scale), interpolation=cv2.INTER_LINEAR)
+                if downsample:
+                    output_alpha = cv2.resize(alpha, (out_w, out_h), interpolation=cv2.INTER_LINEAR)
+                else:
+                    output_alpha = cv2.resize(alpha, (w * self.scale, h * self.scale), interpolation=cv2.INTER_LINEAR)
 
             # merge the alpha channel
             output_img = cv2.cvtColor(output_img, cv2.COLOR_BGR2BGRA)
@@ -253,7 +406,7 @@ class RealESRGANer():
         else:
             output = (output_img * 255.0).round().astype(np.uint8)
 
-        if outscale is not None and outscale != float(self.scale):
+        if outscale is not None and outscale > float(self.scale):
             output = cv2.resize(
                 output, (
                     int(w_input * outscale),
@@ -262,10 +415,125 @@ class RealESRGANer():
 
         return output, img_mode
 
+    @torch.no_grad()
+    def enhance_batch(self, imgs, outscale=None, alpha_upsampler='realesrgan'):
+        """Upsample a list of images, running them through the network as one batch when possible.
+
+        Only 8-bit BGR images of the same size are batched, and only without tiling; any other input falls back to
+        :meth:`enhance` for each image, so the results are the same either way.
+
+        Args:
+            imgs (list[ndarray]): Images read by ``cv2.imread``.
+            outscale (float): The final upsampling scale. Default: None (the network scale).
+            alpha_upsampler (str): See :meth:`enhance`. Default: 'realesrgan'.
+
+        Returns:
+            list[tuple]: (output, img_mode) for each image, as returned by :meth:`enhance`.
+        """
+        batchable = self.tile_size == 0 and all(
+            img.dtype == np.uint8 and img.ndim == 3 and img.shape == imgs[0].shape and img.shape[2] == 3
+            for img in imgs)
+        if len(imgs) < 2 or not batchable:
+            return [self.enhance(img, outscale=outscale, alpha_upsampler=alpha_upsampler) for img in imgs]
+
+        h_input, w_input = imgs[0].shape[0:2]
+        batch = np.stack(imgs)[..., ::-1]  # BGR to RGB
+        self.img = torch.from_numpy(np.ascontiguousarray(batch)).to(self.device).permute(0, 3, 1, 2)
+        self.img = self.img.half() / 255. if self.half else self.img.float() / 255.
+        self.pad_input()
+        self.output = None
+        try:
+            self.process()
+        except RuntimeError as error:
+            if not is_oom_error(error):
+                raise
+        if self.output is None:
+            torch.cuda.empty_cache()
+            print('\tOut of memory for the batch, upsampling the images one by one')
+            return [self.enhance(img, outscale=outscale, alpha_upsampler=alpha_upsampler) for img in imgs]
+        outputs = self.post_process()
+        if outscale is not None and outscale < float(self.scale):
+            outputs = self.downsample(outputs, int(h_input * outscale), int(w_input * outscale))
+        # RGB to BGR and back to (b, h, w, c) uint8 on the device, so only the final bytes are copied to the host
+        outputs = outputs.float().clamp_(0, 1)[:, [2, 1, 0]].permute(0, 2, 3, 1).mul_(255.0).round_()
+        outputs = outputs.to(torch.uint8).cpu().numpy()
+
+        results = []
+        for output in outputs:
+            if outscale is not None and outscale > float(self.scale):
+                output = cv2.resize(
+                    output, (int(w_input * outscale), int(h_input * outscale)), interpolation=cv2.INTER_LANCZOS4)
+            results.append((output, 'RGB'))
+        return results
+
+    @torch.no_grad()
+    def enhance_large(self, img, output, tile_size=512):
+        """Upsample an image that does not fit in memory, one tile at a time.
+
+        ``img`` is read and ``output`` written tile by tile, so with memory-mapped arrays (see
+        :mod:`realesrgan.large_image`) the peak memory is bounded by the tile size, not the image size. The tiles
+        are the same as in :meth:`tile_process`, merged without ``tile_blend``. The output is always at the network
+        scale, and ``pre_pad`` is not applied.
+
+        Args:
+            img (ndarray): RGB (h, w, 3) or gray (h, w) input, uint8 or uint16. Note RGB, the channel order of TIFF.
+            output (ndarray): Array of shape (h * scale, w * scale[, 3]) and the dtype of ``img``.
+            tile_size (int): Tile size, used when ``self.tile_size`` is 0. Default: 512.
+        """
+        height, width = img.shape[0:2]
+        gray = img.ndim == 2
+        if not gray and img.shape[2] != 3:
+            raise ValueError(f'Large-image mode supports RGB and gray images, got {img.shape[2]} channels.')
+        max_range = 65535 if img.dtype == np.uint16 else 255
+        mod_scale = {2: 2, 1: 4}.get(self.scale)
+        gray_weights = torch.tensor([0.299, 0.587, 0.114], device=self.device)
+
+        def run_box(box):
+            input_box, output_box, crop_box = self.pad_box(box, height, width)
+            tile = np.asarray(img[input_box[0]:input_box[1], input_box[2]:input_box[3]], dtype=np.float32)
+            tile = torch.from_numpy(tile / max_range).to(self.device)
+            if gray:
+                tile = tile.unsqueeze(2).expand(-1, -1, 3)
+            tile = tile.permute(2, 0, 1).unsqueeze(0)
+            if self.half:
+                tile = tile.half()
+            if mod_scale is not None:
+                _, _, h, w = tile.size()
+                pad_w, pad_h = -w % mod_scale, -h % mod_scale
+                # reflect as in pad_input, unless an edge tile is too thin to reflect
+                mode = 'reflect' if pad_w < w and pad_h < h else 'replicate'
+                tile = F.pad(tile, (0, pad_w, 0, pad_h), mode)
+
+            output_tile = None
+            try:
+                output_tile = self.model(tile)
+            except RuntimeError as error:
+                if not is_oom_error(error):
+                    raise
+            if output_tile is None:
+                del tile
+                for sub_box in self.split_box(box):
+                    run_box(sub_box)
+                return
+            output_tile = output_tile[:, :, crop_box[0]:crop_box[1], crop_box[2]:crop_box[3]]
+            output_tile = output_tile.float().clamp_(0, 1)[0].permute(1, 2, 0)
+            if gray:
+                output_tile = output_tile @ gray_weights
+            output_tile = output_tile.mul_(max_range).round_().cpu().numpy().astype(img.dtype)
+            output[output_box[0]:output_box[1], output_box[2]:output_box[3]] = output_tile
+
+        for box in self.grid_boxes(height, width, self.tile_size or tile_size):
+            run_box(box)
+
+
+_END = object()  # end of the PrefetchReader queue, as None is an unreadable image
+
 
 class PrefetchReader(threading.Thread):
     """Prefetch images.
 
+    The images that cannot be read are yielded as None, so that the images stay aligned with ``img_list``.
+
     Args:
         img_list (list[str]): A image list of image paths to be read.
         num_prefetch_queue (int): Number of prefetch queue.
@@ -281,11 +549,11 @@ class PrefetchReader(threading.Thread):
             img = cv2.imread(img_path, cv2.IMREAD_UNCHANGED)
             self.que.put(img)
 
-        self.que.put(None)
+        self.que.put(_END)
 
     def __next__(self):
         next_item = self.que.get()
-        if next_item is None:
+        if next_item is _END:
             raise StopIteration
         return next_item
 
@@ -309,5 +577,6 @@ class IOConsumer(threading.Thread):
 
             output = msg['output']
             save_path = msg['save_path']
-            cv2.imwrite(save_path, output)
+            if cv2.imwrite(save_path, output, msg.get('params', [])) and 'on_saved' in msg:
+                msg['on_saved']()
         print(f'IO worker {self.qid} is done.')
@@ -0,0 +1,184 @@
+import collections
+import numpy as np
+import subprocess
+import threading
+import time
+
+
+def read_frame_into(stream, frame):
+    """Read one rawvideo frame from a pipe straight into a pre-allocated array.
+
+    Uses ``readinto`` on the uint8 buffer of ``frame``, so no intermediate bytes object is created and the same
+    array can be reused for every frame of a video.
+
+    Args:
+        stream (io.BufferedReader): Binary stream, e.g. the stdout of an ffmpeg process writing rawvideo.
+        frame (ndarray): C-contiguous uint8 array with the frame shape, e.g. (h, w, 3) for bgr24.
+
+    Returns:
+        bool: True if a full frame was read, False at the end of the stream (a truncated last frame is dropped).
+    """
+    view = memoryview(frame).cast('B')
+    num_bytes = len(view)
+    num_read = 0
+    while num_read < num_bytes:
+        n = stream.readinto(view[num_read:])
+        if not n:
+            return False
+        num_read += n
+    return True
+
+
+def write_frame(stream, frame):
+    """Write one rawvideo frame to a pipe without copying it.
+
+    The buffer of ``frame`` is handed to the pipe directly. A copy is only made when the frame is not already a
+    C-contiguous uint8 array.
+
+    Args:
+        stream (io.BufferedWriter): Binary stream, e.g. the stdin of an ffmpeg process reading rawvideo.
+        frame (ndarray): Frame to write.
+    """
+    frame = np.ascontiguousarray(frame, dtype=np.uint8)
+    stream.write(memoryview(frame).cast('B'))
+
+
+class FFmpegProcess():
+    """Run an ffmpeg command with its output pipes drained on background threads.
+
+    ffmpeg blocks as soon as a pipe it writes to is full, so every pipe that is not read by the caller is drained
+    by a daemon thread into a bounded ring buffer. ``-progress`` and ``-nostats`` are added to the command, and the
+    progress blocks are parsed into dicts, which feed ``progress_callback`` and the stall detector of :meth:`wait`.
+
+    Args:
+        cmd (list[str]): The ffmpeg command, starting with the ffmpeg binary.
+        pipe_stdin (bool): Open stdin as a pipe, e.g. for writing rawvideo frames. Otherwise stdin is /dev/null.
+            Default: False.
+        pipe_stdout (bool): Leave stdout to the caller, e.g. for reading rawvideo frames. Progress is then parsed
+            from stderr instead of stdout. Default: False.
+        progress_callback (callable): Called on the drain thread with a dict for every progress block, e.g.
+            ``{'frame': '120', 'fps': '29.9', 'out_time_us': '4004000', 'speed': '1.0x', 'progress': 'continue'}``.
+            Default: None.
+        buffer_lines (int): Number of output lines kept per stream. Default: 200.
+    """
+
+    def __init__(self, cmd, pipe_stdin=False, pipe_stdout=False, progress_callback=None, buffer_lines=200):
+        progress_url = 'pipe:2' if pipe_stdout else 'pipe:1'
+        self.cmd = [cmd[0], '-progress', progress_url, '-nostats'] + list(cmd[1:])
+        self.progress_callback = progress_callback
+        self.progress = {}
+        self.stdout_lines = collections.deque(maxlen=buffer_lines)
+        self.stderr_lines = collections.deque(maxlen=buffer_lines)
+        self._block = {}
+        self._lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.last_progress_time = self.start_time
+
+        self.proc = subprocess.Popen(
+            self.cmd,
+            stdin=subprocess.PIPE if pipe_stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        self.stdin = self.proc.stdin
+        self.stdout = self.proc.stdout if pipe_stdout else None
+
+        self._threads = [threading.Thread(target=self._drain, args=(self.proc.stderr, self.stderr_lines), daemon=True)]
+        if not pipe_stdout:
+            self._threads.append(
+                threading.Thread(target=self._drain, args=(self.proc.stdout, self.stdout_lines), daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def _drain(self, stream, lines):
+        for raw_line in iter(stream.readline, b''):
+            line = raw_line.decode('utf-8', errors='replace').rstrip()
+            key, sep, value = line.partition('=')
+            if sep and key and ' ' not in key:
+                self._on_progress_line(key, value.strip())
+            elif line:
+                lines.append(line)
+        stream.close()
+
+    def _on_progress_line(self, key, value):
+        self._block[key] = value
+        if key != 'progress':
+            return
+        block, self._block = self._block, {}
+        with self._lock:
+            # only count a block as progress when the position advanced, so a stalled encoder is still detected
+            advanced = any(block.get(k) != self.progress.get(k) for k in ('frame', 'out_time_us', 'total_size'))
+            self.progress = block
+            if advanced:
+                self.last_progress_time = time.monotonic()
+        if self.progress_callback is not None:
+            self.progress_callback(dict(block))
+
+    def stdout_tail(self):
+        return '\n'.join(self.stdout_lines)
+
+    def stderr_tail(self):
+        return '\n'.join(self.stderr_lines)
+
+    def seconds_since_progress(self):
+        with self._lock:
+            return time.monotonic() - self.last_progress_time
+
+    def wait(self, stall_timeout=None, poll_interval=1.0):
+        """Wait for ffmpeg to exit.
+
+        Args:
+            stall_timeout (float): Kill ffmpeg and raise ``subprocess.TimeoutExpired`` when its progress has not
+                advanced for this many seconds. None waits forever. Default: None.
+            poll_interval (float): Seconds between stall checks. Default: 1.0.
+
+        Returns:
+            int: The return code of ffmpeg.
+        """
+        while True:
+            try:
+                self.proc.wait(timeout=poll_interval if stall_timeout is not None else None)
+                break
+            except subprocess.TimeoutExpired:
+                if self.seconds_since_progress() > stall_timeout:
+                    self.proc.kill()
+                    self.proc.wait()
+                    self._join()
+                    raise subprocess.TimeoutExpired(
+                        self.cmd, stall_timeout, output=self.stdout_tail(), stderr=self.stderr_tail())
+        self._join()
+        return self.proc.returncode
+
+    def close(self, stall_timeout=None):
+        """Close stdin (signals the end of the input frames) and wait for ffmpeg to exit."""
+        if self.stdin is not None and not self.stdin.closed:
+            self.stdin.close()
+        return self.wait(stall_timeout=stall_timeout)
+
+    def _join(self):
+        for thread in self._threads:
+            thread.join()
+
+
+def run_ffmpeg(cmd, stall_timeout=None, progress_callback=None, check=True):
+    """Run an ffmpeg command to completion with drained pipes and progress-based stall detection.
+
+    A drop-in for ``subprocess.run(cmd, check=True, capture_output=True, text=True)``: failures raise
+    ``subprocess.CalledProcessError`` and stalls raise ``subprocess.TimeoutExpired``, both carrying the last lines
+    of stdout and stderr.
+
+    Args:
+        cmd (list[str]): The ffmpeg command, starting with the ffmpeg binary.
+        stall_timeout (float): Seconds without progress before ffmpeg is killed. None disables the check.
+            Default: None.
+        progress_callback (callable): See :class:`FFmpegProcess`. Default: None.
+        check (bool): Raise ``subprocess.CalledProcessError`` on a non-zero return code. Default: True.
+
+    Returns:
+        subprocess.CompletedProcess: With the tails of stdout and stderr as text.
+    """
+    process = FFmpegProcess(cmd, progress_callback=progress_callback)
+    returncode = process.wait(stall_timeout=stall_timeout)
+    stdout, stderr = process.stdout_tail(), process.stderr_tail()
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, process.cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(process.cmd, returncode, stdout=stdout, stderr=stderr)
@@ -0,0 +1,51 @@
+import argparse
+import random
+import time
+from basicsr.utils import FileClient, imfrombytes, scandir
+from os import path as osp
+
+
+def read_throughput(file_client, keys, num_reads, client_key):
+    """Read ``num_reads`` random keys and decode them. Returns the images/s and MB/s (of encoded bytes)."""
+    num_bytes = 0
+    start = time.time()
+    for _ in range(num_reads):
+        key, client = random.choice(keys) if client_key is None else (random.choice(keys), client_key)
+        img_bytes = file_client.get(key, client)
+        imfrombytes(img_bytes, float32=True)
+        num_bytes += len(img_bytes)
+    elapsed = time.time() - start
+    return num_reads / elapsed, num_bytes / elapsed / 1024**2
+
+
+def main(args):
+    """Compare the random-access read throughput of sub-images stored as individual files and in LMDB databases.
+
+    The reads go through the file clients of RealESRGANDataset and include the decoding. Run it on a cold page cache
+    (e.g. after writing more data than the RAM, or dropping the caches) to measure the storage rather than memory.
+    """
+    if args.folder:
+        paths = sorted(scandir(args.folder, full_path=True))
+        file_client = FileClient('disk')
+        images_per_s, mb_per_s = read_throughput(file_client, paths, args.num_reads, 'gt')
+        print(f'files: {len(paths)} images, {images_per_s:8.1f} images/s, {mb_per_s:7.1f}MB/s')
+    if args.lmdb:
+        client_keys = [f'shard{i}' for i in range(len(args.lmdb))]
+        keys = []
+        for db_path, client_key in zip(args.lmdb, client_keys):
+            with open(osp.join(db_path, 'meta_info.txt')) as fin:
+                keys.extend((line.split('.')[0], client_key) for line in fin)
+        file_client = FileClient('lmdb', db_paths=args.lmdb, client_keys=client_keys)
+        images_per_s, mb_per_s = read_throughput(file_client, keys, args.num_reads, None)
+        print(f' lmdb: {len(keys)} images in {len(args.lmdb)} database(s), {images_per_s:8.1f} images/s, '
+              f'{mb_per_s:7.1f}MB/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--folder', type=str, help='Folder of sub-images, e.g. datasets/DF2K/DF2K_HR_sub')
+    parser.add_argument('--lmdb', type=str, nargs='+', help='LMDB databases of the same sub-images')
+    parser.add_argument('--num_reads', type=int, default=2000, help='Number of random reads per layout')
+    args = parser.parse_args()
+
+    main(args)
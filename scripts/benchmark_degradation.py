@@ -0,0 +1,78 @@
+import argparse
+import numpy as np
+import sys
+import time
+import torch
+import yaml
+from basicsr.utils import DiffJPEG
+from os import path as osp
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+from realesrgan.data.kernel_bank import random_blur_kernel, random_final_sinc_kernel  # noqa: E402
+from realesrgan.models.degradations import second_order_degradation  # noqa: E402
+from realesrgan.models.degradations import second_order_degradation_per_sample  # noqa: E402
+
+
+def random_kernels(opt, stage, batch_size):
+    suffix = '' if stage == 1 else '2'
+    kernels = [
+        random_blur_kernel(
+            opt[f'kernel_list{suffix}'],
+            opt[f'kernel_prob{suffix}'],
+            opt[f'blur_sigma{suffix}'],
+            opt[f'betag_range{suffix}'],
+            opt[f'betap_range{suffix}'], [2 * v + 1 for v in range(3, 11)],
+            sinc=np.random.uniform() < opt[f'sinc_prob{suffix}']) for _ in range(batch_size)
+    ]
+    return torch.from_numpy(np.stack(kernels))
+
+
+def main(args):
+    """Measure the iterations/sec of the batch-level and the per-sample second-order degradations.
+
+    The batch-level synthesis needs the training pair pool for diversity, which holds ``queue_size`` extra LQ and GT
+    patches on the device; its memory is reported as well.
+    """
+    with open(args.opt, mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    opt['scale'] = args.scale
+    data_opt = opt['datasets']['train']
+    device = torch.device('cuda' if torch.cuda.is_available() and not args.cpu else 'cpu')
+    jpeger = DiffJPEG(differentiable=False).to(device)
+
+    gt = torch.rand(args.batch_size, 3, args.gt_size, args.gt_size, device=device)
+    kernel1 = random_kernels(data_opt, 1, args.batch_size).to(device)
+    kernel2 = random_kernels(data_opt, 2, args.batch_size).to(device)
+    sinc_kernel = torch.from_numpy(
+        np.stack([random_final_sinc_kernel([2 * v + 1 for v in range(3, 11)])
+                  for _ in range(args.batch_size)])).to(device)
+
+    lq_size = args.gt_size // args.scale
+    pool_mb = opt.get('queue_size', 180) * 3 * 4 * (args.gt_size**2 + lq_size**2) / 1024**2
+    print(f'device: {device}, batch size: {args.batch_size}, gt size: {args.gt_size}')
+    print(f'training pair pool of the batch-level synthesis: {pool_mb:.0f}MB')
+    for name, degradation in [('batch', second_order_degradation), ('per-sample', second_order_degradation_per_sample)]:
+        for i in range(args.warmup + args.iters):
+            if i == args.warmup:
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                start = time.time()
+            degradation(gt, kernel1, kernel2, sinc_kernel, opt, jpeger)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        elapsed = time.time() - start
+        print(f'{name:>10s}: {args.iters / elapsed:7.2f} it/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--opt', type=str, default='options/train_realesrgan_x4plus.yml', help='Training options')
+    parser.add_argument('--scale', type=int, default=4, help='Upsampling scale')
+    parser.add_argument('--batch_size', type=int, default=12, help='Batch size per GPU')
+    parser.add_argument('--gt_size', type=int, default=400, help='Size of the GT patches from the dataset')
+    parser.add_argument('--iters', type=int, default=20, help='Timed iterations')
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed iterations')
+    parser.add_argument('--cpu', action='store_true', help='Run on the CPU even if CUDA is available')
+    args = parser.parse_args()
+
+    main(args)
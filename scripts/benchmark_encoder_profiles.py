@@ -0,0 +1,61 @@
+import argparse
+import numpy as np
+import os
+import sys
+import tempfile
+import time
+from os import path as osp
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+from inference_realesrgan_video import ENCODER_PROFILES, Writer  # noqa: E402
+
+
+def synthetic_frames(height, width, num_frames):
+    """Moving gradients with a little noise, so that the encoder has both motion and texture to code."""
+    yy, xx = np.mgrid[0:height, 0:width]
+    noise = np.random.randint(0, 16, (height, width, 3), dtype=np.uint8)
+    for idx in range(num_frames):
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[..., 0] = (xx + idx * 4) % 256
+        frame[..., 1] = (yy + idx * 2) % 256
+        frame[..., 2] = (xx + yy) % 256
+        yield frame + noise
+
+
+def main(args):
+    """Measure the encoder throughput of each Writer encoder profile.
+
+    Frames are generated in memory and pushed through the same Writer that inference_realesrgan_video.py uses,
+    so the numbers include the rawvideo pipe and the encoder, but no model inference.
+    """
+    profiles = args.profiles or list(ENCODER_PROFILES.keys())
+    height, width = args.height, args.width
+    frames = list(synthetic_frames(height, width, args.num_frames))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for profile in profiles:
+            writer_args = argparse.Namespace(
+                outscale=1, ffmpeg_bin=args.ffmpeg_bin, encoder_profile=profile, encoder_threads=args.threads)
+            save_path = osp.join(tmp_dir, f'{profile}.mp4')
+            writer = Writer(writer_args, None, height, width, save_path, args.fps)
+            start = time.time()
+            for frame in frames:
+                writer.write_frame(frame)
+            writer.close()
+            total_time = time.time() - start
+            size_mb = os.path.getsize(save_path) / 1024**2
+            print(f'{profile:>12s}: {args.num_frames / total_time:7.2f} fps, {size_mb:8.2f} MB '
+                  f'({size_mb * 8 / (args.num_frames / args.fps):.1f} Mbit/s)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profiles', nargs='+', default=None, help='Profiles to measure. Default: all profiles')
+    parser.add_argument('--width', type=int, default=1440, help='Frame width, e.g. 720x480 upscaled by 2')
+    parser.add_argument('--height', type=int, default=960, help='Frame height')
+    parser.add_argument('--num_frames', type=int, default=120, help='Number of frames to encode per profile')
+    parser.add_argument('--fps', type=float, default=29.97, help='Frame rate of the output video')
+    parser.add_argument('--threads', type=int, default=None, help='Encoder thread number')
+    parser.add_argument('--ffmpeg_bin', type=str, default='ffmpeg', help='The path to ffmpeg')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,67 @@
+import argparse
+import sys
+import time
+import torch
+from os import path as osp
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+from realesrgan.models.pair_pool import TrainingPairPool  # noqa: E402
+
+
+class ShufflePairPool(TrainingPairPool):
+    """The previous pool, which shuffles the whole pool every step and takes its first b pairs (for reference)."""
+
+    @torch.no_grad()
+    def dequeue_and_enqueue(self, lq, gt):
+        b = lq.size(0)
+        if self.pool_lq is None or self.ptr < self.size:
+            return super().dequeue_and_enqueue(lq, gt)
+        idx = torch.randperm(self.size)
+        self.pool_lq = self.pool_lq[idx]
+        self.pool_gt = self.pool_gt[idx]
+        lq_dequeue = self.pool_lq[0:b].clone()
+        gt_dequeue = self.pool_gt[0:b].clone()
+        self.pool_lq[0:b] = lq.clone()
+        self.pool_gt[0:b] = gt.clone()
+        return lq_dequeue, gt_dequeue
+
+
+def main(args):
+    """Measure the time per step of the training pair pools, and the bytes each one copies per step."""
+    device = torch.device('cuda' if torch.cuda.is_available() and not args.cpu else 'cpu')
+    lq = torch.rand(args.batch_size, 3, args.gt_size // args.scale, args.gt_size // args.scale, device=device)
+    gt = torch.rand(args.batch_size, 3, args.gt_size, args.gt_size, device=device)
+    pair_bytes = (lq[0].numel() + gt[0].numel()) * lq.element_size()
+
+    print(f'device: {device}, batch size: {args.batch_size}, gt size: {args.gt_size}, pool size: {args.queue_size}')
+    # shuffle: gather of the whole pool + clone of b pairs out + clone and copy of b pairs in
+    # swap: gather of b pairs out + copy of b pairs in
+    pools = [('shuffle', ShufflePairPool, args.queue_size + 3 * args.batch_size),
+             ('swap', TrainingPairPool, 2 * args.batch_size)]
+    for name, pool_class, copied in pools:
+        pool = pool_class(args.queue_size)
+        for _ in range(args.queue_size // args.batch_size):  # fill the pool
+            pool.dequeue_and_enqueue(lq, gt)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.time()
+        for _ in range(args.iters):
+            pool.dequeue_and_enqueue(lq, gt)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        elapsed = time.time() - start
+        print(f'{name:>8s}: {elapsed / args.iters * 1000:7.2f} ms/step, '
+              f'{copied * pair_bytes / 1024**2:7.1f}MB copied/step')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=int, default=4, help='Upsampling scale')
+    parser.add_argument('--batch_size', type=int, default=12, help='Batch size per GPU')
+    parser.add_argument('--gt_size', type=int, default=256, help='Size of the GT patches')
+    parser.add_argument('--queue_size', type=int, default=180, help='Size of the training pair pool')
+    parser.add_argument('--iters', type=int, default=50, help='Timed steps')
+    parser.add_argument('--cpu', action='store_true', help='Run on the CPU even if CUDA is available')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,85 @@
+import argparse
+import cv2
+import numpy as np
+import os
+import sys
+import time
+import torch
+from basicsr.archs.rrdbnet_arch import RRDBNet
+from os import path as osp
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+from realesrgan import RealESRGANer  # noqa: E402
+from realesrgan.archs.srvgg_arch import SRVGGNetCompact  # noqa: E402
+
+MODELS = {
+    'RealESRGAN_x4plus':
+    lambda: RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4),
+    'realesr-general-x4v3':
+    lambda: SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4, act_type='prelu'),
+}
+
+
+def psnr(img, ref):
+    mse = np.mean((img.astype(np.float64) - ref.astype(np.float64))**2)
+    return float('inf') if mse == 0 else 10 * np.log10(255.0**2 / mse)
+
+
+def seam_error(img, ref, tile_size, scale, width=2):
+    """Mean absolute error against the reference within ``width`` output pixels of the tile boundaries."""
+    mask = np.zeros(img.shape[:2], dtype=bool)
+    for pos in range(tile_size * scale, img.shape[0], tile_size * scale):
+        mask[pos - width:pos + width, :] = True
+    for pos in range(tile_size * scale, img.shape[1], tile_size * scale):
+        mask[:, pos - width:pos + width] = True
+    if not mask.any():
+        return 0.0
+    return float(np.abs(img.astype(np.float64) - ref.astype(np.float64))[mask].mean())
+
+
+def main(args):
+    """Measure the quality of tiled inference against untiled inference, per tile size and tile_blend mode.
+
+    For each combination, reports the PSNR of the whole image and the mean absolute error at the tile boundaries
+    (where seams show up) against the untiled result, together with the time and, on CUDA, the peak memory.
+    """
+    img = cv2.imread(args.input, cv2.IMREAD_COLOR)
+    model = MODELS[args.model_name]()
+    upsampler = RealESRGANer(
+        scale=4, model_path=args.model_path, model=model, tile=0, tile_pad=args.tile_pad, pre_pad=0, half=args.half)
+
+    reference, _ = upsampler.enhance(img)
+    print(f'{"tile":>5s} {"blend":>7s} {"PSNR":>8s} {"seam MAE":>9s} {"time":>7s} {"peak mem":>9s}')
+    for tile_size in args.tile_sizes:
+        for tile_blend in args.blend_modes:
+            upsampler.tile_size = tile_size
+            upsampler.tile_blend = tile_blend
+            if torch.cuda.is_available():
+                torch.cuda.reset_peak_memory_stats()
+            start = time.time()
+            with open(os.devnull, 'w') as devnull:  # silence the per-tile prints
+                stdout, sys.stdout = sys.stdout, devnull
+                try:
+                    output, _ = upsampler.enhance(img)
+                finally:
+                    sys.stdout = stdout
+            elapsed = time.time() - start
+            peak = f'{torch.cuda.max_memory_allocated() / 1024**2:7.0f}MB' if torch.cuda.is_available() else 'n/a'
+            print(f'{tile_size:5d} {tile_blend:>7s} {psnr(output, reference):8.2f} '
+                  f'{seam_error(output, reference, tile_size, upsampler.scale):9.3f} {elapsed:6.2f}s {peak:>9s}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', type=str, default='inputs/0014.jpg', help='Input image')
+    parser.add_argument('--model_name', type=str, default='RealESRGAN_x4plus', choices=list(MODELS.keys()))
+    parser.add_argument(
+        '--model_path', type=str, default='weights/RealESRGAN_x4plus.pth', help='Path to the model weights')
+    parser.add_argument('--tile_sizes', type=int, nargs='+', default=[32, 64, 128, 256], help='Tile sizes to test')
+    parser.add_argument('--tile_pad', type=int, default=10, help='Tile padding')
+    parser.add_argument(
+        '--blend_modes', nargs='+', default=['none', 'linear', 'cosine'], choices=['none', 'linear', 'cosine'])
+    parser.add_argument('--half', action='store_true', help='Use fp16 inference (CUDA only)')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,122 @@
+import argparse
+import numpy as np
+import sys
+import time
+import torch
+import yaml
+from collections import OrderedDict
+from os import path as osp
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+from realesrgan.data.kernel_bank import random_blur_kernel, random_final_sinc_kernel  # noqa: E402
+from realesrgan.models.realesrgan_model import RealESRGANModel  # noqa: E402
+from realesrgan.models.realesrnet_model import RealESRNetModel  # noqa: E402
+
+KERNEL_RANGE = [2 * v + 1 for v in range(3, 11)]  # kernel size ranges from 7 to 21
+
+
+def random_batch(data_opt, batch_size, gt_size):
+    """A batch in the format of RealESRGANDataset, with random GT images and kernels drawn with its settings."""
+
+    def kernels(suffix):
+        return torch.from_numpy(
+            np.stack([
+                random_blur_kernel(
+                    data_opt[f'kernel_list{suffix}'],
+                    data_opt[f'kernel_prob{suffix}'],
+                    data_opt[f'blur_sigma{suffix}'],
+                    data_opt[f'betag_range{suffix}'],
+                    data_opt[f'betap_range{suffix}'],
+                    KERNEL_RANGE,
+                    sinc=np.random.uniform() < data_opt[f'sinc_prob{suffix}']) for _ in range(batch_size)
+            ]))
+
+    sinc_kernel = np.stack([random_final_sinc_kernel(KERNEL_RANGE) for _ in range(batch_size)])
+    return {
+        'gt': torch.rand(batch_size, 3, gt_size, gt_size),
+        'kernel1': kernels(''),
+        'kernel2': kernels('2'),
+        'sinc_kernel': torch.from_numpy(sinc_kernel)
+    }
+
+
+def build_model(args):
+    """RealESRNetModel or RealESRGANModel with the settings of the training options, and a tiny RRDBNet unless
+    ``--full_size``."""
+    with open(args.opt, mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    opt.update(num_gpu=0 if args.cpu or not torch.cuda.is_available() else 1, is_train=True, dist=False)
+    opt['queue_size'] = args.queue_size
+    opt['per_sample_degradation'] = args.per_sample_degradation
+    if not args.full_size:
+        opt['network_g'].update(num_feat=args.num_feat, num_block=args.num_block, num_grow_ch=args.num_feat // 2)
+    opt['path'] = {'pretrain_network_g': None, 'strict_load_g': True, 'resume_state': None}
+    opt['train'].update(ema_decay=0, mixed_precision=args.mixed_precision, channels_last=args.channels_last)
+    opt['logger'] = {}
+    model_class = RealESRGANModel if opt['model_type'] == 'RealESRGANModel' else RealESRNetModel
+    return model_class(opt), opt
+
+
+def main(args):
+    """Time the training steps of RealESRNetModel or RealESRGANModel, split into degradation synthesis, the training
+    pair pool and optimize_parameters (forward and backward passes and optimizer steps), and report the peak GPU
+    memory."""
+    model, opt = build_model(args)
+    data = random_batch(opt['datasets']['train'], args.batch_size, args.gt_size)
+    # the pool is timed on its own, instead of inside feed_data
+    queue_size, model.queue_size = model.queue_size, 0
+
+    def synchronize():
+        if model.device.type == 'cuda':
+            torch.cuda.synchronize()
+
+    times = OrderedDict((name, 0.0) for name in ['synthesis', 'pool', 'optimize'])
+    for i in range(args.warmup + args.iters):
+        if i == args.warmup and model.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats()
+        tic = time.time()
+        model.feed_data(data)
+        synchronize()
+        toc = time.time()
+        if queue_size > 0:
+            model._dequeue_and_enqueue()
+            if hasattr(model, 'gt_usm'):
+                model.gt_usm = model.usm_sharpener(model.gt)
+        synchronize()
+        toc2 = time.time()
+        model.optimize_parameters(i + 1)
+        synchronize()
+        toc3 = time.time()
+        if i >= args.warmup:
+            for name, elapsed in zip(times, [toc - tic, toc2 - toc, toc3 - toc2]):
+                times[name] += elapsed
+
+    total = sum(times.values())
+    print(f'{type(model).__name__}, device: {model.device}, batch size: {args.batch_size}, gt size: {args.gt_size}, '
+          f'queue size: {queue_size}, per-sample degradation: {args.per_sample_degradation}, '
+          f'mixed precision: {args.mixed_precision}, channels_last: {args.channels_last}')
+    for name, elapsed in times.items():
+        print(f'{name:>10s}: {elapsed / args.iters * 1000:8.1f} ms/iter ({elapsed / total * 100:4.1f}%)')
+    print(f'{"total":>10s}: {total / args.iters * 1000:8.1f} ms/iter ({args.iters / total:.2f} it/s)')
+    if model.device.type == 'cuda':
+        print(f'peak memory: {torch.cuda.max_memory_allocated() / 1024**2:.0f}MB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--opt', type=str, default='options/train_realesrnet_x4plus.yml', help='Training options')
+    parser.add_argument('--batch_size', type=int, default=4, help='Batch size')
+    parser.add_argument('--gt_size', type=int, default=400, help='Size of the GT patches from the dataset')
+    parser.add_argument('--num_feat', type=int, default=16, help='Channels of the tiny RRDBNet')
+    parser.add_argument('--num_block', type=int, default=2, help='RRDB blocks of the tiny RRDBNet')
+    parser.add_argument('--full_size', action='store_true', help='Use the RRDBNet of the training options')
+    parser.add_argument('--queue_size', type=int, default=16, help='Size of the training pair pool, 0 to disable')
+    parser.add_argument('--per_sample_degradation', action='store_true', help='Draw degradations per sample')
+    parser.add_argument('--mixed_precision', type=str, default=None, help='Autocast dtype: fp16 or bf16')
+    parser.add_argument('--channels_last', action='store_true', help='Use the channels_last memory format')
+    parser.add_argument('--iters', type=int, default=10, help='Timed iterations')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed iterations')
+    parser.add_argument('--cpu', action='store_true', help='Run on the CPU even if CUDA is available')
+    args = parser.parse_args()
+
+    main(args)
@@ -4,6 +4,7 @@ import numpy as np
 import os
 import sys
 from basicsr.utils import scandir
+from basicsr.utils.lmdb_util import LmdbMaker
 from multiprocessing import Pool
 from os import path as osp
 from tqdm import tqdm
@@ -21,6 +22,8 @@ def main(args):
         crop_size (int): Crop size.
         step (int): Step for overlapped sliding window.
         thresh_size (int): Threshold size. Patches whose size is lower than thresh_size will be dropped.
+        lmdb (bool): Write the sub-images into LMDB databases instead of individual files.
+        num_shards (int): Number of LMDB databases to spread the sub-images over.
 
     Usage:
         For each folder, run this script.
@@ -37,7 +40,11 @@ def main(args):
     opt['crop_size'] = args.crop_size
     opt['step'] = args.step
     opt['thresh_size'] = args.thresh_size
-    extract_subimages(opt)
+    if args.lmdb:
+        opt['num_shards'] = args.num_shards
+        extract_subimages_lmdb(opt)
+    else:
+        extract_subimages(opt)
 
 
 def extract_subimages(opt):
@@ -71,30 +78,67 @@ def extract_subimages(opt):
     print('All processes done.')
 
 
-def worker(path, opt):
-    """Worker for each process.
+def extract_subimages_lmdb(opt):
+    """Crop images to subimages and write them into LMDB databases, with their meta_info.txt.
+
+    The images are cropped and PNG-encoded by the worker processes and written by the main process. With
+    ``num_shards`` > 1, the images are distributed over ``num_shards`` databases round-robin, named after the save
+    folder with a shard suffix, e.g. DF2K_HR_sub_000.lmdb. Pass the list of them as ``dataroot_gt``.
 
     Args:
-        path (str): Image path.
+        opt (dict): Configuration dict. It contains:
+            input_folder (str): Path to the input folder.
+            save_folder (str): Path of the LMDB database. It should end with '.lmdb'.
+            n_thread (int): Thread number.
+            num_shards (int): Number of databases.
+    """
+    save_folder = opt['save_folder']
+    num_shards = opt['num_shards']
+    if num_shards == 1:
+        lmdb_paths = [save_folder]
+    else:
+        lmdb_paths = [f'{osp.splitext(save_folder)[0]}_{shard:03d}.lmdb' for shard in range(num_shards)]
+    makers = [LmdbMaker(lmdb_path, compress_level=opt['compression_level']) for lmdb_path in lmdb_paths]
+
+    # scan all images
+    img_list = sorted(scandir(opt['input_folder'], full_path=True))
+
+    pbar = tqdm(total=len(img_list), unit='image', desc='Extract')
+    with Pool(opt['n_thread']) as pool:
+        for idx, crops in enumerate(pool.imap(encode_worker, [(path, opt) for path in img_list])):
+            for key, img_byte, img_shape in crops:
+                makers[idx % num_shards].put(img_byte, key, img_shape)
+            pbar.update(1)
+    pbar.close()
+    for maker in makers:
+        maker.close()
+    print(f'All processes done. LMDB databases: {", ".join(lmdb_paths)}')
+
+
+def sub_name(path):
+    """Returns the name and extension of an image, the base of its sub-image names."""
+    img_name, extension = osp.splitext(osp.basename(path))
+    # remove the x2, x3, x4 and x8 in the filename for DIV2K
+    img_name = img_name.replace('x2', '').replace('x3', '').replace('x4', '').replace('x8', '')
+    return img_name, extension
+
+
+def crop(img, opt):
+    """Crop an image with an overlapped sliding window.
+
+    Args:
+        img (ndarray): Image.
         opt (dict): Configuration dict. It contains:
             crop_size (int): Crop size.
             step (int): Step for overlapped sliding window.
             thresh_size (int): Threshold size. Patches whose size is lower than thresh_size will be dropped.
-            save_folder (str): Path to save folder.
-            compression_level (int): for cv2.IMWRITE_PNG_COMPRESSION.
 
-    Returns:
-        process_info (str): Process information displayed in progress bar.
+    Yields:
+        tuple: The index of the sub-image (from 1) and the contiguous sub-image.
     """
     crop_size = opt['crop_size']
     step = opt['step']
     thresh_size = opt['thresh_size']
-    img_name, extension = osp.splitext(osp.basename(path))
-
-    # remove the x2, x3, x4 and x8 in the filename for DIV2K
-    img_name = img_name.replace('x2', '').replace('x3', '').replace('x4', '').replace('x8', '')
-
-    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
 
     h, w = img.shape[0:2]
     h_space = np.arange(0, h - crop_size + 1, step)
@@ -109,10 +153,51 @@ def worker(path, opt):
         for y in w_space:
             index += 1
             cropped_img = img[x:x + crop_size, y:y + crop_size, ...]
-            cropped_img = np.ascontiguousarray(cropped_img)
-            cv2.imwrite(
-                osp.join(opt['save_folder'], f'{img_name}_s{index:03d}{extension}'), cropped_img,
-                [cv2.IMWRITE_PNG_COMPRESSION, opt['compression_level']])
+            yield index, np.ascontiguousarray(cropped_img)
+
+
+def encode_worker(args):
+    """Worker that crops an image and PNG-encodes the sub-images, for :func:`extract_subimages_lmdb`.
+
+    Args:
+        args (tuple): Image path and the configuration dict (see :func:`crop`, and compression_level).
+
+    Returns:
+        list[tuple]: LMDB key, PNG bytes and shape (h, w, c) of every sub-image.
+    """
+    path, opt = args
+    img_name, _ = sub_name(path)
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    crops = []
+    for index, cropped_img in crop(img, opt):
+        _, img_byte = cv2.imencode('.png', cropped_img, [cv2.IMWRITE_PNG_COMPRESSION, opt['compression_level']])
+        h, w = cropped_img.shape[0:2]
+        c = 1 if cropped_img.ndim == 2 else cropped_img.shape[2]
+        crops.append((f'{img_name}_s{index:03d}', img_byte, (h, w, c)))
+    return crops
+
+
+def worker(path, opt):
+    """Worker for each process.
+
+    Args:
+        path (str): Image path.
+        opt (dict): Configuration dict. It contains:
+            crop_size (int): Crop size.
+            step (int): Step for overlapped sliding window.
+            thresh_size (int): Threshold size. Patches whose size is lower than thresh_size will be dropped.
+            save_folder (str): Path to save folder.
+            compression_level (int): for cv2.IMWRITE_PNG_COMPRESSION.
+
+    Returns:
+        process_info (str): Process information displayed in progress bar.
+    """
+    img_name, extension = sub_name(path)
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    for index, cropped_img in crop(img, opt):
+        cv2.imwrite(
+            osp.join(opt['save_folder'], f'{img_name}_s{index:03d}{extension}'), cropped_img,
+            [cv2.IMWRITE_PNG_COMPRESSION, opt['compression_level']])
     process_info = f'Processing {img_name} ...'
     return process_info
 
@@ -130,6 +215,9 @@ if __name__ == '__main__':
         help='Threshold size. Patches whose size is lower than thresh_size will be dropped.')
     parser.add_argument('--n_thread', type=int, default=20, help='Thread number.')
     parser.add_argument('--compression_level', type=int, default=3, help='Compression level')
+    parser.add_argument(
+        '--lmdb', action='store_true', help='Write LMDB databases (--output ends with .lmdb) instead of image files')
+    parser.add_argument('--num_shards', type=int, default=1, help='Number of LMDB databases with --lmdb')
     args = parser.parse_args()
 
     main(args)
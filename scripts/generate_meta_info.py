@@ -1,36 +1,49 @@
 import argparse
-import cv2
 import glob
 import os
+import sys
+from os import path as osp
+from tqdm import tqdm
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+from realesrgan.data.image_info import ImageInfoCache, scan_image_sizes  # noqa: E402
 
 
 def main(args):
-    txt_file = open(args.meta_info, 'w')
+    img_paths = []
     for folder, root in zip(args.input, args.root):
-        img_paths = sorted(glob.glob(os.path.join(folder, '*')))
-        for img_path in img_paths:
-            status = True
-            if args.check:
-                # read the image once for check, as some images may have errors
-                try:
-                    img = cv2.imread(img_path)
-                except (IOError, OSError) as error:
-                    print(f'Read {img_path} error: {error}')
-                    status = False
-                if img is None:
-                    status = False
-                    print(f'Img is None: {img_path}')
-            if status:
-                # get the relative path
-                img_name = os.path.relpath(img_path, root)
-                print(img_name)
-                txt_file.write(f'{img_name}\n')
+        img_paths.extend((img_path, root) for img_path in sorted(glob.glob(os.path.join(folder, '*'))))
+
+    if args.check or args.full_check:
+        # read the image headers (or the whole images) to check them, as some images may have errors
+        cache = ImageInfoCache(args.cache) if args.cache else None
+        with tqdm(total=len(img_paths), unit='image', desc='Check') as pbar:
+            img_sizes = scan_image_sizes([img_path for img_path, _ in img_paths], args.n_thread, cache, args.full_check,
+                                         pbar.update)
+        if cache is not None:
+            cache.close()
+    else:
+        img_sizes = [True] * len(img_paths)
+
+    num_images = 0
+    with open(args.meta_info, 'w') as txt_file:
+        for (img_path, root), img_size in zip(img_paths, img_sizes):
+            if img_size is None:
+                print(f'Read {img_path} error, skipped')
+                continue
+            # get the relative path
+            img_name = os.path.relpath(img_path, root)
+            txt_file.write(f'{img_name}\n')
+            num_images += 1
+    print(f'{num_images} images written to {args.meta_info}')
 
 
 if __name__ == '__main__':
     """Generate meta info (txt file) for only Ground-Truth images.
 
     It can also generate meta info from several folders into one txt file.
+    With --check, the image headers are read by a thread pool and cached by file size and mtime, so that regenerating
+    the meta info of a large dataset only reads the new or changed images.
     """
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -48,11 +61,21 @@ if __name__ == '__main__':
         type=str,
         default='datasets/DF2K/meta_info/meta_info_DF2Kmultiscale.txt',
         help='txt path for meta info')
-    parser.add_argument('--check', action='store_true', help='Read image to check whether it is ok')
+    parser.add_argument('--check', action='store_true', help='Read image headers to check whether they are ok')
+    parser.add_argument('--full_check', action='store_true', help='Decode the whole images to check them')
+    parser.add_argument('--n_thread', type=int, default=16, help='Thread number for the check')
+    parser.add_argument(
+        '--cache',
+        type=str,
+        default=None,
+        help='Cache of the checked images. Default: next to the meta info, '
+        "'' to disable")
     args = parser.parse_args()
 
     assert len(args.input) == len(args.root), ('Input folder and folder root should have the same length, but got '
                                                f'{len(args.input)} and {len(args.root)}.')
     os.makedirs(os.path.dirname(args.meta_info), exist_ok=True)
+    if args.cache is None:
+        args.cache = f'{osp.splitext(args.meta_info)[0]}_cache.db'
 
     main(args)
@@ -1,10 +1,15 @@
 import argparse
 import glob
 import os
+import sys
+from os import path as osp
+from tqdm import tqdm
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+from realesrgan.data.image_info import ImageInfoCache, scan_image_sizes  # noqa: E402
 
 
 def main(args):
-    txt_file = open(args.meta_info, 'w')
     # sca images
     img_paths_gt = sorted(glob.glob(os.path.join(args.input[0], '*')))
     img_paths_lq = sorted(glob.glob(os.path.join(args.input[1], '*')))
@@ -12,16 +17,43 @@ def main(args):
     assert len(img_paths_gt) == len(img_paths_lq), ('GT folder and LQ folder should have the same length, but got '
                                                     f'{len(img_paths_gt)} and {len(img_paths_lq)}.')
 
-    for img_path_gt, img_path_lq in zip(img_paths_gt, img_paths_lq):
-        # get the relative paths
-        img_name_gt = os.path.relpath(img_path_gt, args.root[0])
-        img_name_lq = os.path.relpath(img_path_lq, args.root[1])
-        print(f'{img_name_gt}, {img_name_lq}')
-        txt_file.write(f'{img_name_gt}, {img_name_lq}\n')
+    if args.scale is not None or args.full_check:
+        # read the image headers to check that every GT image is scale times larger than its LQ image
+        cache = ImageInfoCache(args.cache) if args.cache else None
+        with tqdm(total=2 * len(img_paths_gt), unit='image', desc='Check') as pbar:
+            img_sizes = scan_image_sizes(img_paths_gt + img_paths_lq, args.n_thread, cache, args.full_check,
+                                         pbar.update)
+        if cache is not None:
+            cache.close()
+        img_sizes_gt, img_sizes_lq = img_sizes[:len(img_paths_gt)], img_sizes[len(img_paths_gt):]
+    else:
+        img_sizes_gt = img_sizes_lq = [True] * len(img_paths_gt)
+
+    num_pairs = 0
+    with open(args.meta_info, 'w') as txt_file:
+        for img_path_gt, img_path_lq, size_gt, size_lq in zip(img_paths_gt, img_paths_lq, img_sizes_gt, img_sizes_lq):
+            if size_gt is None or size_lq is None:
+                print(f'Read {img_path_gt if size_gt is None else img_path_lq} error, skipped')
+                continue
+            if args.scale is not None and size_gt != (size_lq[0] * args.scale, size_lq[1] * args.scale):
+                print(f'Scale mismatch: {img_path_gt} {size_gt} and {img_path_lq} {size_lq} '
+                      f'are not x{args.scale}, skipped')
+                continue
+            # get the relative paths
+            img_name_gt = os.path.relpath(img_path_gt, args.root[0])
+            img_name_lq = os.path.relpath(img_path_lq, args.root[1])
+            txt_file.write(f'{img_name_gt}, {img_name_lq}\n')
+            num_pairs += 1
+    print(f'{num_pairs} pairs written to {args.meta_info}, {len(img_paths_gt) - num_pairs} skipped')
+    if num_pairs == 0 and img_paths_gt:
+        sys.exit('Every pair was skipped, check the folders and --scale.')
 
 
 if __name__ == '__main__':
     """This script is used to generate meta info (txt file) for paired images.
+
+    With --scale, the image headers are read by a thread pool to check the GT/LQ scale, and cached by file size and
+    mtime, so that regenerating the meta info of a large dataset only reads the new or changed images.
     """
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -35,11 +67,23 @@ if __name__ == '__main__':
         type=str,
         default='datasets/DF2K/meta_info/meta_info_DIV2K_sub_pair.txt',
         help='txt path for meta info')
+    parser.add_argument(
+        '--scale', type=int, default=None, help='Skip the pairs whose GT is not scale times larger than the LQ')
+    parser.add_argument('--full_check', action='store_true', help='Decode the whole images to check them')
+    parser.add_argument('--n_thread', type=int, default=16, help='Thread number for the check')
+    parser.add_argument(
+        '--cache',
+        type=str,
+        default=None,
+        help='Cache of the checked images. Default: next to the meta info, '
+        "'' to disable")
     args = parser.parse_args()
 
     assert len(args.input) == 2, 'Input folder should have two elements: gt folder and lq folder'
     assert len(args.root) == 2, 'Root path should have two elements: root for gt folder and lq folder'
     os.makedirs(os.path.dirname(args.meta_info), exist_ok=True)
+    if args.cache is None:
+        args.cache = f'{osp.splitext(args.meta_info)[0]}_cache.db'
     for i in range(2):
         if args.input[i].endswith('/'):
             args.input[i] = args.input[i][:-1]
@@ -1,38 +1,188 @@
 import argparse
 import glob
+import io
+import lmdb
 import os
+import sys
+from multiprocessing import Pool
+from os import path as osp
 from PIL import Image
+from tqdm import tqdm
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+from realesrgan.manifest import Manifest, params_fingerprint  # noqa: E402
+
+# For DF2K, we consider the following three scales,
+# and the smallest image whose shortest edge is 400
+SCALE_LIST = [0.75, 0.5, 1 / 3]
+SHORTEST_EDGE = 400
+
+
+def multiscale_images(path):
+    """Decode an image once and resize it to all the scales with LANCZOS resampling.
+
+    Yields:
+        tuple: Name (e.g. 0001T0) and resized PIL image, for each scale and then the smallest image whose shortest
+            edge is 400.
+    """
+    basename = os.path.splitext(os.path.basename(path))[0]
+    img = Image.open(path)
+    img.load()
+    width, height = img.size
+    for idx, scale in enumerate(SCALE_LIST):
+        yield f'{basename}T{idx}', img.resize((int(width * scale), int(height * scale)), resample=Image.LANCZOS)
+
+    # the smallest image which the shortest edge is 400
+    if width < height:
+        ratio = height / width
+        width = SHORTEST_EDGE
+        height = int(width * ratio)
+    else:
+        ratio = width / height
+        height = SHORTEST_EDGE
+        width = int(height * ratio)
+    yield f'{basename}T{len(SCALE_LIST)}', img.resize((int(width), int(height)), resample=Image.LANCZOS)
+
+
+def worker(args):
+    """Write the multi-scale images of one image as PNG files, or return them PNG-encoded with ``lmdb``.
+
+    Args:
+        args (tuple): Index and path of the image, the output folder, whether to encode for LMDB and the PNG
+            compression level.
+
+    Returns:
+        tuple: The index, path and a list of (key, PNG bytes, (h, w, c)) with ``lmdb``, otherwise None.
+    """
+    index, path, output, to_lmdb, compress_level = args
+    if not to_lmdb:
+        for name, img in multiscale_images(path):
+            img.save(os.path.join(output, f'{name}.png'))
+        return index, path, None
+    encoded = []
+    for name, img in multiscale_images(path):
+        buf = io.BytesIO()
+        img.save(buf, format='PNG', compress_level=compress_level)
+        encoded.append((name, buf.getvalue(), (img.size[1], img.size[0], len(img.getbands()))))
+    return index, path, encoded
+
+
+class LmdbShardWriter():
+    """Appends images to LMDB shards with their meta_info.txt, resumable after an interruption.
+
+    The meta_info lines of a transaction are written after it is committed, and keys that are already in a
+    meta_info.txt are not listed again, so the meta information always matches the committed images.
+
+    Args:
+        lmdb_paths (list[str]): Paths of the shards, ending with '.lmdb'. Existing shards are appended to.
+        compress_level (int): PNG compression level, recorded in the meta information.
+        map_size (int): Map size of the LMDB environments. Default: 1024 ** 4, 1TB.
+    """
+
+    def __init__(self, lmdb_paths, compress_level, map_size=1024**4):
+        self.compress_level = compress_level
+        self.envs = []
+        self.txns = []
+        self.meta_files = []
+        self.pending = []
+        self.listed = set()
+        for lmdb_path in lmdb_paths:
+            if not lmdb_path.endswith('.lmdb'):
+                raise ValueError("lmdb_path must end with '.lmdb'.")
+            env = lmdb.open(lmdb_path, map_size=map_size)
+            meta_path = osp.join(lmdb_path, 'meta_info.txt')
+            if osp.exists(meta_path):
+                with open(meta_path) as fin:
+                    self.listed.update(line.split('.')[0] for line in fin)
+            self.envs.append(env)
+            self.txns.append(env.begin(write=True))
+            self.meta_files.append(open(meta_path, 'a'))
+            self.pending.append([])
+
+    def put(self, shard, key, img_byte, img_shape):
+        self.txns[shard].put(key.encode('ascii'), img_byte)
+        if key not in self.listed:
+            h, w, c = img_shape
+            self.pending[shard].append(f'{key}.png ({h},{w},{c}) {self.compress_level}\n')
+            self.listed.add(key)
+
+    def commit(self):
+        for shard, env in enumerate(self.envs):
+            self.txns[shard].commit()
+            self.meta_files[shard].writelines(self.pending[shard])
+            self.meta_files[shard].flush()
+            self.pending[shard] = []
+            self.txns[shard] = env.begin(write=True)
+
+    def close(self):
+        self.commit()
+        for env, txn, meta_file in zip(self.envs, self.txns, self.meta_files):
+            txn.abort()
+            env.close()
+            meta_file.close()
 
 
 def main(args):
-    # For DF2K, we consider the following three scales,
-    # and the smallest image whose shortest edge is 400
-    scale_list = [0.75, 0.5, 1 / 3]
-    shortest_edge = 400
+    """Generate the multi-scale images of a folder with a process pool.
 
+    Every source image is decoded once and resized to all the scales. A manifest of the completed source images
+    (see :class:`Manifest`) lets an interrupted run resume where it stopped. With ``--lmdb``, the images are written
+    into LMDB shards (named after the output with a shard suffix when ``--num_shards`` > 1), with their
+    meta_info.txt, instead of PNG files.
+    """
     path_list = sorted(glob.glob(os.path.join(args.input, '*')))
-    for path in path_list:
-        print(path)
+    output = args.output.rstrip('/')
+    if args.lmdb:
+        if args.num_shards == 1:
+            lmdb_paths = [output]
+        else:
+            lmdb_paths = [f'{osp.splitext(output)[0]}_{shard:03d}.lmdb' for shard in range(args.num_shards)]
+    else:
+        os.makedirs(output, exist_ok=True)
+    # next to the output rather than in it, so that the output folder only contains images
+    manifest_path = f'{osp.splitext(output)[0]}_manifest.db'
+    params = {'scale_list': SCALE_LIST, 'shortest_edge': SHORTEST_EDGE, 'lmdb': args.lmdb}
+    if args.lmdb:
+        params.update(num_shards=args.num_shards, compression_level=args.compression_level)
+    manifest = Manifest(manifest_path, params_fingerprint(params))
+
+    def done_marker(index, path):
+        """Output whose existence the manifest checks: the last multi-scale image, or the shard."""
+        if args.lmdb:
+            return lmdb_paths[index % args.num_shards]
         basename = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(args.output, f'{basename}T{len(SCALE_LIST)}.png')
 
-        img = Image.open(path)
-        width, height = img.size
-        for idx, scale in enumerate(scale_list):
-            print(f'\t{scale:.2f}')
-            rlt = img.resize((int(width * scale), int(height * scale)), resample=Image.LANCZOS)
-            rlt.save(os.path.join(args.output, f'{basename}T{idx}.png'))
-
-        # save the smallest image which the shortest edge is 400
-        if width < height:
-            ratio = height / width
-            width = shortest_edge
-            height = int(width * ratio)
-        else:
-            ratio = width / height
-            height = shortest_edge
-            width = int(height * ratio)
-        rlt = img.resize((int(width), int(height)), resample=Image.LANCZOS)
-        rlt.save(os.path.join(args.output, f'{basename}T{idx+1}.png'))
+    todo = [(index, path) for index, path in enumerate(path_list)
+            if not manifest.is_up_to_date(osp.basename(path), path)]
+    print(f'Manifest {manifest_path}: {len(path_list) - len(todo)} images done, {len(todo)} to process')
+
+    writer = LmdbShardWriter(lmdb_paths, args.compression_level) if args.lmdb else None
+    completed = []  # images written but not committed yet (lmdb)
+    pbar = tqdm(total=len(todo), unit='image', desc='Multiscale')
+    try:
+        with Pool(args.n_thread) as pool:
+            jobs = [(index, path, args.output, args.lmdb, args.compression_level) for index, path in todo]
+            for index, path, encoded in pool.imap_unordered(worker, jobs):
+                if writer is None:
+                    manifest.record(osp.basename(path), path, done_marker(index, path))
+                else:
+                    for key, img_byte, img_shape in encoded:
+                        writer.put(index % args.num_shards, key, img_byte, img_shape)
+                    completed.append((index, path))
+                    if len(completed) >= args.commit_every:
+                        writer.commit()
+                        for index_done, path_done in completed:
+                            manifest.record(osp.basename(path_done), path_done, done_marker(index_done, path_done))
+                        completed = []
+                pbar.update(1)
+    finally:
+        pbar.close()
+        if writer is not None:
+            writer.close()
+            for index_done, path_done in completed:
+                manifest.record(osp.basename(path_done), path_done, done_marker(index_done, path_done))
+        manifest.close()
 
 
 if __name__ == '__main__':
@@ -41,8 +191,16 @@ if __name__ == '__main__':
     """
     parser = argparse.ArgumentParser()
     parser.add_argument('--input', type=str, default='datasets/DF2K/DF2K_HR', help='Input folder')
-    parser.add_argument('--output', type=str, default='datasets/DF2K/DF2K_multiscale', help='Output folder')
+    parser.add_argument(
+        '--output',
+        type=str,
+        default='datasets/DF2K/DF2K_multiscale',
+        help='Output folder, or LMDB path ending with .lmdb with --lmdb')
+    parser.add_argument('--n_thread', type=int, default=20, help='Thread number.')
+    parser.add_argument('--lmdb', action='store_true', help='Write LMDB shards instead of PNG files')
+    parser.add_argument('--num_shards', type=int, default=1, help='Number of LMDB databases with --lmdb')
+    parser.add_argument('--compression_level', type=int, default=1, help='PNG compression level with --lmdb')
+    parser.add_argument('--commit_every', type=int, default=50, help='Images per LMDB transaction with --lmdb')
     args = parser.parse_args()
 
-    os.makedirs(args.output, exist_ok=True)
     main(args)
@@ -1,6 +1,16 @@
+import cv2
+import numpy as np
+import os
 import pytest
+import random
+import torch
 import yaml
+from basicsr.utils.lmdb_util import LmdbMaker
+from scipy import stats
 
+from realesrgan import large_image
+from realesrgan.data.decoded_cache import DecodedImageCache
+from realesrgan.data.kernel_bank import KernelBank
 from realesrgan.data.realesrgan_dataset import RealESRGANDataset
 from realesrgan.data.realesrgan_paired_dataset import RealESRGANPairedDataset
 
@@ -79,6 +89,122 @@ def test_realesrgan_dataset():
         dataset = RealESRGANDataset(opt)
 
 
+def test_realesrgan_dataset_lmdb_shards(tmp_path):
+    with open('tests/data/test_realesrgan_dataset.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+
+    # one image per shard
+    db_paths = []
+    for shard, name in enumerate(['baboon', 'comic']):
+        db_path = str(tmp_path / f'gt_{shard:03d}.lmdb')
+        maker = LmdbMaker(db_path)
+        with open(f'tests/data/gt/{name}.png', 'rb') as f:
+            img_byte = f.read()
+        maker.put(img_byte, name, cv2.imread(f'tests/data/gt/{name}.png').shape)
+        maker.close()
+        db_paths.append(db_path)
+    opt['dataroot_gt'] = db_paths
+    opt['io_backend']['type'] = 'lmdb'
+
+    dataset = RealESRGANDataset(opt)
+    assert dataset.paths == ['baboon', 'comic']
+    result = dataset.__getitem__(1)
+    assert result['gt'].shape == (3, 400, 400)
+    assert result['gt_path'] == 'comic'
+
+
+def test_realesrgan_dataset_region_read(tmp_path):
+    with open('tests/data/test_realesrgan_dataset.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    opt['use_rot'] = True
+    # the same images as .npy arrays in RGB order
+    for name in ['baboon', 'comic']:
+        np.save(tmp_path / f'{name}.npy', cv2.imread(f'tests/data/gt/{name}.png')[..., ::-1])
+    (tmp_path / 'meta_info.txt').write_text('baboon.npy\ncomic.npy\n')
+    opt_npy = dict(opt, dataroot_gt=str(tmp_path), meta_info=str(tmp_path / 'meta_info.txt'))
+    opt_npy['io_backend'] = dict(opt['io_backend'])
+    io_backend = dict(opt['io_backend'])  # the datasets pop its type
+
+    dataset = RealESRGANDataset(opt)
+    dataset_npy = RealESRGANDataset(opt_npy)
+    assert isinstance(dataset_npy.read_gt(dataset_npy.paths[0], 'gt'), np.memmap)
+    # cropping the memory-mapped image gives the same samples as decoding it
+    for seed in range(8):
+        np.random.seed(seed)
+        random.seed(seed)
+        result = dataset.__getitem__(seed % 2)
+        np.random.seed(seed)
+        random.seed(seed)
+        result_npy = dataset_npy.__getitem__(seed % 2)
+        assert torch.equal(result['gt'], result_npy['gt'])
+
+    # gray images, smaller than the 400x400 crop (padded) and larger
+    np.save(tmp_path / 'small.npy', np.random.randint(0, 255, (100, 120), dtype=np.uint8))
+    np.save(tmp_path / 'large.npy', np.random.randint(0, 255, (500, 520), dtype=np.uint8))
+    (tmp_path / 'meta_info.txt').write_text('small.npy\nlarge.npy\n')
+    dataset_gray = RealESRGANDataset(dict(opt_npy, io_backend=io_backend))
+    for index in range(2):
+        assert dataset_gray.__getitem__(index)['gt'].shape == (3, 400, 400)
+
+
+def test_realesrgan_dataset_tiff_without_tifffile(tmp_path, monkeypatch):
+    with open('tests/data/test_realesrgan_dataset.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    # uncompressed, so that it would be memory-mapped with tifffile
+    cv2.imwrite(str(tmp_path / 'baboon.tif'), cv2.imread('tests/data/gt/baboon.png'), [cv2.IMWRITE_TIFF_COMPRESSION, 1])
+    (tmp_path / 'meta_info.txt').write_text('baboon.tif\n')
+    opt.update(dataroot_gt=str(tmp_path), meta_info=str(tmp_path / 'meta_info.txt'))
+
+    def missing_tifffile():
+        raise ImportError('tifffile')
+
+    # without tifffile, TIFF images are decoded as before
+    monkeypatch.setattr(large_image, '_import_tifffile', missing_tifffile)
+    dataset = RealESRGANDataset(opt)
+    assert dataset.__getitem__(0)['gt'].shape == (3, 400, 400)
+
+
+def kernel_statistics(kernels):
+    """Peak value and spread (mean squared distance from the centre) of each kernel."""
+    kernels = np.stack(kernels)
+    yy, xx = np.mgrid[-10:11, -10:11]
+    return kernels.max(axis=(1, 2)), (kernels * (yy**2 + xx**2)).sum(axis=(1, 2))
+
+
+def test_realesrgan_dataset_kernel_bank(tmp_path):
+    with open('tests/data/test_realesrgan_dataset.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    opt['sinc_prob'] = 0.1
+    opt['sinc_prob2'] = 0.1
+    opt['final_sinc_prob'] = 0.8
+    opt['kernel_bank_size'] = 1000
+    opt['kernel_bank_cache'] = str(tmp_path / 'kernel_bank.npz')
+
+    opt_fly = dict(opt, kernel_bank_size=0, io_backend=dict(opt['io_backend']))
+    np.random.seed(0)
+    random.seed(0)
+    dataset = RealESRGANDataset(opt)
+    assert dataset.kernel_bank is not None
+    result = dataset.__getitem__(0)
+    assert result['kernel1'].shape == (21, 21)
+    assert result['kernel2'].shape == (21, 21)
+    assert result['sinc_kernel'].shape == (21, 21)
+
+    # drawn kernels follow the distribution of kernels generated per sample
+    dataset_fly = RealESRGANDataset(opt_fly)
+    for stage, sinc_prob in [('kernel1', 0.1), ('kernel2', 0.1)]:
+        banked = kernel_statistics([dataset.random_kernel(stage, sinc_prob) for _ in range(1000)])
+        on_the_fly = kernel_statistics([dataset_fly.random_kernel(stage, sinc_prob) for _ in range(1000)])
+        for values_bank, values_fly in zip(banked, on_the_fly):
+            assert stats.ks_2samp(values_bank, values_fly).pvalue > 1e-3
+
+    # the cache is reused when the settings match, and regenerated otherwise
+    bank = KernelBank(dataset.blur_settings, dataset.kernel_range, 1000, opt['kernel_bank_cache'])
+    np.testing.assert_array_equal(bank.pools['kernel1'], dataset.kernel_bank.pools['kernel1'])
+    bank = KernelBank(dataset.blur_settings, dataset.kernel_range, 10, opt['kernel_bank_cache'])
+    assert bank.pools['kernel1'].shape == (10, 21, 21)
+
+
 def test_realesrgan_paired_dataset():
 
     with open('tests/data/test_realesrgan_paired_dataset.yml', mode='r') as f:
@@ -149,3 +275,52 @@ def test_realesrgan_paired_dataset():
     # check shape and contents
     assert result['gt'].shape == (3, 128, 128)
     assert result['lq'].shape == (3, 32, 32)
+
+
+def test_realesrgan_paired_dataset_decoded_cache(tmp_path):
+    with open('tests/data/test_realesrgan_paired_dataset.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    opt_cache = dict(opt, io_backend=dict(opt['io_backend']), decoded_cache_dir=str(tmp_path / 'cache'))
+
+    dataset = RealESRGANPairedDataset(opt)
+    dataset_cache = RealESRGANPairedDataset(opt_cache)
+    for _ in range(2):  # decoded, then read from the cache
+        for index in range(len(dataset)):
+            np.random.seed(index)
+            random.seed(index)
+            result = dataset.__getitem__(index)
+            np.random.seed(index)
+            random.seed(index)
+            result_cache = dataset_cache.__getitem__(index)
+            assert torch.equal(result['gt'], result_cache['gt'])
+            assert torch.equal(result['lq'], result_cache['lq'])
+    assert len(list((tmp_path / 'cache').iterdir())) == 4
+
+    # a changed image is decoded again instead of read from the cache
+    path = str(tmp_path / 'img.png')
+    cv2.imwrite(path, np.zeros((8, 8, 3), dtype=np.uint8))
+    assert dataset_cache.read_image(path, 'gt').max() == 0
+    cv2.imwrite(path, np.full((8, 8, 3), 255, dtype=np.uint8))
+    os.utime(path, ns=(0, 10**9))  # a different mtime, even with a coarse file system clock
+    assert dataset_cache.read_image(path, 'gt').min() == 255
+
+
+def test_decoded_image_cache(tmp_path, monkeypatch):
+    img = np.zeros((100, 100, 3), dtype=np.uint8)
+    cache = DecodedImageCache(str(tmp_path), max_bytes=2.5 * img.nbytes)
+    for key in ['a', 'b']:
+        assert cache.get(key, lambda: img) is img
+    os.utime(cache._path('a'), (1, 1))
+    os.utime(cache._path('b'), (2, 2))
+    assert cache.get('c', lambda: img) is img
+    # 'a' is the least recently used and evicted
+    assert not os.path.exists(cache._path('a'))
+    assert isinstance(cache.get('c', lambda: None), np.memmap)
+    assert cache.get('a', lambda: img) is img
+
+    # an image evicted by another worker after it was memory-mapped is still returned
+    def utime_evicted(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, 'utime', utime_evicted)
+    assert isinstance(cache.get('a', lambda: None), np.memmap)
@@ -0,0 +1,41 @@
+import torch
+import yaml
+from basicsr.utils import DiffJPEG
+from torch.nn import functional as F
+
+from realesrgan.models.degradations import (resize_per_sample, second_order_degradation,
+                                            second_order_degradation_per_sample)
+
+
+def test_resize_per_sample():
+    img = torch.rand(3, 3, 20, 24)
+    sizes = [(20, 24), (16, 16), (20, 24)]
+    out_sizes = [(10, 12), (18, 14), (10, 12)]
+    modes = ['bicubic', 'area', 'bicubic']
+    out = resize_per_sample(img, sizes, out_sizes, modes)
+    assert out.shape == (3, 3, 18, 14)
+    for i, ((h, w), (out_h, out_w), mode) in enumerate(zip(sizes, out_sizes, modes)):
+        expected = F.interpolate(img[i:i + 1, :, :h, :w], size=(out_h, out_w), mode=mode)
+        assert torch.allclose(out[i:i + 1, :, :out_h, :out_w], expected)
+    # the rest of the canvas replicates the borders
+    assert torch.equal(out[0, :, 10:, :12], out[0, :, 9:10, :12].expand(3, 8, 12))
+
+
+def test_second_order_degradation():
+    with open('tests/data/test_realesrgan_model.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    opt['gaussian_noise_prob'] = 0.5
+    opt['gaussian_noise_prob2'] = 0.5
+    opt['second_blur_prob'] = 0.5
+    jpeger = DiffJPEG(differentiable=False)
+
+    gt = torch.rand((4, 3, 64, 64), dtype=torch.float32)
+    kernel = torch.zeros((4, 5, 5), dtype=torch.float32)
+    kernel[:, 2, 2] = 1
+    for degradation in (second_order_degradation, second_order_degradation_per_sample):
+        for _ in range(5):
+            lq = degradation(gt, kernel, kernel, kernel, opt, jpeger)
+            assert lq.shape == (4, 3, 16, 16)
+            assert lq.min() >= 0 and lq.max() <= 1
+            # rounded to 8 bits
+            assert torch.allclose(lq * 255, (lq * 255).round(), atol=1e-4)
@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+import os
+
+from realesrgan.data.image_info import ImageInfoCache, read_image_size, scan_image_sizes
+
+
+def test_read_image_size(tmp_path):
+    cv2.imwrite(str(tmp_path / 'a.png'), np.zeros((12, 20, 3), dtype=np.uint8))
+    np.save(str(tmp_path / 'b.npy'), np.zeros((8, 6, 3), dtype=np.uint8))
+    (tmp_path / 'c.png').write_bytes(b'not an image')
+    assert read_image_size(str(tmp_path / 'a.png')) == (12, 20)
+    assert read_image_size(str(tmp_path / 'a.png'), full_check=True) == (12, 20)
+    assert read_image_size(str(tmp_path / 'b.npy')) == (8, 6)
+    assert read_image_size(str(tmp_path / 'c.png')) is None
+    assert read_image_size(str(tmp_path / 'c.png'), full_check=True) is None
+
+    # a truncated image has a valid header, only the full check catches it
+    png = cv2.imencode('.png', np.random.randint(0, 255, (64, 64, 3), dtype=np.uint8))[1].tobytes()
+    (tmp_path / 'd.png').write_bytes(png[:len(png) // 2])
+    assert read_image_size(str(tmp_path / 'd.png')) == (64, 64)
+    assert read_image_size(str(tmp_path / 'd.png'), full_check=True) is None
+
+
+def test_scan_image_sizes(tmp_path):
+    paths = []
+    for i in range(5):
+        path = str(tmp_path / f'{i}.png')
+        cv2.imwrite(path, np.zeros((10 + i, 20, 3), dtype=np.uint8))
+        paths.append(path)
+    db_path = str(tmp_path / 'cache.db')
+    cache = ImageInfoCache(db_path)
+    assert scan_image_sizes(paths, num_threads=2, cache=cache, chunk_size=2) == [(10 + i, 20) for i in range(5)]
+    cache.close()
+
+    # the cached sizes are used while the file size and mtime match
+    stat = os.stat(paths[0])
+    with open(paths[0], 'r+b') as f:
+        f.write(b'\x00')
+    os.utime(paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    cache = ImageInfoCache(db_path)
+    assert scan_image_sizes(paths, cache=cache)[0] == (10, 20)
+    # and the images are read again when they change
+    cv2.imwrite(paths[1], np.zeros((30, 40, 3), dtype=np.uint8))
+    assert scan_image_sizes(paths, cache=cache)[:2] == [(10, 20), (30, 40)]
+    # a header read is not reused for a full check
+    assert scan_image_sizes(paths, cache=cache, full_check=True)[0] is None
+    cache.close()
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import shutil
+
+from realesrgan.interpolation import BlendInterpolator, FlowInterpolator, MinterpolateInterpolator, build_interpolator
+
+
+def run_interpolator(interpolator, frames, drop_last=False):
+    outputs = []
+    for frame in frames:
+        outputs += interpolator.push(frame)
+    outputs += interpolator.flush(drop_last=drop_last)
+    return outputs
+
+
+def test_blend_interpolator():
+    frames = [np.full((4, 6, 3), value, dtype=np.uint8) for value in (0, 100, 200)]
+    outputs = run_interpolator(BlendInterpolator(), frames)
+    assert [int(out[0, 0, 0]) for out in outputs] == [0, 50, 100, 150, 200, 200]
+
+    # the last frame is context only: it is neither output nor repeated
+    outputs = run_interpolator(BlendInterpolator(), frames, drop_last=True)
+    assert [int(out[0, 0, 0]) for out in outputs] == [0, 50, 100, 150]
+
+    assert run_interpolator(BlendInterpolator(), []) == []
+
+
+def test_flow_interpolator():
+    # a square moving 8 pixels to the right; the middle frame has it half way
+    frames = []
+    for x in (8, 16):
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        frame[16:32, x:x + 16] = 255
+        frames.append(frame)
+    outputs = run_interpolator(FlowInterpolator(flow_width=32), frames)
+    assert len(outputs) == 4
+    assert all(out.shape == (48, 64, 3) and out.dtype == np.uint8 for out in outputs)
+    middle = outputs[1].astype(np.float32).mean(axis=(0, 2))
+    assert middle[12:28].mean() > middle[8:12].mean()
+    assert middle[12:28].mean() > middle[28:32].mean()
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is not installed')
+def test_minterpolate_interpolator():
+    frames = []
+    for x in range(0, 40, 8):
+        frame = np.zeros((32, 48, 3), dtype=np.uint8)
+        frame[8:24, x:x + 8] = 255
+        frames.append(frame)
+    for mi_mode in ['mci', 'blend']:
+        outputs = run_interpolator(MinterpolateInterpolator(fps=25, mi_mode=mi_mode), frames)
+        assert len(outputs) == 2 * len(frames)
+        assert all(out.shape == (32, 48, 3) and out.dtype == np.uint8 for out in outputs)
+        outputs = run_interpolator(MinterpolateInterpolator(fps=25, mi_mode=mi_mode), frames, drop_last=True)
+        assert len(outputs) == 2 * len(frames) - 2
+
+    assert run_interpolator(MinterpolateInterpolator(fps=25), []) == []
+
+
+def test_build_interpolator():
+    assert isinstance(build_interpolator('flow'), FlowInterpolator)
+    with pytest.raises(ValueError):
+        build_interpolator('rife')
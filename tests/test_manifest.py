@@ -0,0 +1,46 @@
+import os
+
+from realesrgan.manifest import Manifest, in_shard, params_fingerprint
+
+
+def test_manifest(tmp_path):
+    inp = tmp_path / 'a.png'
+    out = tmp_path / 'a_out.png'
+    inp.write_bytes(b'input')
+    out.write_bytes(b'output')
+    db_path = str(tmp_path / 'manifest.db')
+    fingerprint = params_fingerprint({'model_name': 'RealESRGAN_x4plus', 'outscale': 4})
+
+    manifest = Manifest(db_path, fingerprint)
+    assert not manifest.is_up_to_date('a.png', str(inp))
+    manifest.record('a.png', str(inp), str(out))
+    manifest.close()
+
+    # records survive a restart
+    manifest = Manifest(db_path, fingerprint)
+    assert manifest.is_up_to_date('a.png', str(inp))
+    # a new mtime with the same content is still up to date
+    stat = os.stat(inp)
+    os.utime(inp, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert manifest.is_up_to_date('a.png', str(inp))
+    # changed content, missing output or other parameters are not
+    inp.write_bytes(b'INPUT')
+    assert not manifest.is_up_to_date('a.png', str(inp))
+    manifest.record('a.png', str(inp), str(out))
+    assert manifest.is_up_to_date('a.png', str(inp))
+    manifest.close()
+    manifest = Manifest(db_path, params_fingerprint({'model_name': 'RealESRGAN_x4plus', 'outscale': 2}))
+    assert not manifest.is_up_to_date('a.png', str(inp))
+    manifest.close()
+    out.unlink()
+    manifest = Manifest(db_path, fingerprint)
+    assert not manifest.is_up_to_date('a.png', str(inp))
+    manifest.close()
+
+
+def test_in_shard():
+    keys = [f'img_{i:05d}.png' for i in range(1000)]
+    shards = [[key for key in keys if in_shard(key, idx, 4)] for idx in range(4)]
+    # every key is in exactly one shard, and the shards are roughly balanced
+    assert sorted(sum(shards, [])) == keys
+    assert all(200 < len(shard) < 300 for shard in shards)
@@ -0,0 +1,34 @@
+import pytest
+import torch
+
+from realesrgan.models.mixed_precision import MixedPrecision
+
+
+def test_mixed_precision():
+    cpu = torch.device('cpu')
+    net = torch.nn.Conv2d(3, 4, 3, padding=1)
+    x = torch.rand(2, 3, 8, 8)
+
+    # disabled by default: fp32 and NCHW
+    mixed_precision = MixedPrecision({}, cpu)
+    with mixed_precision.autocast():
+        assert net(x).dtype == torch.float32
+    assert mixed_precision.memory_format(x) is x
+    assert not mixed_precision.grad_scaler().is_enabled()
+
+    # bf16 autocast runs on the CPU, without gradient scaling
+    mixed_precision = MixedPrecision({'mixed_precision': 'bf16', 'channels_last': True}, cpu)
+    net = mixed_precision.memory_format(net)
+    assert net.weight.is_contiguous(memory_format=torch.channels_last)
+    with mixed_precision.autocast():
+        out = net(mixed_precision.memory_format(x))
+    assert out.dtype == torch.bfloat16
+    scaler = mixed_precision.grad_scaler()
+    assert not scaler.is_enabled()
+    scaler.scale(out.float().mean()).backward()
+    assert net.weight.grad.dtype == torch.float32
+
+    with pytest.raises(ValueError):
+        MixedPrecision({'mixed_precision': 'fp16'}, cpu)
+    with pytest.raises(ValueError):
+        MixedPrecision({'mixed_precision': 'fp8'}, cpu)
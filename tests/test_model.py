@@ -45,6 +45,13 @@ def test_realesrnet_model():
     assert model.lq.shape == (1, 3, 8, 8)
     assert model.gt.shape == (1, 3, 32, 32)
 
+    # per-sample degradations without the training pair pool
+    model.opt['per_sample_degradation'] = True
+    model.queue_size = 0
+    model.feed_data(data)
+    assert model.lq.shape == (1, 3, 8, 8)
+    assert model.gt.shape == (1, 3, 32, 32)
+
     # ----------------- test nondist_validation -------------------- #
     # construct dataloader
     dataset_opt = dict(
@@ -60,6 +67,19 @@ def test_realesrnet_model():
     model.nondist_validation(dataloader, 1, None, False)
     assert model.is_train is True
 
+    # ----------------- test optimize_parameters with bf16 autocast and channels_last -------------------- #
+    # reload the options, as building the first model popped the optimizer types
+    with open('tests/data/test_realesrnet_model.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    opt['train'].update(mixed_precision='bf16', channels_last=True)
+    model = RealESRNetModel(opt)
+    assert model.net_g.conv_first.weight.is_contiguous(memory_format=torch.channels_last)
+    model.feed_data(data)
+    model.optimize_parameters(1)
+    assert model.output.shape == (1, 3, 32, 32)
+    assert model.output.dtype == torch.bfloat16
+    assert 'l_pix' in model.log_dict
+
 
 def test_realesrgan_model():
     with open('tests/data/test_realesrgan_model.yml', mode='r') as f:
@@ -101,6 +121,13 @@ def test_realesrgan_model():
     assert model.lq.shape == (1, 3, 8, 8)
     assert model.gt.shape == (1, 3, 32, 32)
 
+    # per-sample degradations without the training pair pool
+    model.opt['per_sample_degradation'] = True
+    model.queue_size = 0
+    model.feed_data(data)
+    assert model.lq.shape == (1, 3, 8, 8)
+    assert model.gt.shape == (1, 3, 32, 32)
+
     # ----------------- test nondist_validation -------------------- #
     # construct dataloader
     dataset_opt = dict(
@@ -124,3 +151,16 @@ def test_realesrgan_model():
     # check returned keys
     expected_keys = ['l_g_pix', 'l_g_percep', 'l_g_gan', 'l_d_real', 'out_d_real', 'l_d_fake', 'out_d_fake']
     assert set(expected_keys).issubset(set(model.log_dict.keys()))
+
+    # ----------------- test optimize_parameters with bf16 autocast and channels_last -------------------- #
+    # reload the options, as building the first model popped the optimizer types
+    with open('tests/data/test_realesrgan_model.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    opt['train'].update(mixed_precision='bf16', channels_last=True)
+    model = RealESRGANModel(opt)
+    assert model.net_d.conv0.weight.is_contiguous(memory_format=torch.channels_last)
+    model.feed_data(data)
+    model.optimize_parameters(1)
+    assert model.output.shape == (1, 3, 32, 32)
+    assert model.output.dtype == torch.bfloat16
+    assert set(expected_keys).issubset(set(model.log_dict.keys()))
@@ -0,0 +1,25 @@
+import torch
+
+from realesrgan.models.pair_pool import TrainingPairPool
+
+
+def test_training_pair_pool():
+    pool = TrainingPairPool(6)
+    # samples are numbered by their value, the GT of a pair is twice its LQ
+    batches = [torch.arange(i * 2, i * 2 + 2, dtype=torch.float32).view(2, 1, 1, 1) for i in range(10)]
+
+    # the first batches fill the pool and are returned unchanged
+    for lq in batches[:3]:
+        lq_out, gt_out = pool.dequeue_and_enqueue(lq, lq.expand(2, 1, 2, 2) * 2)
+        assert torch.equal(lq_out, lq)
+        assert gt_out.shape == (2, 1, 2, 2)
+
+    for lq in batches[3:]:
+        in_pool = set(pool.pool_lq.flatten().tolist())
+        lq_out, gt_out = pool.dequeue_and_enqueue(lq, lq.expand(2, 1, 2, 2) * 2)
+        out = lq_out.flatten().tolist()
+        # two distinct pairs of the pool come out, and the new pairs take their slots
+        assert len(set(out)) == 2 and set(out) <= in_pool
+        assert torch.equal(gt_out, lq_out.expand(2, 1, 2, 2) * 2)
+        assert set(pool.pool_lq.flatten().tolist()) == in_pool - set(out) | set(lq.flatten().tolist())
+        assert torch.equal(pool.pool_gt, pool.pool_lq.expand(6, 1, 2, 2) * 2)
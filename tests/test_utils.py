@@ -1,7 +1,11 @@
+import cv2
 import numpy as np
+import pytest
+import torch
 from basicsr.archs.rrdbnet_arch import RRDBNet
 
-from realesrgan.utils import RealESRGANer
+from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+from realesrgan.utils import PrefetchReader, RealESRGANer
 
 
 def test_realesrganer():
@@ -85,3 +89,193 @@ def test_realesrganer():
     result = restorer.enhance(img, outscale=2, alpha_upsampler=None)
     assert result[0].shape == (8, 8, 4)
     assert result[1] == 'RGBA'
+
+
+@pytest.fixture
+def tiny_upsampler(tmp_path):
+    """Builds RealESRGANers of a tiny SRVGGNetCompact (x4 by default), with RealESRGANer options such as tile,
+    tile_blend or downsample_mode. The upsamplers of a scale share the model."""
+    models = {}
+
+    def build(scale=4, **kwargs):
+        if scale not in models:
+            model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=8, num_conv=2, upscale=scale, act_type='prelu')
+            model_path = str(tmp_path / f'srvgg_tiny_x{scale}.pth')
+            torch.save({'params': model.state_dict()}, model_path)
+            models[scale] = model, model_path
+        model, model_path = models[scale]
+        kwargs = dict(dict(tile=0, pre_pad=0, half=False), **kwargs)
+        return RealESRGANer(scale=scale, model_path=model_path, model=model, **kwargs)
+
+    return build
+
+
+def test_realesrganer_downsample(tiny_upsampler):
+    restorer = tiny_upsampler()
+
+    # ------------------ outscale below the network scale is resized on the device ---------------- #
+    img = (np.random.random((12, 10, 3)) * 255).astype(np.uint8)
+    result = restorer.enhance(img, outscale=2)
+    assert result[0].shape == (24, 20, 3)
+    assert result[0].dtype == np.uint8
+    # non-integer output sizes follow int(size * outscale), same as the cv2 path
+    result = restorer.enhance(img, outscale=1.5)
+    assert result[0].shape == (18, 15, 3)
+    restorer.downsample_mode = 'area'
+    result = restorer.enhance(img, outscale=2)
+    assert result[0].shape == (24, 20, 3)
+
+    # ------------------ alpha channel follows the same path ---------------- #
+    img = (np.random.random((12, 10, 4)) * 255).astype(np.uint8)
+    result = restorer.enhance(img, outscale=2)
+    assert result[0].shape == (24, 20, 4)
+    result = restorer.enhance(img, outscale=2, alpha_upsampler=None)
+    assert result[0].shape == (24, 20, 4)
+
+    # ------------------ outscale above the network scale still uses cv2 ---------------- #
+    img = (np.random.random((6, 5, 3)) * 255).astype(np.uint8)
+    result = restorer.enhance(img, outscale=6)
+    assert result[0].shape == (36, 30, 3)
+
+    # ------------------ unsupported modes are rejected up front ---------------- #
+    with pytest.raises(ValueError):
+        tiny_upsampler(downsample_mode='nearest')
+
+
+def test_realesrganer_enhance_batch(tiny_upsampler):
+    restorer = tiny_upsampler(pre_pad=2)
+
+    # ------------------ same-size 8-bit images are batched, with the same results as enhance ---------------- #
+    imgs = [(np.random.random((12, 10, 3)) * 255).astype(np.uint8) for _ in range(3)]
+    for outscale in [4, 2, 6]:
+        results = restorer.enhance_batch(imgs, outscale=outscale)
+        assert len(results) == 3
+        for img, (output, img_mode) in zip(imgs, results):
+            expected, _ = restorer.enhance(img, outscale=outscale)
+            assert img_mode == 'RGB'
+            assert output.shape == expected.shape and output.dtype == np.uint8
+            assert np.abs(output.astype(int) - expected.astype(int)).max() <= 1
+
+    # ------------------ other inputs fall back to enhance ---------------- #
+    imgs = [(np.random.random(shape) * 255).astype(np.uint8) for shape in [(12, 10, 4), (8, 8, 3)]]
+    results = restorer.enhance_batch(imgs, outscale=4)
+    assert [output.shape for output, _ in results] == [(48, 40, 4), (32, 32, 3)]
+    assert [img_mode for _, img_mode in results] == ['RGBA', 'RGB']
+
+
+def test_realesrganer_enhance_large(tmp_path, tiny_upsampler):
+    from realesrgan.large_image import create_large_image, open_large_image
+
+    restorer = tiny_upsampler(tile=8, tile_pad=2)
+
+    # ------------------ memory-mapped RGB input gives the same result as tiled enhance ---------------- #
+    img = (np.random.random((21, 17, 3)) * 255).astype(np.uint8)
+    np.save(tmp_path / 'in.npy', img)
+    output = create_large_image(str(tmp_path / 'out.npy'), (84, 68, 3), np.uint8)
+    restorer.enhance_large(open_large_image(str(tmp_path / 'in.npy')), output)
+    output.flush()
+    expected, _ = restorer.enhance(img[..., ::-1])
+    assert np.abs(np.load(tmp_path / 'out.npy').astype(int) - expected[..., ::-1].astype(int)).max() <= 1
+
+    # ------------------ gray 16-bit input ---------------- #
+    img = (np.random.random((9, 11)) * 65535).astype(np.uint16)
+    output = np.zeros((36, 44), dtype=np.uint16)
+    restorer.enhance_large(img, output)
+    assert output.any()
+
+    # ------------------ x2: the borders are padded to the mod scale as in enhance ---------------- #
+    restorer = tiny_upsampler(scale=2)
+    img = (np.random.random((21, 17, 3)) * 255).astype(np.uint8)
+    output = np.zeros((42, 34, 3), dtype=np.uint8)
+    restorer.enhance_large(img, output)
+    expected, _ = restorer.enhance(img[..., ::-1])
+    assert np.abs(output.astype(int) - expected[..., ::-1].astype(int)).max() <= 1
+
+    # an edge tile thinner than its padding
+    restorer = tiny_upsampler(scale=2, tile=8, tile_pad=0)
+    output = np.zeros((34, 34, 3), dtype=np.uint8)
+    restorer.enhance_large(img[:17], output)
+    assert output.any()
+
+
+def test_realesrganer_tile_blend(tiny_upsampler):
+    img = (np.random.random((21, 17, 3)) * 255).astype(np.uint8)
+    reference, _ = tiny_upsampler().enhance(img)
+
+    # feathered tiles stay close to the untiled result
+    for tile_blend in ['linear', 'cosine']:
+        restorer = tiny_upsampler(tile=8, tile_pad=4, tile_blend=tile_blend)
+        output, _ = restorer.enhance(img)
+        assert output.shape == reference.shape
+        assert np.abs(output.astype(int) - reference.astype(int)).mean() < 2
+
+        # complementary ramps: the weights of two overlapping neighbours sum to one
+        left = restorer.blend_weights(64, 48, (0, 64, 0, 32))[0, 0, 0]
+        right = restorer.blend_weights(64, 48, (0, 64, 16, 48))[0, 0, 0]
+        torch.testing.assert_close(left[16:] + right[:32], torch.ones(32))
+
+
+class LimitedMemoryModel(torch.nn.Module):
+    """Raises a CUDA-style out-of-memory error for inputs larger than ``max_pixels``."""
+
+    def __init__(self, model, max_pixels):
+        super().__init__()
+        self.model = model
+        self.max_pixels = max_pixels
+
+    def forward(self, x):
+        if x.shape[0] * x.shape[2] * x.shape[3] > self.max_pixels:
+            raise RuntimeError('CUDA out of memory. Tried to allocate 2.00 GiB')
+        return self.model(x)
+
+
+def test_realesrganer_out_of_memory(tiny_upsampler):
+    img = (np.random.random((40, 36, 3)) * 255).astype(np.uint8)
+    reference, _ = tiny_upsampler(tile=8, tile_pad=4).enhance(img)
+
+    restorer = tiny_upsampler(tile_pad=4, min_tile_size=4)
+    model = restorer.model
+    restorer.model = LimitedMemoryModel(model, max_pixels=16 * 16)
+
+    # ------------------ no tiles: falls back to tiles, split further until they fit ---------------- #
+    output, _ = restorer.enhance(img)
+    assert output.shape == reference.shape
+    assert 0 < restorer.tile_size <= 8  # remembered for the next image
+    tile_size = restorer.tile_size
+    # same tiles as a restorer started with that tile size
+    expected, _ = tiny_upsampler(tile=tile_size, tile_pad=4).enhance(img)
+    np.testing.assert_array_equal(output, expected)
+
+    # ------------------ batches fall back to single images ---------------- #
+    restorer.tile_size = 0
+    results = restorer.enhance_batch([img, img])
+    assert [result.shape for result, _ in results] == [reference.shape] * 2
+
+    # ------------------ below min_tile_size the error is raised ---------------- #
+    restorer.model = LimitedMemoryModel(model, max_pixels=1)
+    with pytest.raises(RuntimeError, match='out of memory'):
+        restorer.enhance(img)
+
+    # ------------------ other errors are not swallowed ---------------- #
+    restorer.model = lambda x: torch.zeros(1)[5]
+    with pytest.raises(IndexError):
+        restorer.enhance(img)
+
+
+def test_prefetch_reader(tmp_path):
+    paths = []
+    for i in range(20):
+        path = str(tmp_path / f'{i}.png')
+        cv2.imwrite(path, np.full((4, 4, 3), i, dtype=np.uint8))
+        paths.append(path)
+    (tmp_path / '1.png').write_bytes(b'not an image')
+
+    reader = PrefetchReader(paths, num_prefetch_queue=2)
+    reader.start()
+    imgs = list(reader)
+    reader.join(timeout=10)
+    assert not reader.is_alive()
+    # the unreadable image is yielded as None, and the images after it are still read
+    assert len(imgs) == 20
+    assert imgs[1] is None
+    assert [img[0, 0, 0] for i, img in enumerate(imgs) if i != 1] == [i for i in range(20) if i != 1]
@@ -0,0 +1,114 @@
+import io
+import numpy as np
+import pytest
+import subprocess
+import sys
+import time
+
+from realesrgan.video_io import FFmpegProcess, read_frame_into, run_ffmpeg, write_frame
+
+
+class ChunkedReader(io.RawIOBase):
+    """A pipe-like stream that returns at most ``chunk`` bytes per read."""
+
+    def __init__(self, data, chunk):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.chunk = chunk
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self.chunk, len(self.data) - self.pos)
+        buffer[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+def test_read_frame_into():
+    frames = np.random.randint(0, 256, (3, 4, 5, 3), dtype=np.uint8)
+    # short reads, as returned by pipes, are completed
+    stream = ChunkedReader(frames.tobytes(), chunk=7)
+    frame = np.empty((4, 5, 3), dtype=np.uint8)
+    for idx in range(3):
+        assert read_frame_into(stream, frame)
+        np.testing.assert_array_equal(frame, frames[idx])
+    assert not read_frame_into(stream, frame)
+
+    # a truncated last frame is dropped
+    stream = ChunkedReader(frames.tobytes()[:-1], chunk=1024)
+    assert read_frame_into(stream, frame)
+    assert read_frame_into(stream, frame)
+    assert not read_frame_into(stream, frame)
+
+
+def test_write_frame():
+    stream = io.BytesIO()
+    frame = np.random.randint(0, 256, (4, 5, 3), dtype=np.uint8)
+    write_frame(stream, frame)
+    # non-contiguous and non-uint8 frames are converted
+    write_frame(stream, frame[:, ::-1])
+    write_frame(stream, frame.astype(np.float32))
+    data = stream.getvalue()
+    assert len(data) == 3 * frame.nbytes
+    assert data[:frame.nbytes] == frame.tobytes()
+    assert data[frame.nbytes:2 * frame.nbytes] == np.ascontiguousarray(frame[:, ::-1]).tobytes()
+    assert data[2 * frame.nbytes:] == frame.tobytes()
+
+
+FAKE_FFMPEG = """#!{python}
+import sys, time
+args = sys.argv[1:]
+assert args[:3] == ['-progress', 'pipe:1', '-nostats'], args
+mode = args[3]
+sys.stderr.write('ffmpeg version fake\\n')
+for frame in range(3):
+    sys.stdout.write(f'frame={{frame}}\\nfps=30.0\\nout_time_us={{frame * 1000}}\\nprogress=continue\\n')
+    sys.stdout.flush()
+if mode == 'stall':
+    time.sleep(30)
+if mode == 'fail':
+    sys.stderr.write('Conversion failed!\\n')
+    sys.exit(1)
+sys.stdout.write('frame=3\\nprogress=end\\n')
+"""
+
+
+def make_fake_ffmpeg(tmp_path):
+    path = tmp_path / 'ffmpeg'
+    path.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    path.chmod(0o755)
+    return str(path)
+
+
+def test_run_ffmpeg(tmp_path):
+    ffmpeg_bin = make_fake_ffmpeg(tmp_path)
+
+    # progress blocks are parsed and passed to the callback, log lines end up in the ring buffer
+    blocks = []
+    result = run_ffmpeg([ffmpeg_bin, 'ok'], stall_timeout=10, progress_callback=blocks.append)
+    assert result.returncode == 0
+    assert [block['progress'] for block in blocks] == ['continue'] * 3 + ['end']
+    assert blocks[1] == {'frame': '1', 'fps': '30.0', 'out_time_us': '1000', 'progress': 'continue'}
+    assert result.stderr == 'ffmpeg version fake'
+    assert result.stdout == ''
+
+    # failures carry the stderr tail
+    with pytest.raises(subprocess.CalledProcessError) as excinfo:
+        run_ffmpeg([ffmpeg_bin, 'fail'])
+    assert 'Conversion failed!' in excinfo.value.stderr
+
+    # a process whose progress stops advancing is killed
+    start = time.time()
+    with pytest.raises(subprocess.TimeoutExpired):
+        run_ffmpeg([ffmpeg_bin, 'stall'], stall_timeout=1)
+    assert time.time() - start < 10
+
+
+def test_ffmpeg_process_ring_buffer(tmp_path):
+    ffmpeg_bin = make_fake_ffmpeg(tmp_path)
+    process = FFmpegProcess([ffmpeg_bin, 'fail'], buffer_lines=1)
+    assert process.wait() == 1
+    assert process.stderr_tail() == 'Conversion failed!'
+    assert process.progress == {'frame': '2', 'fps': '30.0', 'out_time_us': '2000', 'progress': 'continue'}
@@ -34,17 +34,71 @@
 #             would require a deliberate decision to change the final output
 #             format, which is out of scope here.
 # ==============================================================================
+# CHANGE HISTORY — ESRGAN CHUNK ENCODE
+# ==============================================================================
+# 2026-10-18: inference_realesrgan_video.py now takes an encoder profile, and
+#             the pipeline selects it per run (--esrgan-encoder, default auto):
+#
+#               --rife (chunk is decoded to PNG for RIFE):
+#                 Before: libx264 defaults (CRF 23, preset medium)
+#                 After:  "intermediate" — libx264 ultrafast, QP 0, yuv444p
+#
+#               no RIFE (chunk is promoted to the final output):
+#                 Before: libx264 defaults (CRF 23, preset medium)
+#                 After:  "archival" — CRF 14, preset fast, yuv420p (same as
+#                         the RIFE reassembly intermediate)
+#
+#             ALL previously processed videos used the libx264 defaults.
+#             Resumed runs whose metadata.json predates this change keep the
+#             "default" profile so that old and new chunks are never mixed.
+# ==============================================================================
+# CHANGE HISTORY — FINALISATION
+# ==============================================================================
+# 2026-10-18: Step 3 is a single ffmpeg pass: concat + audio mux + SAR + the
+#             source's global metadata and chapters.
+#
+#               SAR:      Before: mkvpropedit/MP4Box after the concat
+#                         After:  h264_metadata bsf (SPS) + -aspect (container)
+#                                 during the concat; the container tools are
+#                                 only used if the header check disagrees.
+#               Chapters: Before: dropped (chunks carry no chapters)
+#                         After:  copied from the input via an ffmetadata file
+#
+#             --preview appends each finished chunk to a .partial.ts next to
+#             the final output so a long job can be watched while it runs.
+# ==============================================================================
+# CHANGE HISTORY — INTERPOLATION BACKENDS
+# ==============================================================================
+# 2026-10-18: --interpolation selects how --rife doubles the frame rate:
+#
+#               rife (default): rife-ncnn-vulkan in directory mode, as before
+#                               (ESRGAN chunk → PNG → RIFE → PNG → encode).
+#               flow | blend | minterpolate: in-process stages of
+#                               realesrgan.interpolation, run inside
+#                               inference_realesrgan_video.py on the frames
+#                               it upscales. The ESRGAN chunk is then the
+#                               final chunk, like the no-RIFE path, and is
+#                               encoded with the "archival" profile.
+#
+#             Resumed runs keep the backend they were started with.
+# ==============================================================================
 import subprocess
 import os
 import shutil
 import shlex
 import json
+import bisect
+import hashlib
 import math
+import platform
 import glob
 import time
 import sys
 import argparse
 import re
+import resource
+import threading
+from collections import defaultdict
 from datetime import datetime, timedelta
 import statistics
 
@@ -55,8 +109,29 @@ RIFE_BIN = "./rife-ncnn-vulkan/rife-ncnn-vulkan"
 # --- Auto-Tuning Config ---
 MIN_CHUNK_SEC = 10
 MAX_CHUNK_SEC = 300  # Tuned for RTX 4060 Ti; was 120 for GTX 1060
+# Throughput planner (used once stage timings for this machine are on record):
+# chunks are sized so one chunk takes about TARGET_CHUNK_MINUTES (the work lost
+# to an interruption) while the fixed per-chunk cost (process start-up, model
+# load) stays below MAX_CHUNK_OVERHEAD of the chunk time.
+TARGET_CHUNK_MINUTES = 60
+MAX_CHUNK_OVERHEAD = 0.05
+# Stage records of all jobs, kept across runs (processing_chunks/ is per job)
+THROUGHPUT_HISTORY_FILE = os.path.join(OUTPUT_DIR, "throughput_history.jsonl")
+
+# --- Chunk Boundary Config ---
+# Boundaries are placed on keyframes (the split is a stream copy), preferably
+# on a scene cut, within ±CHUNK_SCENE_WINDOW of the target chunk duration.
+# The target is CHUNK_DURATION_SECONDS / (1 + CHUNK_SCENE_WINDOW), so no chunk
+# exceeds the disk-budgeted chunk duration.
+CHUNK_SCENE_WINDOW = 0.25
+DEFAULT_SCENE_THRESHOLD = 0.3  # select='gt(scene,x)' score that counts as a cut
+INDEX_CACHE_DIR = os.path.join(OUTPUT_DIR, "index_cache")  # Keyframe/scene index per input, kept across jobs
 DISK_SAFETY_MARGIN = 0.5
 EST_PNG_COMP_RATIO = 0.4 
+# ffmpeg steps are killed when their -progress position has not advanced for this
+# long. This is a stall detector, not a runtime limit: a slow but moving step
+# never times out, however long the chunk.
+FFMPEG_STALL_TIMEOUT = 300
 
 # --- Chunking Config ---
 PROCESSING_DIR = "processing_chunks"
@@ -64,7 +139,11 @@ INPUT_CHUNKS_DIR = os.path.join(PROCESSING_DIR, "0_input_chunks")
 ESRGAN_CHUNKS_DIR = os.path.join(PROCESSING_DIR, "1_esrgan_chunks")
 RIFE_CHUNKS_DIR = os.path.join(PROCESSING_DIR, "2_rife_chunks")
 CONCAT_FILE = os.path.join(PROCESSING_DIR, "concat_list.txt")
+CHUNK_PLAN_FILE = os.path.join(PROCESSING_DIR, "chunk_plan.json")  # Boundaries the input was split at
 STOP_FILE = os.path.join(PROCESSING_DIR, "STOP")  # Touch this file to request a graceful stop after the current chunk
+METRICS_FILE = os.path.join(PROCESSING_DIR, "metrics.jsonl")  # One JSON record per stage and per chunk
+PREVIEW_STATE_FILE = os.path.join(PROCESSING_DIR, "preview_state.json")  # Chunks already in the --preview file
+DISK_SAMPLE_INTERVAL = 5  # seconds between disk usage samples while a stage runs
 TEST_MODE_CHUNKS = None
 
 
@@ -81,6 +160,205 @@ class Timer:
         duration = self.end - self.start
         print(f"   [Perf] {self.name} took {duration:.2f} seconds.")
 
+def cpu_seconds():
+    """User + system CPU time of this process and all waited-for subprocesses."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def path_size_bytes(path):
+    """Size of a file, or the total size of the files in a directory tree. 0 if missing."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # removed while walking
+    return total
+
+def read_metrics(metrics_file):
+    """
+    Load all records from metrics.jsonl.
+
+    Returns an empty list if the file does not exist. Lines that are not valid
+    JSON (e.g. a record cut short by a crash) are skipped.
+    """
+    records = []
+    try:
+        with open(metrics_file, "r") as fh:
+            for line in fh:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass
+    except FileNotFoundError:
+        pass
+    return records
+
+class StageTimer(Timer):
+    """
+    Timer that also writes a structured metrics record for one pipeline stage.
+
+    Records wall time, CPU time (including ffmpeg/ESRGAN/RIFE subprocesses),
+    frames and fps, bytes read and written, and the peak used space of the
+    processing filesystem, sampled on a background thread while the stage runs.
+    Frames come from the ffmpeg -progress callback (pass on_progress to
+    run_ffmpeg) or can be set directly via the frames attribute.
+    """
+    def __init__(self, recorder, name, chunk, stage, inputs=(), outputs=()):
+        super().__init__(name)
+        self.recorder = recorder
+        self.chunk = chunk
+        self.stage = stage
+        self.inputs = inputs
+        self.outputs = outputs
+        self.frames = None
+        self.peak_disk_bytes = 0
+        self._stop = threading.Event()
+    def on_progress(self, progress):
+        if progress.get("frame", "").isdigit():
+            self.frames = int(progress["frame"])
+    def _sample_disk(self):
+        while True:
+            try:
+                self.peak_disk_bytes = max(self.peak_disk_bytes, shutil.disk_usage(PROCESSING_DIR).used)
+            except OSError:
+                pass
+            if self._stop.wait(DISK_SAMPLE_INTERVAL):
+                break
+    def __enter__(self):
+        self.bytes_in = sum(path_size_bytes(p) for p in self.inputs)
+        self.cpu_start = cpu_seconds()
+        self._sampler = threading.Thread(target=self._sample_disk, daemon=True)
+        self._sampler.start()
+        return super().__enter__()
+    def __exit__(self, exc_type, *args):
+        super().__exit__(exc_type, *args)
+        self._stop.set()
+        self._sampler.join()
+        wall = self.end - self.start
+        self.recorder.record(
+            chunk=self.chunk, stage=self.stage,
+            status="ok" if exc_type is None else "failed",
+            wall_s=round(wall, 3),
+            cpu_s=round(cpu_seconds() - self.cpu_start, 3),
+            frames=self.frames,
+            fps=round(self.frames / wall, 3) if self.frames and wall > 0 else None,
+            bytes_in=self.bytes_in,
+            bytes_out=sum(path_size_bytes(p) for p in self.outputs),
+            peak_disk_bytes=self.peak_disk_bytes,
+        )
+
+class MetricsRecorder:
+    """
+    Appends per-stage and per-chunk records to metrics.jsonl.
+
+    Every record carries the job description (input, resolution, scale, model,
+    profile, encoder, RIFE) so that timings from different runs can be compared.
+    Successful stage records are also appended to history_file, which outlives
+    the job and feeds the ThroughputPlanner of later runs. Optionally mirrors
+    the totals to a Prometheus node_exporter textfile, which is rewritten
+    atomically after each record.
+    """
+    def __init__(self, metrics_file, job, prometheus_file=None, history_file=None):
+        self.metrics_file = metrics_file
+        self.history_file = history_file
+        self.job = job
+        self.prometheus_file = prometheus_file
+        self.run_id = datetime.now().astimezone().strftime("%Y%m%d_%H%M%S")
+        self.chunk_stages = defaultdict(list)
+        # Prometheus counters start from the records of earlier sessions of this job
+        self.totals = defaultdict(lambda: defaultdict(float))
+        self.last_fps = {}
+        self.chunks_completed = 0
+        self.peak_disk_bytes = 0
+        for record in read_metrics(metrics_file):
+            self._accumulate(record)
+    def stage(self, name, chunk, stage, inputs=(), outputs=()):
+        return StageTimer(self, name, chunk, stage, inputs, outputs)
+    def record(self, **fields):
+        record = {"time": datetime.now().astimezone().isoformat(timespec="seconds"), "run_id": self.run_id}
+        record.update(fields)
+        record["job"] = self.job
+        if record["stage"] != "chunk":
+            self.chunk_stages[record["chunk"]].append(record)
+        with open(self.metrics_file, "a") as fh:
+            fh.write(json.dumps(record) + "\n")
+        if self.history_file and record["status"] == "ok" and record["stage"] != "chunk":
+            with open(self.history_file, "a") as fh:
+                fh.write(json.dumps(record) + "\n")
+        self._accumulate(record)
+        if self.prometheus_file:
+            try:
+                self.write_prometheus()
+            except OSError as e:
+                print(f"  [WARN] Could not write Prometheus textfile {self.prometheus_file}: {e}")
+        return record
+    def record_chunk(self, chunk, wall_s, full_chunk, output_file, chunk_fraction=1.0):
+        """
+        Summarise the stages of a finished chunk into a single "chunk" record.
+        chunk_fraction is the chunk's duration relative to the nominal chunk duration.
+        """
+        stages = [r for r in self.chunk_stages.pop(chunk, []) if r["status"] == "ok"]
+        frames = get_video_frame_count(output_file)
+        return self.record(
+            chunk=chunk, stage="chunk", status="ok",
+            wall_s=round(wall_s, 3),
+            cpu_s=round(sum(r["cpu_s"] for r in stages), 3),
+            frames=frames,
+            fps=round(frames / wall_s, 3) if frames and wall_s > 0 else None,
+            bytes_in=stages[0]["bytes_in"] if stages else None,
+            bytes_out=path_size_bytes(output_file),
+            peak_disk_bytes=max((r["peak_disk_bytes"] for r in stages), default=None),
+            full_chunk=full_chunk,
+            chunk_fraction=round(chunk_fraction, 4),
+            stages=[r["stage"] for r in stages],
+        )
+    def _accumulate(self, record):
+        if record.get("status") != "ok":
+            return
+        if record.get("stage") == "chunk":
+            self.chunks_completed += 1
+            return
+        totals = self.totals[record["stage"]]
+        totals["runs"] += 1
+        for key in ("wall_s", "cpu_s", "frames", "bytes_in", "bytes_out"):
+            totals[key] += record.get(key) or 0
+        if record.get("fps"):
+            self.last_fps[record["stage"]] = record["fps"]
+        self.peak_disk_bytes = max(self.peak_disk_bytes, record.get("peak_disk_bytes") or 0)
+    def write_prometheus(self):
+        video = os.path.basename(self.job.get("input_video", "")).replace("\\", "\\\\").replace('"', '\\"')
+        lines = []
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP video_upscale_{name} {help_text}")
+            lines.append(f"# TYPE video_upscale_{name} {kind}")
+            for labels, value in samples:
+                label_str = ",".join([f'video="{video}"'] + [f'{k}="{v}"' for k, v in labels.items()])
+                lines.append(f"video_upscale_{name}{{{label_str}}} {value}")
+        stages = sorted(self.totals)
+        for key, name, help_text in [
+            ("runs", "stage_runs_total", "Completed runs of a pipeline stage."),
+            ("wall_s", "stage_wall_seconds_total", "Wall time spent in a pipeline stage."),
+            ("cpu_s", "stage_cpu_seconds_total", "CPU time spent in a pipeline stage, including subprocesses."),
+            ("frames", "stage_frames_total", "Frames processed by a pipeline stage."),
+            ("bytes_in", "stage_read_bytes_total", "Bytes of input files consumed by a pipeline stage."),
+            ("bytes_out", "stage_written_bytes_total", "Bytes of output files produced by a pipeline stage."),
+        ]:
+            metric(name, "counter", help_text, [({"stage": s}, self.totals[s][key]) for s in stages])
+        metric("stage_last_fps", "gauge", "Frames per second of the last run of a pipeline stage.",
+               [({"stage": s}, fps) for s, fps in sorted(self.last_fps.items())])
+        metric("chunks_completed", "gauge", "Chunks completed for this job.", [({}, self.chunks_completed)])
+        metric("peak_disk_used_bytes", "gauge", "Peak used space of the processing filesystem.",
+               [({}, self.peak_disk_bytes)])
+        tmp_file = f"{self.prometheus_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as fh:
+            fh.write("\n".join(lines) + "\n")
+        os.replace(tmp_file, self.prometheus_file)
+
 def check_venv():
     """Ensures the script is running inside the virtual environment."""
     # sys.prefix != sys.base_prefix is the standard way to detect a venv in Python 3
@@ -90,11 +368,151 @@ def check_venv():
         print("    Please run: source venv/bin/activate")
         sys.exit(1)
 
+def run_ffmpeg(cmd, **kwargs):
+    """realesrgan.video_io.run_ffmpeg, imported on first use: the realesrgan
+    package needs torch and basicsr, so it must not be imported before
+    check_venv() has run."""
+    from realesrgan.video_io import run_ffmpeg as video_io_run_ffmpeg
+    return video_io_run_ffmpeg(cmd, **kwargs)
+
 def safe_rmtree(path):
     """Safely remove a directory tree."""
     if os.path.isdir(path):
         shutil.rmtree(path)
 
+# Frames handled by each stage per source frame, and the job fields its
+# throughput depends on (besides the machine). Resolution is matched exactly
+# when possible and otherwise scaled by pixel count.
+PLANNER_STAGES = {
+    "split":     {"frames": 1, "keys": (), "once": True},
+    "prefilter": {"frames": 1, "keys": ("profile",)},
+    "esrgan":    {"frames": 1, "keys": ("scale_factor", "model", "esrgan_encoder", "interpolation")},
+    "extract":   {"frames": 1, "keys": ("scale_factor",), "rife": True},
+    "rife":      {"frames": 2, "keys": ("scale_factor",), "rife": True},
+    "encode":    {"frames": 2, "keys": ("scale_factor",), "rife": True},
+    "concat":    {"frames": 1, "keys": ("scale_factor", "rife"), "once": True},
+}
+
+class ThroughputPlanner:
+    """
+    Predicts stage and job times from the stage records of earlier runs.
+
+    Each stage is modelled as wall = overhead + cost * pixel_frames, fitted by
+    least squares over the matching records (same host and the job fields in
+    PLANNER_STAGES), where pixel_frames is frames x input pixels. Records of
+    the same input resolution are preferred; other resolutions are used,
+    scaled by pixel count, when there are none.
+    """
+    def __init__(self, history_file):
+        self.records = [
+            r for r in read_metrics(history_file)
+            if r.get("status") == "ok" and r.get("stage") in PLANNER_STAGES
+            and r.get("frames") and r.get("wall_s") and r.get("job", {}).get("width")
+        ]
+        self._models = {}
+    def stage_model(self, stage, job):
+        """Returns (overhead_s, s_per_pixel_frame, n_records) for a stage, or None without history."""
+        keys = ("host",) + PLANNER_STAGES[stage]["keys"]
+        cache_key = (stage, job["width"], job["height"]) + tuple(job.get(k) for k in keys)
+        if cache_key in self._models:
+            return self._models[cache_key]
+        matches = [r for r in self.records
+                   if r["stage"] == stage and all(r["job"].get(k) == job.get(k) for k in keys)]
+        same_res = [r for r in matches if (r["job"]["width"], r["job"]["height"]) == (job["width"], job["height"])]
+        points = [(r["frames"] * r["job"]["width"] * r["job"]["height"], r["wall_s"]) for r in same_res or matches]
+        model = None
+        if points:
+            xs = [x for x, _ in points]
+            ys = [y for _, y in points]
+            overhead, cost = 0.0, statistics.median(y / x for x, y in points)
+            if len(set(xs)) >= 2:
+                mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+                slope = (sum((x - mean_x) * (y - mean_y) for x, y in points)
+                         / sum((x - mean_x) ** 2 for x in xs))
+                intercept = mean_y - slope * mean_x
+                # A negative intercept or slope is noise, not a real model
+                if slope > 0 and intercept >= 0:
+                    overhead, cost = intercept, slope
+            model = (overhead, cost, len(points))
+        self._models[cache_key] = model
+        return model
+    def _stages(self, job):
+        # The directory-mode RIFE stages only run with the rife backend
+        # (job["interpolation"] is None); in-process backends run in "esrgan"
+        rife_dir = job.get("rife") and job.get("interpolation") is None
+        return [s for s, spec in PLANNER_STAGES.items() if rife_dir or not spec.get("rife")]
+    def chunk_cost(self, job):
+        """
+        Returns (overhead_s, s_per_video_sec) of one chunk, summed over the
+        per-chunk stages, or None when a stage has no history (nothing can be
+        predicted without an ESRGAN timing, which dominates).
+        """
+        pixels = job["width"] * job["height"]
+        overhead = per_sec = 0.0
+        for stage in self._stages(job):
+            if PLANNER_STAGES[stage].get("once"):
+                continue
+            model = self.stage_model(stage, job)
+            if model is None:
+                return None
+            overhead += model[0]
+            per_sec += model[1] * pixels * job["source_fps"] * PLANNER_STAGES[stage]["frames"]
+        return overhead, per_sec
+    def predict(self, job, duration, chunk_sec):
+        """
+        Predicts the time of each stage for a job of `duration` seconds of
+        video in chunks of `chunk_sec`. Returns {stage: seconds} or None.
+        One-off stages without history (split, concat) are left out.
+        """
+        if self.chunk_cost(job) is None:
+            return None
+        pixels = job["width"] * job["height"]
+        num_chunks = math.ceil(duration / chunk_sec) if duration > 0 else 0
+        plan = {}
+        for stage in self._stages(job):
+            model = self.stage_model(stage, job)
+            if model is None:
+                continue
+            runs = 1 if PLANNER_STAGES[stage].get("once") else num_chunks
+            pixel_frames = pixels * job["source_fps"] * duration * PLANNER_STAGES[stage]["frames"]
+            plan[stage] = model[0] * runs + model[1] * pixel_frames
+        return plan
+    def choose_chunk_duration(self, job, max_chunk_sec_disk):
+        """
+        Chunk duration in seconds that keeps a chunk near TARGET_CHUNK_MINUTES
+        and the per-chunk overhead below MAX_CHUNK_OVERHEAD, within the disk
+        budget and [MIN_CHUNK_SEC, MAX_CHUNK_SEC]. None without history.
+        """
+        cost = self.chunk_cost(job)
+        if cost is None:
+            return None
+        overhead, per_sec = cost
+        granularity_sec = max(TARGET_CHUNK_MINUTES * 60 - overhead, 0) / per_sec
+        overhead_sec = overhead * (1 - MAX_CHUNK_OVERHEAD) / (MAX_CHUNK_OVERHEAD * per_sec)
+        chunk_sec = max(granularity_sec, overhead_sec, MIN_CHUNK_SEC)
+        chunk_sec = min(chunk_sec, max_chunk_sec_disk, MAX_CHUNK_SEC)
+        print(f"Planner: chunk cost {overhead:.0f}s + {per_sec:.2f}s per video second "
+              f"(granularity {granularity_sec:.0f}s, overhead floor {overhead_sec:.0f}s, disk {max_chunk_sec_disk:.0f}s)")
+        return max(MIN_CHUNK_SEC, int(chunk_sec))
+
+def format_hours(seconds):
+    return f"{seconds / 3600:.1f}h"
+
+def load_chunk_durations_from_metrics(metrics_file):
+    """
+    Full-chunk timing history from metrics.jsonl.
+
+    Uses the "chunk" records of completed chunks, excluding partial-resume
+    chunks (full_chunk false), which represent far less work than a full
+    chunk. Timings are normalised to a full-length chunk (see chunk_fraction).
+    Returns an empty list if there are no such records, e.g. for a run
+    started before metrics were recorded; see load_chunk_durations_from_log.
+    """
+    return [
+        r["wall_s"] / r.get("chunk_fraction", 1.0) for r in read_metrics(metrics_file)
+        if r.get("stage") == "chunk" and r.get("status") == "ok" and r.get("full_chunk")
+    ]
+
 def load_chunk_durations_from_log(log_file):
     """
     Reconstruct the full-chunk timing history from pipeline.log.
@@ -238,6 +656,116 @@ def apply_sar_to_file(filepath, sar_str, pixel_width, pixel_height):
     print(f"  > SAR fix applied ({label}) to {os.path.basename(filepath)}")
     return True
 
+def get_video_codec(video_file):
+    """Returns the codec name of the first video stream (e.g. 'h264'), or None if the probe fails."""
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        video_file
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+def sar_mux_args(video_file, sar_str, pixel_width, pixel_height, container=True):
+    """
+    ffmpeg output options that write the SAR while stream-copying video_file,
+    so no separate apply_sar_to_file pass over the finished output is needed:
+      h264_metadata bsf: SAR in the H.264 SPS (bitstream, read by every player)
+      -aspect:           container display aspect (MKV DisplayWidth/Height)
+    Returns an empty list for square pixels.
+    """
+    if not sar_str or sar_str in ("N/A", "0:1", "1:1"):
+        return []
+    sar_num, sar_den = sar_str.split(":")
+    args = []
+    if get_video_codec(video_file) == "h264":
+        args += ["-bsf:v", f"h264_metadata=sample_aspect_ratio={sar_num}/{sar_den}"]
+    if container:
+        display_width = compute_display_width(pixel_width, pixel_height, sar_str)
+        args += ["-aspect", f"{display_width}:{pixel_height}"]
+    return args
+
+def extract_ffmetadata(input_video, metadata_file):
+    """
+    Writes the global metadata and chapters of input_video to an ffmetadata
+    file (container header only, no stream data is read). Returns False if
+    ffmpeg fails, in which case the output is written without them.
+    """
+    cmd = ["ffmpeg", "-y", "-i", input_video, "-f", "ffmetadata", metadata_file]
+    try:
+        run_ffmpeg(cmd, stall_timeout=FFMPEG_STALL_TIMEOUT)
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"  ⚠️  WARNING: Could not read metadata/chapters from {input_video}: {e.stderr}")
+        return False
+
+def update_incremental_preview(preview_file, state_file, audio_file, sar_str):
+    """
+    Appends finished chunks, in order, to an MPEG-TS preview of the output.
+
+    Matroska cannot be appended to, but MPEG-TS can: each chunk is remuxed
+    (video stream copy, its slice of the audio as AAC) into a TS segment whose
+    timestamps continue where the previous one ended, and the segment is
+    appended to preview_file. The preview is playable at any time during the
+    job. Progress is kept in state_file; a segment appended before a crash but
+    not recorded is truncated away on the next call. Returns the number of
+    chunks appended.
+    """
+    state = {"chunks": 0, "offset": 0.0, "size": 0}
+    try:
+        with open(state_file, "r") as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    if not os.path.exists(preview_file):
+        state = {"chunks": 0, "offset": 0.0, "size": 0}
+    elif os.path.getsize(preview_file) > state["size"]:
+        with open(preview_file, "r+b") as f:
+            f.truncate(state["size"])
+
+    appended = 0
+    segment_file = f"{preview_file}.segment.ts"
+    while True:
+        chunk_file = os.path.join(RIFE_CHUNKS_DIR, f"chunk_{state['chunks']:03d}_rife.mp4")
+        if not os.path.exists(chunk_file) or not is_valid_video(chunk_file):
+            break
+        chunk_sec = get_video_duration(chunk_file)
+        pixel_width, pixel_height = get_video_dimensions(chunk_file)
+        cmd = [
+            "ffmpeg", "-y",
+            "-i", chunk_file,
+            "-ss", f"{state['offset']:.6f}", "-t", f"{chunk_sec:.6f}", "-i", audio_file,
+            "-map", "0:v", "-map", "1:a?",
+            "-c:v", "copy", "-c:a", "aac", "-b:a", "192k",
+        ] + sar_mux_args(chunk_file, sar_str, pixel_width, pixel_height, container=False) + [
+            "-output_ts_offset", f"{state['offset']:.6f}",
+            "-mpegts_flags", "+initial_discontinuity",
+            "-f", "mpegts", segment_file
+        ]
+        try:
+            run_ffmpeg(cmd, stall_timeout=FFMPEG_STALL_TIMEOUT)
+        except subprocess.SubprocessError as e:
+            # The preview is a convenience — never fail the job over it
+            print(f"  ⚠️  WARNING: Could not append {os.path.basename(chunk_file)} to the preview: "
+                  f"{getattr(e, 'stderr', e)}")
+            break
+        with open(segment_file, "rb") as src, open(preview_file, "ab") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.remove(segment_file)
+        state = {
+            "chunks": state["chunks"] + 1,
+            "offset": state["offset"] + chunk_sec,
+            "size": os.path.getsize(preview_file),
+        }
+        with open(state_file, "w") as f:
+            json.dump(state, f)
+        appended += 1
+    if appended:
+        print(f"  > Preview: appended {appended} chunk(s), {state['chunks']} in {preview_file} "
+              f"({state['offset'] / 60:.1f} min watchable)")
+    return appended
+
 def verify_audio_video_duration(video_file, audio_file, tolerance_sec=2.0):
     """
     Compares audio and video durations and aborts if they differ beyond tolerance.
@@ -348,6 +876,23 @@ def get_video_dimensions(video_file):
     except Exception as e:
         raise RuntimeError(f"Could not parse video dimensions. Output: '{result.stdout}'. Error: {e}")
 
+def get_video_frame_count(video_file):
+    """
+    Returns the frame count stored in the stream header (nb_frames), or None
+    if the container does not store it (e.g. MKV) or the probe fails.
+    """
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=nb_frames",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        video_file
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=15)
+        return int(result.stdout.strip())
+    except Exception:
+        return None
+
 def check_disk_space(path, required_gb):
     total, used, free = shutil.disk_usage(path)
     free_gb = free / (1024**3)
@@ -374,8 +919,15 @@ def cleanup_intermediate_files(input_chunk, esrgan_file, rife_in_dir, rife_out_d
     print(f"  > Cleaning up RIFE output frames: {rife_out_dir}")
     safe_rmtree(rife_out_dir)
 
-def autotune_chunk_size(input_video_path, scale_factor):
-    """Calculates optimal chunk size based on free disk and video properties."""
+def autotune_chunk_size(input_video_path, scale_factor, planner=None, job=None):
+    """
+    Calculates optimal chunk size based on free disk and video properties.
+
+    With a ThroughputPlanner that has timings for this job on this machine, the
+    chunk size is chosen from the predicted chunk time (see
+    ThroughputPlanner.choose_chunk_duration) within the disk budget; otherwise
+    the largest chunk the disk allows is used, clamped to [MIN, MAX]_CHUNK_SEC.
+    """
     print("--- Auto-Tuning Chunk Size ---")
     try:
         free_disk_gb = check_disk_space(".", 10)
@@ -417,6 +969,15 @@ def autotune_chunk_size(input_video_path, scale_factor):
             print(f"    Free up at least {needed_gb - free_disk_gb:.1f} GB and retry.")
             raise RuntimeError("Insufficient disk space for minimum chunk size.")
 
+        planned_chunk_sec = planner.choose_chunk_duration(job, max_chunk_sec_disk) if planner else None
+        if planned_chunk_sec is not None:
+            print(f"Planned {planned_chunk_sec} second chunks (target ~{TARGET_CHUNK_MINUTES} min per chunk, "
+                  f"overhead <{MAX_CHUNK_OVERHEAD:.0%})")
+            print("--------------------------------")
+            return planned_chunk_sec
+        if planner:
+            print("Planner: no timings for this job on this machine yet — sizing by disk only.")
+
         final_chunk_sec = max(MIN_CHUNK_SEC, min(max_chunk_sec_disk, MAX_CHUNK_SEC))
 
         print(f"Clamped to {final_chunk_sec:.0f} seconds (Min: {MIN_CHUNK_SEC}s, Max: {MAX_CHUNK_SEC}s)")
@@ -430,6 +991,135 @@ def autotune_chunk_size(input_video_path, scale_factor):
         print("--------------------------------")
         return 10
 
+def build_keyframe_index(input_video, scene_threshold=None):
+    """
+    Keyframe and scene-cut index of the input video, cached in INDEX_CACHE_DIR.
+
+    The packet index comes from ffprobe (timestamps and keyframe flags only,
+    nothing is decoded). With a scene_threshold, a decoding pass with
+    select='gt(scene,x)' adds the scene cuts. Times are relative to the start
+    of the video, as seen by ffmpeg's segment muxer. The cache is keyed by the
+    input path, size, mtime and threshold.
+
+    Returns a dict with "duration", "fps", "num_frames", "keyframes" (times),
+    "keyframe_frames" (index of the frame at each keyframe, in presentation
+    order) and "scene_cuts" (times).
+    """
+    st = os.stat(input_video)
+    key = f"{os.path.abspath(input_video)}|{st.st_size}|{int(st.st_mtime)}|{scene_threshold}"
+    cache_file = os.path.join(INDEX_CACHE_DIR, hashlib.sha1(key.encode()).hexdigest()[:16] + ".json")
+    try:
+        with open(cache_file, "r") as f:
+            index = json.load(f)
+        print(f"  > Loaded keyframe index from cache: {cache_file}")
+        return index
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+
+    print(f"  > Indexing packets of {input_video}...")
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,dts_time,flags",
+        "-of", "csv=p=0",
+        input_video
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    packets = []
+    for line in result.stdout.splitlines():
+        fields = line.split(",")
+        if len(fields) < 3:
+            continue
+        time_str = fields[0] if fields[0] not in ("", "N/A") else fields[1]
+        try:
+            packets.append((float(time_str), "K" in fields[2]))
+        except ValueError:
+            continue
+    if not packets:
+        raise RuntimeError(f"ffprobe returned no video packets for {input_video}")
+    packets.sort()
+    start = packets[0][0]
+    times = [t - start for t, _ in packets]
+    keyframe_frames = [i for i, (_, is_key) in enumerate(packets) if is_key]
+    fps = float(get_video_fps(input_video))
+    index = {
+        "duration": get_video_duration(input_video),
+        "fps": fps,
+        "num_frames": len(times),
+        "keyframes": [round(times[i], 6) for i in keyframe_frames],
+        "keyframe_frames": keyframe_frames,
+        "scene_cuts": [],
+    }
+
+    if scene_threshold:
+        print(f"  > Detecting scene cuts (scene > {scene_threshold})...")
+        scene_file = cache_file[:-len(".json")] + ".scenes.txt"
+        cmd_scene = [
+            "ffmpeg", "-y", "-i", input_video, "-map", "0:v:0", "-an",
+            "-vf", f"select='gt(scene,{scene_threshold})',metadata=print:file={scene_file}",
+            "-f", "null", "-"
+        ]
+        with Timer("Scene detection"):
+            run_ffmpeg(cmd_scene, stall_timeout=FFMPEG_STALL_TIMEOUT)
+        with open(scene_file, "r") as f:
+            index["scene_cuts"] = [
+                round(float(m.group(1)), 6) for m in re.finditer(r"pts_time:([0-9.]+)", f.read())
+            ]
+        os.remove(scene_file)
+
+    with open(cache_file, "w") as f:
+        json.dump(index, f)
+    print(f"  > Index: {len(index['keyframes'])} keyframes, {len(index['scene_cuts'])} scene cuts, "
+          f"{index['num_frames']} frames (cached in {cache_file})")
+    return index
+
+def plan_chunk_boundaries(index, chunk_duration, use_scene_cuts=True):
+    """
+    Places chunk boundaries on keyframes near chunk_duration / (1 + CHUNK_SCENE_WINDOW).
+
+    Within ±CHUNK_SCENE_WINDOW of the target, a keyframe on a scene cut is
+    preferred, so temporal filters (hqdn3d, RIFE) never span a chunk seam
+    inside a shot; otherwise the keyframe closest to the target is used.
+
+    Returns {"boundaries", "durations", "frames"}: the split times, and the
+    duration and exact frame count of every chunk.
+    """
+    keyframes = index["keyframes"]
+    duration = index["duration"]
+    target = chunk_duration / (1 + CHUNK_SCENE_WINDOW)
+    half_frame = 0.5 / index["fps"]
+    cuts = index["scene_cuts"] if use_scene_cuts else []
+
+    def on_scene_cut(t):
+        pos = bisect.bisect_left(cuts, t - half_frame)
+        return pos < len(cuts) and cuts[pos] <= t + half_frame
+
+    boundaries = []
+    start = 0.0
+    while duration - start > target * (1 + CHUNK_SCENE_WINDOW):
+        lo = bisect.bisect_left(keyframes, start + target * (1 - CHUNK_SCENE_WINDOW))
+        hi = bisect.bisect_right(keyframes, start + target * (1 + CHUNK_SCENE_WINDOW))
+        window = keyframes[lo:hi]
+        scene_window = [t for t in window if on_scene_cut(t)]
+        candidates = scene_window or window
+        if candidates:
+            boundary = min(candidates, key=lambda t: abs(t - (start + target)))
+        elif hi < len(keyframes):
+            boundary = keyframes[hi]  # long GOP: first keyframe after the window
+        else:
+            break
+        boundaries.append(boundary)
+        start = boundary
+
+    edges = [0.0] + boundaries + [duration]
+    frame_edges = [0] + [index["keyframe_frames"][keyframes.index(b)] for b in boundaries] + [index["num_frames"]]
+    return {
+        "boundaries": boundaries,
+        "durations": [round(b - a, 6) for a, b in zip(edges, edges[1:])],
+        "frames": [b - a for a, b in zip(frame_edges, frame_edges[1:])],
+        "scene_aligned": sum(1 for b in boundaries if on_scene_cut(b)),
+    }
+
 def parse_arguments():
     """Parses command-line arguments."""
     parser = argparse.ArgumentParser(
@@ -445,6 +1135,7 @@ Examples:
   %(prog)s video.avi --profile hi8dv         # Hi8 tape via Digital8/FireWire direct capture
   %(prog)s video_60fps.mp4                   # 60fps mode=1 master: upscale only, 60fps out (default)
   %(prog)s video_30fps.mp4 --rife            # 30fps mode=0 master: RIFE doubles to ~60fps out
+  %(prog)s video_30fps.mp4 --rife --interpolation flow  # CPU optical-flow interpolation, no PNG frames
   %(prog)s camcorder.mp4                    # works with DV, Hi8, and other camcorder formats
   %(prog)s video.avi --model realesr-general-x4v3   # use general degradation model at 2x output
   %(prog)s video.avi -s 4 --model realesr-general-x4v3  # general model at 4x output
@@ -511,6 +1202,31 @@ Pre-filter profiles (--profile):
             "it upscales to 4x then downsamples to 2x, which can reduce over-hallucination on noisy sources."
         )
     )
+    parser.add_argument(
+        "--esrgan-encoder",
+        choices=["auto", "default", "archival", "intermediate"],
+        default="auto",
+        help=(
+            "Encoder profile of the Real-ESRGAN chunk video (default: auto). "
+            "auto: intermediate (fast lossless) with --rife, since the chunk is decoded to PNG frames again; "
+            "archival (CRF 14, preset fast) without RIFE, since the chunk becomes part of the final output. "
+            "default: libx264 defaults (CRF 23, preset medium), the behaviour before profiles existed."
+        )
+    )
+    parser.add_argument(
+        "--interpolation",
+        choices=["rife", "flow", "blend", "minterpolate"],
+        default="rife",
+        help=(
+            "Frame interpolation backend used with --rife (default: rife). "
+            "rife: rife-ncnn-vulkan in directory mode (PNG frames on disk). "
+            "flow: motion-compensated blending with optical flow, on the CPU. "
+            "blend: plain averaging of neighbouring frames. "
+            "minterpolate: ffmpeg's minterpolate filter, streamed through pipes. "
+            "flow, blend and minterpolate run inside the Real-ESRGAN step on the frames as they are upscaled, "
+            "so no PNG frames are written. A resumed run keeps the backend it was started with."
+        )
+    )
     parser.add_argument(
         "--max-runtime",
         type=float,
@@ -518,6 +1234,56 @@ Pre-filter profiles (--profile):
         metavar="HOURS",
         help="Maximum runtime in hours before graceful shutdown. Script will not start a new chunk if (elapsed time + last chunk duration) would exceed this limit. Example: --max-runtime 8"
     )
+    parser.add_argument(
+        "--chunk-boundaries",
+        choices=["scene", "keyframe", "fixed"],
+        default="scene",
+        help=(
+            "How chunk boundaries are placed on a fresh split (default: scene). "
+            "scene: on a scene cut near the target chunk duration (one decoding pass to detect cuts, cached). "
+            "keyframe: on the keyframe nearest the target (packet index only). "
+            "fixed: ffmpeg's segment_time, the behaviour before boundary planning existed. "
+            "A resumed run always keeps the boundaries it was split with."
+        )
+    )
+    parser.add_argument(
+        "--scene-threshold",
+        type=float,
+        default=DEFAULT_SCENE_THRESHOLD,
+        help=f"Scene change score (0-1) that counts as a cut for --chunk-boundaries scene (default: {DEFAULT_SCENE_THRESHOLD})."
+    )
+    parser.add_argument(
+        "--chunk-overlap",
+        type=int,
+        default=0,
+        metavar="FRAMES",
+        help=(
+            "Decode this many frames of context before each chunk so hqdn3d's temporal filter starts warm, "
+            "and (with --rife) one frame after it so the last frame of a chunk is interpolated towards the "
+            "next chunk; the context is trimmed off before encoding, so chunk frame counts are unchanged. "
+            "Requires planned chunk boundaries (--chunk-boundaries scene or keyframe). Default: 0 (off). "
+            "Example: --chunk-overlap 8"
+        )
+    )
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help=(
+            "Append each finished chunk to outputs/<final name>.partial.ts (MPEG-TS, with audio), "
+            "so the upscaled result can be watched while a long job is still running. "
+            "Costs one extra copy of the output on disk; deleted once the final file is written."
+        )
+    )
+    parser.add_argument(
+        "--prometheus-textfile",
+        default=None,
+        metavar="PATH",
+        help=(
+            "Also export the stage metrics (see processing_chunks/metrics.jsonl) as a Prometheus "
+            "textfile, rewritten after every stage. Point this at the node_exporter textfile collector "
+            "directory, e.g. /var/lib/node_exporter/textfile_collector/video_upscale.prom"
+        )
+    )
     parser.add_argument(
         "--rife",
         dest="no_rife",
@@ -702,6 +1468,12 @@ def main(args):
     MODEL_SHORT = {"RealESRGAN_x2plus": "x2plus", "RealESRGAN_x4plus": "x4plus", "realesr-general-x4v3": "gen-x4v3"}.get(REALSRGAN_MODEL, REALSRGAN_MODEL)
     # FINAL_VIDEO_FILE_BASE is the name without the fps/rife suffix, which is
     # appended later once source_fps_float and args.no_rife are both known.
+    # ESRGAN chunk encoder profile — see CHANGE HISTORY — ESRGAN CHUNK ENCODE.
+    if args.esrgan_encoder == "auto":
+        # With an in-process interpolation backend the ESRGAN chunk is final too
+        ESRGAN_ENCODER = "archival" if args.no_rife or args.interpolation != "rife" else "intermediate"
+    else:
+        ESRGAN_ENCODER = args.esrgan_encoder
     FINAL_VIDEO_FILE_BASE = os.path.join(OUTPUT_DIR, f"{input_basename}_{profile}_x{SCALE_FACTOR}_{MODEL_SHORT}")
     ORIGINAL_AUDIO_FILE = os.path.join(PROCESSING_DIR, f"{input_basename}_original.mka")  # .mka accepts any codec (AC-3, AAC, PCM, MP3)
     ORIGINAL_AUDIO_FILE_MP3 = os.path.join(PROCESSING_DIR, f"{input_basename}_original.mp3")  # fallback path
@@ -722,6 +1494,9 @@ def main(args):
         # no_rife is included so that a resumed run cannot accidentally mix
         # RIFE-interpolated and non-interpolated chunks in the same output.
         "no_rife": args.no_rife,
+        "esrgan_encoder": ESRGAN_ENCODER,
+        "chunk_overlap": args.chunk_overlap,
+        "interpolation": args.interpolation,
     }
     
     # is_resume is set True only when metadata existed and matched exactly,
@@ -773,13 +1548,41 @@ def main(args):
             # current_metadata only after autotune runs. Stored metadata may
             # contain it from a previous run; excluding it from both sides
             # prevents a false mismatch on resume.
-            comparable_keys = [k for k in current_metadata if k != "chunk_duration"]
+            # esrgan_encoder is excluded too: on a resume the stored profile
+            # always wins (see below), so a changed --esrgan-encoder or a
+            # metadata.json that predates the field is not a different job.
+            # chunk_overlap likewise: the stored value wins, because a chunk whose
+            # ESRGAN output already exists was produced with that context.
+            # interpolation likewise: chunks of different backends would need
+            # different ESRGAN encoder profiles and could not be concatenated.
+            comparable_keys = [k for k in current_metadata
+                               if k not in ("chunk_duration", "esrgan_encoder", "chunk_overlap", "interpolation")]
             old_comparable = {k: old_metadata.get(k) for k in comparable_keys}
             new_comparable = {k: current_metadata[k] for k in comparable_keys}
 
             if old_comparable == new_comparable:
                 # Core parameters matched — this is a resume of an existing run.
                 is_resume = True
+                # Keep the encoder profile the run was started with; mixing
+                # chunks from different profiles would break the stream-copy
+                # concat. Runs predating the field used the libx264 defaults.
+                stored_encoder = old_metadata.get("esrgan_encoder", "default")
+                if stored_encoder != ESRGAN_ENCODER:
+                    print(f"[INFO] Resuming with stored ESRGAN encoder profile: {stored_encoder} "
+                          f"(requested: {ESRGAN_ENCODER}).")
+                    ESRGAN_ENCODER = stored_encoder
+                    current_metadata["esrgan_encoder"] = ESRGAN_ENCODER
+                stored_overlap = old_metadata.get("chunk_overlap", 0)
+                if stored_overlap != args.chunk_overlap:
+                    print(f"[INFO] Resuming with stored chunk overlap: {stored_overlap} frames "
+                          f"(requested: {args.chunk_overlap}).")
+                    current_metadata["chunk_overlap"] = stored_overlap
+                # Runs predating the field used directory-mode RIFE
+                stored_interpolation = old_metadata.get("interpolation", "rife")
+                if stored_interpolation != args.interpolation:
+                    print(f"[INFO] Resuming with stored interpolation backend: {stored_interpolation} "
+                          f"(requested: {args.interpolation}).")
+                    current_metadata["interpolation"] = stored_interpolation
             else:
                 # Genuine mismatch — processing_chunks belongs to a different job.
                 # Never offer a simple y/n delete prompt: completed chunks may
@@ -816,6 +1619,31 @@ def main(args):
 
     completed_rife_chunks = glob.glob(os.path.join(RIFE_CHUNKS_DIR, "*_rife.mp4"))
 
+    # Interpolation backend (see CHANGE HISTORY — INTERPOLATION BACKENDS). With
+    # an in-process backend the frames are doubled by inference_realesrgan_video.py
+    # and the RIFE extract/interpolate/encode steps are skipped.
+    INTERPOLATION = current_metadata["interpolation"]
+    IN_PROCESS_INTERPOLATION = not args.no_rife and INTERPOLATION != "rife"
+
+    # Job description shared by the throughput planner and the metrics records.
+    in_width, in_height = get_video_dimensions(INPUT_VIDEO)
+    job = {
+        "input_video": os.path.abspath(INPUT_VIDEO),
+        "host": platform.node(),
+        "width": in_width,
+        "height": in_height,
+        "source_fps": float(get_video_fps(INPUT_VIDEO)),
+        "scale_factor": SCALE_FACTOR,
+        "model": REALSRGAN_MODEL,
+        "profile": profile,
+        "esrgan_encoder": ESRGAN_ENCODER,
+        "rife": not args.no_rife,
+        # None for directory-mode RIFE, so records that predate the field still match
+        "interpolation": INTERPOLATION if IN_PROCESS_INTERPOLATION else None,
+        "threads": threads,
+    }
+    planner = ThroughputPlanner(THROUGHPUT_HISTORY_FILE)
+
     # On a resume, always use the stored chunk_duration regardless of whether
     # any rife chunks exist yet. The input split (if it happened) used that
     # size; a different autotune result would produce different boundaries and
@@ -850,7 +1678,8 @@ def main(args):
         except Exception:
             pass  # disk check failure is non-fatal on resume
     else:
-        CHUNK_DURATION_SECONDS = autotune_chunk_size(INPUT_VIDEO, SCALE_FACTOR)
+        CHUNK_DURATION_SECONDS = autotune_chunk_size(INPUT_VIDEO, SCALE_FACTOR, planner=planner, job=job)
+    job["chunk_duration"] = CHUNK_DURATION_SECONDS
 
     # Add chunk_duration now that autotune has run, then write metadata
     # only if the content has changed. On a clean resume the file already
@@ -897,6 +1726,7 @@ def main(args):
     else:
         fps_suffix = "_60fps_rife"
     FINAL_VIDEO_FILE = f"{FINAL_VIDEO_FILE_BASE}{fps_suffix}.mkv"
+    PREVIEW_FILE = f"{FINAL_VIDEO_FILE_BASE}{fps_suffix}.partial.ts"
 
     # --- Deferred profile selection (requires source_fps_float) ---
     # 60fps masters (bwdif mode=1) use halved temporal hqdn3d values to avoid
@@ -910,7 +1740,62 @@ def main(args):
         fps_label = "30fps"
 
     source_sar = get_video_sar(INPUT_VIDEO)
-    total_chunks = math.ceil(duration / CHUNK_DURATION_SECONDS)
+
+    # --- Chunk Boundary Plan ---
+    # A fresh split places boundaries on keyframes/scene cuts (see
+    # plan_chunk_boundaries) and stores them in chunk_plan.json, together with
+    # the settings they were planned with. A resumed run reuses the stored plan,
+    # because the chunks on disk were split at its boundaries; runs split before
+    # plans existed have none and keep the fixed segment_time boundaries.
+    # Before the split, a plan made with other settings is stale and replanned.
+    chunk_plan = None
+    needs_split = (not completed_rife_chunks
+                   and not os.path.exists(os.path.join(INPUT_CHUNKS_DIR, f"chunk_000{INPUT_EXT}")))
+    plan_settings = {
+        "chunk_boundaries": args.chunk_boundaries,
+        "scene_threshold": args.scene_threshold if args.chunk_boundaries == "scene" else None,
+        "chunk_duration": CHUNK_DURATION_SECONDS,
+    }
+    if os.path.exists(CHUNK_PLAN_FILE):
+        with open(CHUNK_PLAN_FILE, "r") as f:
+            stored_plan = json.load(f)
+        # Plans predating the field have no settings
+        stored_settings = stored_plan.get("settings")
+        if not needs_split:
+            chunk_plan = stored_plan
+            if stored_settings is not None and stored_settings != plan_settings:
+                print(f"[INFO] Resuming with the stored chunk plan settings: {stored_settings} "
+                      f"(requested: {plan_settings}).")
+            print(f"[INFO] Using stored chunk plan: {len(chunk_plan['durations'])} chunks.")
+        elif stored_settings == plan_settings:
+            chunk_plan = stored_plan
+            print(f"[INFO] Using stored chunk plan: {len(chunk_plan['durations'])} chunks.")
+        else:
+            print(f"[INFO] Chunk boundary settings changed since {CHUNK_PLAN_FILE} was planned; "
+                  f"discarding it.")
+            os.remove(CHUNK_PLAN_FILE)
+    if chunk_plan is None and needs_split and args.chunk_boundaries != "fixed":
+        print(f"\n--- Planning chunk boundaries ({args.chunk_boundaries}) ---")
+        use_scene_cuts = args.chunk_boundaries == "scene"
+        index = build_keyframe_index(INPUT_VIDEO, args.scene_threshold if use_scene_cuts else None)
+        chunk_plan = plan_chunk_boundaries(index, CHUNK_DURATION_SECONDS, use_scene_cuts)
+        chunk_plan["settings"] = plan_settings
+        with open(CHUNK_PLAN_FILE, "w") as f:
+            json.dump(chunk_plan, f)
+        print(f"  > {len(chunk_plan['durations'])} chunks of {min(chunk_plan['durations']):.0f}-"
+              f"{max(chunk_plan['durations']):.0f}s, {chunk_plan['scene_aligned']}/"
+              f"{len(chunk_plan['boundaries'])} boundaries on scene cuts.")
+    if chunk_plan is not None:
+        total_chunks = len(chunk_plan["durations"])
+    else:
+        total_chunks = math.ceil(duration / CHUNK_DURATION_SECONDS)
+
+    # Overlap-and-trim needs exact chunk start frames, which only a plan has.
+    CHUNK_OVERLAP = current_metadata["chunk_overlap"]
+    if CHUNK_OVERLAP and chunk_plan is None:
+        print(f"[WARN] --chunk-overlap needs planned chunk boundaries; this split has fixed boundaries. "
+              f"Processing chunks without overlap.")
+        CHUNK_OVERLAP = 0
 
     # --- Pre-Flight Plan ---
     # Always printed so the user can verify settings before hours of processing.
@@ -928,10 +1813,35 @@ def main(args):
     print(f"  Scale:         {SCALE_FACTOR}x  ({REALSRGAN_MODEL})")
     print(f"  Profile:       {profile}  →  {prefilter_vf}")
     print(f"  Pre-filter:    CRF 12  |  preset fast  |  yuv444p  (intermediate, deleted after processing)")
-    print(f"  RIFE encode:   CRF 14  |  preset fast  (intermediate, deleted after concat)")
+    if CHUNK_OVERLAP:
+        print(f"  Overlap:       {CHUNK_OVERLAP} context frame(s) before each chunk"
+              f"{', 1 after (RIFE)' if not args.no_rife else ''}, trimmed before encoding")
+    print(f"  ESRGAN encode: {ESRGAN_ENCODER} profile  "
+          f"({'final chunk' if args.no_rife or IN_PROCESS_INTERPOLATION else 'intermediate, deleted after RIFE'})")
+    if not args.no_rife and not IN_PROCESS_INTERPOLATION:
+        print(f"  RIFE encode:   CRF 14  |  preset fast  (intermediate, deleted after concat)")
     print(f"  RIFE:          {'enabled (--rife): frames will be doubled' if not args.no_rife else 'disabled (default)'}")
+    if not args.no_rife:
+        print(f"  Interpolation: {INTERPOLATION}"
+              f"{' (in-process, during Real-ESRGAN)' if IN_PROCESS_INTERPOLATION else ' (directory mode)'}")
     print(f"  Output FPS:    {output_fps_float:.3f}")
     print(f"  Output file:   {FINAL_VIDEO_FILE}")
+    # Predicted time of the remaining work, from the throughput history of
+    # earlier runs on this machine (see ThroughputPlanner).
+    remaining_video_sec = max(duration - len(completed_rife_chunks) * CHUNK_DURATION_SECONDS, 0)
+    plan = planner.predict(job, remaining_video_sec, CHUNK_DURATION_SECONDS)
+    if plan is None:
+        print(f"  Predicted:     unknown (no timings for this job on this machine yet)")
+    else:
+        if os.path.exists(os.path.join(INPUT_CHUNKS_DIR, f"chunk_000{INPUT_EXT}")) or completed_rife_chunks:
+            plan.pop("split", None)
+        plan_total = sum(plan.values())
+        plan_finish = datetime.now().astimezone() + timedelta(seconds=plan_total)
+        plan_stages = ", ".join(f"{stage} {format_hours(sec)}"
+                                for stage, sec in sorted(plan.items(), key=lambda kv: -kv[1]))
+        print(f"  Predicted:     {format_hours(plan_total)}{' remaining' if completed_rife_chunks else ''}  "
+              f"→  {plan_finish.strftime('%Y-%m-%d %H:%M %Z')}")
+        print(f"                 ({plan_stages})")
 
     # Warn prominently when the output will not be ~60fps — this is the most
     # common configuration mistake and can waste hours of processing time.
@@ -954,6 +1864,11 @@ def main(args):
             print("  Exiting. Add --force to bypass this prompt in future runs.")
             sys.exit(0)
 
+    # Structured per-stage metrics (processing_chunks/metrics.jsonl). The job
+    # description is stored with every record so runs can be compared later.
+    metrics = MetricsRecorder(METRICS_FILE, job, prometheus_file=args.prometheus_textfile,
+                              history_file=THROUGHPUT_HISTORY_FILE)
+
     # Emit final-output-file line after confirmation so it appears in the log
     # at the point processing actually begins (consistent with prior behaviour).
     print(f"Final Output File: {FINAL_VIDEO_FILE}")
@@ -984,7 +1899,7 @@ def main(args):
                 "-vn", "-c:a", "copy",
                 ORIGINAL_AUDIO_FILE
             ]
-            subprocess.run(cmd_audio_copy, check=True, capture_output=True, text=True)
+            run_ffmpeg(cmd_audio_copy, stall_timeout=FFMPEG_STALL_TIMEOUT)
             if os.path.exists(ORIGINAL_AUDIO_FILE) and os.path.getsize(ORIGINAL_AUDIO_FILE) > 0:
                 audio_copy_ok = True
                 print(f"  > Audio extracted via stream copy (lossless).")
@@ -1001,7 +1916,7 @@ def main(args):
                     "-vn", "-acodec", "libmp3lame", "-q:a", "0",  # q:a 0 = highest VBR quality (~245kbps), handles Hi8/DV fidelity
                     ORIGINAL_AUDIO_FILE_MP3
                 ]
-                subprocess.run(cmd_audio_mp3, check=True, capture_output=True, text=True)
+                run_ffmpeg(cmd_audio_mp3, stall_timeout=FFMPEG_STALL_TIMEOUT)
                 ORIGINAL_AUDIO_FILE = ORIGINAL_AUDIO_FILE_MP3  # point to the actual file produced
                 print(f"  > Audio extracted via MP3 encode fallback (q:a 0, ~245kbps VBR).")
             except subprocess.CalledProcessError as e:
@@ -1028,14 +1943,28 @@ def main(args):
               f"skipping split to preserve existing boundaries.")
     elif not os.path.exists(os.path.join(INPUT_CHUNKS_DIR, f"chunk_000{INPUT_EXT}")):
         print(f"Splitting video into chunks (video only, extension {INPUT_EXT})...")
+        if chunk_plan is not None:
+            # Split just before each planned keyframe: the segment muxer cuts at
+            # the first keyframe at or after each time, so half a frame of slack
+            # keeps float rounding from pushing the cut to the next keyframe.
+            half_frame = 0.5 / source_fps_float
+            segment_args = ["-segment_times", ",".join(f"{b - half_frame:.6f}" for b in chunk_plan["boundaries"])]
+        else:
+            segment_args = ["-segment_time", str(CHUNK_DURATION_SECONDS)]
         cmd_split = [
             "ffmpeg", "-i", INPUT_VIDEO,
             "-an", "-c:v", "copy", "-map", "0:v",
-            "-segment_time", str(CHUNK_DURATION_SECONDS),
+        ] + segment_args + [
             "-f", "segment", "-reset_timestamps", "1",
             chunk_file_pattern
         ]
-        subprocess.run(cmd_split, check=True)
+        try:
+            with metrics.stage("Split", "all", "split", inputs=[INPUT_VIDEO], outputs=[INPUT_CHUNKS_DIR]) as stage:
+                run_ffmpeg(cmd_split, stall_timeout=FFMPEG_STALL_TIMEOUT, progress_callback=stage.on_progress)
+        except subprocess.CalledProcessError as e:
+            print(f"\n--- ERROR: FFmpeg split failed ---")
+            print("STDERR:", e.stderr)
+            raise
     else:
         print("Input chunks already exist, skipping split.")
 
@@ -1114,39 +2043,55 @@ def main(args):
         os.remove(STOP_FILE)
         print(f"[INFO] Removed stale STOP file from previous session: {STOP_FILE}")
 
+    if args.preview:
+        print(f"[INFO] Incremental preview: {PREVIEW_FILE}")
+        update_incremental_preview(PREVIEW_FILE, PREVIEW_STATE_FILE, ORIGINAL_AUDIO_FILE, source_sar)
+
     total_start_time = time.time()
     chunks_to_process = total_chunks
-    # Rolling history for median ETA.  On a resume, reconstruct from the log
-    # so the first chunk in this session shows an ETA rather than "unknown".
-    if is_resume and os.path.exists(LOG_FILE):
-        chunk_durations = load_chunk_durations_from_log(LOG_FILE)
+    # Rolling history for median ETA.  On a resume, reconstruct from the
+    # metrics records so the first chunk in this session shows an ETA rather
+    # than "unknown". Runs started before metrics.jsonl existed fall back to
+    # scraping the log.
+    chunk_durations = []
+    if is_resume:
+        chunk_durations = load_chunk_durations_from_metrics(METRICS_FILE)
+        timing_source = "metrics"
+        if not chunk_durations and os.path.exists(LOG_FILE):
+            chunk_durations = load_chunk_durations_from_log(LOG_FILE)
+            timing_source = "log"
         if chunk_durations:
-            print(f"[INFO] Loaded {len(chunk_durations)} prior chunk timing(s) from log "
+            print(f"[INFO] Loaded {len(chunk_durations)} prior chunk timing(s) from {timing_source} "
                   f"(median: {statistics.median(chunk_durations)/3600:.2f}h).")
-    else:
-        chunk_durations = []
+    # Until the first full chunk of this job finishes, the chunk ETA comes from the planner
+    planned_chunk_cost = planner.chunk_cost(job)
     if TEST_MODE_CHUNKS is not None:
         chunks_to_process = min(total_chunks, TEST_MODE_CHUNKS)
         print(f"*** TEST MODE: Only processing {chunks_to_process} chunk(s) ***")
 
-    # Probe the last input chunk once so every project-completion ETA in the
-    # loop can use (chunks_remaining - 1 + last_chunk_fraction) × median
-    # rather than chunks_remaining × median, which over-estimates whenever the
-    # final chunk is shorter than CHUNK_DURATION_SECONDS (the common case).
-    last_chunk_fraction = 1.0  # assume full chunk if probe fails
-    last_chunk_path = os.path.join(INPUT_CHUNKS_DIR,
-                                   f"chunk_{total_chunks - 1:03d}{INPUT_EXT}")
-    try:
-        _last_sec = float(subprocess.run(
-            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
-             "-of", "default=noprint_wrappers=1:nokey=1", last_chunk_path],
-            capture_output=True, text=True, check=True
-        ).stdout.strip())
-        last_chunk_fraction = min(_last_sec / CHUNK_DURATION_SECONDS, 1.0)
-        print(f"[INFO] Last chunk: {_last_sec:.0f}s / {CHUNK_DURATION_SECONDS}s nominal"
-              f" = {last_chunk_fraction:.2f} of a full chunk.")
-    except Exception:
-        print(f"[INFO] Last chunk size probe failed — ETA will treat it as a full chunk.")
+    # Size of every chunk as a fraction of CHUNK_DURATION_SECONDS. Chunk
+    # timings are normalised to a full chunk before they enter the median, and
+    # ETAs scale the median back by these fractions. Planned chunks have known
+    # durations; with fixed boundaries only the last chunk differs, so it is
+    # probed once (the segment splitter cuts on keyframes, so it is usually short).
+    if chunk_plan is not None:
+        chunk_fractions = [d / CHUNK_DURATION_SECONDS for d in chunk_plan["durations"]]
+    else:
+        last_chunk_fraction = 1.0  # assume full chunk if probe fails
+        last_chunk_path = os.path.join(INPUT_CHUNKS_DIR,
+                                       f"chunk_{total_chunks - 1:03d}{INPUT_EXT}")
+        try:
+            _last_sec = float(subprocess.run(
+                ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+                 "-of", "default=noprint_wrappers=1:nokey=1", last_chunk_path],
+                capture_output=True, text=True, check=True
+            ).stdout.strip())
+            last_chunk_fraction = min(_last_sec / CHUNK_DURATION_SECONDS, 1.0)
+            print(f"[INFO] Last chunk: {_last_sec:.0f}s / {CHUNK_DURATION_SECONDS}s nominal"
+                  f" = {last_chunk_fraction:.2f} of a full chunk.")
+        except Exception:
+            print(f"[INFO] Last chunk size probe failed — ETA will treat it as a full chunk.")
+        chunk_fractions = [1.0] * (total_chunks - 1) + [last_chunk_fraction]
 
     for i in range(chunks_to_process):
         chunk_name = f"chunk_{i:03d}"
@@ -1166,37 +2111,38 @@ def main(args):
 
         if chunk_durations:
             median_sec_pre = statistics.median(chunk_durations)
-            # Last chunk is often shorter than CHUNK_DURATION_SECONDS because
-            # ffmpeg's segment splitter cuts on keyframe boundaries.  Probe the
-            # actual input chunk duration and scale the median proportionally so
-            # the ETA reflects the real remaining work instead of a full chunk.
-            if i == total_chunks - 1:
-                try:
-                    actual_last_sec = float(subprocess.run(
-                        ["ffprobe", "-v", "error", "-show_entries", "format=duration",
-                         "-of", "default=noprint_wrappers=1:nokey=1", input_chunk],
-                        capture_output=True, text=True, check=True
-                    ).stdout.strip())
-                    ratio = actual_last_sec / CHUNK_DURATION_SECONDS
-                    eta_sec = median_sec_pre * ratio
-                    chunk_eta = local_start + timedelta(seconds=eta_sec)
-                    print(f"  > Estimated completion: {chunk_eta.strftime('%Y-%m-%d %H:%M:%S %Z')} "
-                          f"(last chunk {actual_last_sec:.0f}s / {CHUNK_DURATION_SECONDS}s nominal"
-                          f" → {ratio:.2f}× median {median_sec_pre/3600:.2f}h)")
-                except Exception:
-                    # Probe failed — fall back to unscaled median.
-                    chunk_eta = local_start + timedelta(seconds=median_sec_pre)
-                    print(f"  > Estimated completion: {chunk_eta.strftime('%Y-%m-%d %H:%M:%S %Z')} "
-                          f"(median {median_sec_pre/3600:.2f}h, last-chunk size probe failed)")
+            # Scale the full-chunk median by this chunk's size so the ETA
+            # reflects the real work (short last chunk, planned chunk lengths).
+            ratio = chunk_fractions[i]
+            if abs(ratio - 1.0) > 0.01:
+                chunk_eta = local_start + timedelta(seconds=median_sec_pre * ratio)
+                print(f"  > Estimated completion: {chunk_eta.strftime('%Y-%m-%d %H:%M:%S %Z')} "
+                      f"(chunk {ratio * CHUNK_DURATION_SECONDS:.0f}s / {CHUNK_DURATION_SECONDS}s nominal"
+                      f" → {ratio:.2f}× median {median_sec_pre/3600:.2f}h)")
             else:
                 chunk_eta = local_start + timedelta(seconds=median_sec_pre)
                 print(f"  > Estimated completion: {chunk_eta.strftime('%Y-%m-%d %H:%M:%S %Z')} "
                       f"(median {median_sec_pre/3600:.2f}h)")
+        elif planned_chunk_cost is not None:
+            planned_sec = planned_chunk_cost[0] + planned_chunk_cost[1] * CHUNK_DURATION_SECONDS * chunk_fractions[i]
+            chunk_eta = local_start + timedelta(seconds=planned_sec)
+            print(f"  > Estimated completion: {chunk_eta.strftime('%Y-%m-%d %H:%M:%S %Z')} "
+                  f"(planner {planned_sec/3600:.2f}h)")
         else:
             print(f"  > Estimated completion: unknown (first chunk)")
         print(f"  > Project elapsed: {elapsed_hours:.2f}h")
         print(f"  > To stop after this chunk: touch {STOP_FILE}")
 
+        # Context frames around the chunk (--chunk-overlap). hqdn3d's temporal
+        # filter is recursive over past frames only, so it needs context before
+        # the chunk; RIFE needs the first frame of the next chunk to interpolate
+        # after the last one. Chunk 0 has no past and the last chunk no future.
+        context_pre = context_post = 0
+        if CHUNK_OVERLAP:
+            start_frame = sum(chunk_plan["frames"][:i])
+            context_pre = min(CHUNK_OVERLAP, start_frame)
+            context_post = 1 if not args.no_rife and i < total_chunks - 1 else 0
+
         # Track which steps were skipped so partial-resume chunks are excluded
         # from the median ETA — they represent far less work than a full chunk.
         skipped_esrgan = False
@@ -1226,10 +2172,26 @@ def main(args):
 
             print(f"  > Pre-filtering (denoise, deblock, sharpen)...")
             prefiltered_chunk = os.path.join(esrgan_temp_work_dir, f"{chunk_name}_prefiltered.mp4")
+            if CHUNK_OVERLAP:
+                # Read the chunk plus its context from the master instead of the
+                # split chunk. Input seeking is frame-accurate when decoding; half
+                # a frame of slack makes it include exactly context_pre frames
+                # (constant frame rate masters). trim then drops the context
+                # after hqdn3d has seen it.
+                chunk_start = chunk_plan["boundaries"][i - 1] if i > 0 else 0.0
+                seek = max(chunk_start - (context_pre + 0.5) / source_fps_float, 0.0) if context_pre else chunk_start
+                end_frame = context_pre + chunk_plan["frames"][i] + context_post
+                prefilter_input = ["-ss", f"{seek:.6f}", "-i", INPUT_VIDEO, "-map", "0:v:0", "-an"]
+                chunk_vf = f"{prefilter_vf},trim=start_frame={context_pre}:end_frame={end_frame},setpts=PTS-STARTPTS"
+                print(f"  > Context: {context_pre} frame(s) before, {context_post} after "
+                      f"({chunk_plan['frames'][i]} chunk frames)")
+            else:
+                prefilter_input = ["-i", input_chunk]
+                chunk_vf = prefilter_vf
             cmd_prefilter = [
                 "ffmpeg", "-y",
-                "-i", input_chunk,
-                "-vf", prefilter_vf, # "hqdn3d=3:3:6:6,pp=ac,unsharp=3:3:0.6",
+            ] + prefilter_input + [
+                "-vf", chunk_vf, # "hqdn3d=3:3:6:6,pp=ac,unsharp=3:3:0.6",
                 "-c:v", "libx264", "-threads", str(threads), "-crf", "12", # archival: CRF 12 preserves maximum detail for ESRGAN
                 # 2026-05-04: raised from CRF 16 to CRF 12 — all previously processed
                 # videos used CRF 16 for the pre-filter intermediate.
@@ -1243,8 +2205,9 @@ def main(args):
                 prefiltered_chunk
             ]
             try:
-                with Timer(f"{chunk_name} Pre-filter"):
-                    subprocess.run(cmd_prefilter, check=True, capture_output=True, text=True)
+                with metrics.stage(f"{chunk_name} Pre-filter", chunk_name, "prefilter",
+                                   inputs=[input_chunk], outputs=[prefiltered_chunk]) as stage:
+                    run_ffmpeg(cmd_prefilter, stall_timeout=FFMPEG_STALL_TIMEOUT, progress_callback=stage.on_progress)
             except subprocess.CalledProcessError as e:
                 print(f"\n--- ERROR: FFmpeg pre-filtering failed on {chunk_name} ---")
                 print("STDOUT:", e.stdout)
@@ -1261,10 +2224,22 @@ def main(args):
                 "-n", REALSRGAN_MODEL,
                 "-o", esrgan_temp_work_dir, "-s", str(SCALE_FACTOR),
                 "--fps", source_fps_str,
+                "--encoder_profile", ESRGAN_ENCODER,
+                "--encoder_threads", str(threads),
             ]
+            if IN_PROCESS_INTERPOLATION:
+                cmd_realesrgan += ["--interpolate", INTERPOLATION]
+                if context_post:
+                    # The next chunk's first frame is only interpolated towards
+                    cmd_realesrgan.append("--interpolate_drop_last")
+            esrgan_stage = metrics.stage(f"{chunk_name} ESRGAN Inference", chunk_name, "esrgan",
+                                         inputs=[prefiltered_chunk])
             try:
-                with Timer(f"{chunk_name} ESRGAN Inference"):
+                with esrgan_stage:
                     subprocess.run(cmd_realesrgan, check=True, capture_output=True, text=True)
+                    # bytes_out/frames are read on exit, before the rename below
+                    esrgan_stage.outputs = glob.glob(os.path.join(esrgan_temp_work_dir, "*_out.mp4"))
+                    esrgan_stage.frames = get_video_frame_count(esrgan_stage.outputs[0]) if esrgan_stage.outputs else None
             except subprocess.CalledProcessError as e:
                 print(f"\n--- ERROR: Real-ESRGAN failed on {chunk_name} ---")
                 print("STDOUT:", e.stdout)
@@ -1286,20 +2261,33 @@ def main(args):
             
             safe_rmtree(esrgan_temp_work_dir)
             print(f"  > Real-ESRGAN complete: {esrgan_output_file}")
+            # Planned chunks have an exact frame count from the packet index
+            if IN_PROCESS_INTERPOLATION:
+                expected_frames = 2 * chunk_plan["frames"][i] if chunk_plan is not None else None
+            else:
+                expected_frames = chunk_plan["frames"][i] + context_post if chunk_plan is not None else None
+            if expected_frames is not None and esrgan_stage.frames is not None \
+                    and esrgan_stage.frames != expected_frames:
+                print(f"  > WARNING: Real-ESRGAN output has {esrgan_stage.frames} frames, "
+                      f"the chunk plan expects {expected_frames}.")
         else:
             skipped_esrgan = True
             print(f"  > Found existing Real-ESRGAN output, skipping to RIFE.")
 
         # --- Step 2: Run RIFE (Multi-Step) or bypass ---
-        if args.no_rife:
+        if args.no_rife or IN_PROCESS_INTERPOLATION:
             # --no-rife: promote the ESRGAN output directly to the rife chunk slot.
             # All downstream logic (concat, cleanup, ETA) is undisturbed because it
             # only ever references rife_output_file, never esrgan_output_file directly.
             # cleanup_intermediate_files() tolerates a missing esrgan_output_file
             # (it was renamed, not deleted) and missing frame dirs (never created).
-            print(f"  > Skipping RIFE (--no-rife): promoting ESRGAN output to final chunk slot.")
+            # An in-process interpolation backend has already doubled the frames.
+            if IN_PROCESS_INTERPOLATION:
+                print(f"  > Frames interpolated in-process ({INTERPOLATION}): promoting ESRGAN output to final chunk slot.")
+            else:
+                print(f"  > Skipping RIFE (--no-rife): promoting ESRGAN output to final chunk slot.")
             os.rename(esrgan_output_file, rife_output_file)
-            print(f"  > No-RIFE complete: {rife_output_file}")
+            print(f"  > {'Interpolation' if IN_PROCESS_INTERPOLATION else 'No-RIFE'} complete: {rife_output_file}")
 
             # --- CRITICAL: Aggressive Cleanup (no-RIFE path) ---
             # esrgan_output_file was renamed above so it no longer exists at its
@@ -1320,25 +2308,22 @@ def main(args):
                     "ffmpeg", "-i", esrgan_output_file,
                     os.path.join(rife_in_frames_dir, "frame_%08d.png")
                 ]
-                # Timeout: allow 10s per expected frame plus a 120s fixed overhead.
-                # Normal extraction takes 20-45s. This catches silent hangs (e.g. a
-                # subprocess pipe buffer deadlock with capture_output=True) that would
-                # otherwise block the pipeline indefinitely without any error output.
-                # capture_output=True is intentionally kept to preserve error messages
-                # on genuine failures; the timeout is the safeguard against deadlock.
-                expected_frames = int(source_fps_float * CHUNK_DURATION_SECONDS)
-                extraction_timeout = 120 + (expected_frames * 10)
+                # 2026-10-18: the wall-clock timeout (120s + 10s per expected frame)
+                # is replaced by a stall detector. run_ffmpeg drains stdout/stderr on
+                # background threads, so the pipe buffer deadlock the timeout guarded
+                # against cannot happen, and ffmpeg is only killed when its -progress
+                # frame counter stops advancing for FFMPEG_STALL_TIMEOUT seconds.
                 try:
-                    with Timer(f"{chunk_name} RIFE Frame Extraction"):
-                        subprocess.run(cmd_extract, check=True, capture_output=True,
-                                       text=True, timeout=extraction_timeout)
-                except subprocess.TimeoutExpired:
-                    print(f"\n--- ERROR: FFmpeg frame extraction timed out on {chunk_name} ---")
-                    print(f"    Timeout: {extraction_timeout}s "
-                          f"(expected ~{expected_frames} frames at {source_fps_float:.3f} fps)")
+                    with metrics.stage(f"{chunk_name} RIFE Frame Extraction", chunk_name, "extract",
+                                       inputs=[esrgan_output_file], outputs=[rife_in_frames_dir]) as stage:
+                        run_ffmpeg(cmd_extract, stall_timeout=FFMPEG_STALL_TIMEOUT, progress_callback=stage.on_progress)
+                except subprocess.TimeoutExpired as e:
+                    print(f"\n--- ERROR: FFmpeg frame extraction stalled on {chunk_name} ---")
+                    print(f"    No progress for {FFMPEG_STALL_TIMEOUT}s.")
+                    print("STDERR:", e.stderr)
                     print(f"    Partial frames in {rife_in_frames_dir} will be wiped on next run.")
                     print(f"    If this recurs, check disk I/O and available space.")
-                    raise RuntimeError(f"Frame extraction timed out after {extraction_timeout}s on {chunk_name}")
+                    raise RuntimeError(f"Frame extraction stalled for {FFMPEG_STALL_TIMEOUT}s on {chunk_name}")
                 except subprocess.CalledProcessError as e:
                     print(f"\n--- ERROR: FFmpeg frame extraction failed on {chunk_name} ---")
                     print("STDOUT:", e.stdout)
@@ -1364,8 +2349,10 @@ def main(args):
                     "-s", "0.5"
                 ]
                 try:
-                    with Timer(f"{chunk_name} RIFE Interpolation"):
+                    with metrics.stage(f"{chunk_name} RIFE Interpolation", chunk_name, "rife",
+                                       inputs=[rife_in_frames_dir], outputs=[rife_out_frames_dir]) as stage:
                         subprocess.run(cmd_rife, check=True, capture_output=True, text=True)
+                        stage.frames = len(glob.glob(os.path.join(rife_out_frames_dir, "*.png")))
                 except subprocess.CalledProcessError as e:
                     print(f"\n--- ERROR: RIFE failed on {chunk_name} ---")
                     print("STDOUT:", e.stdout)
@@ -1396,11 +2383,16 @@ def main(args):
                 # 2026-05-04: raised from CRF 17 to CRF 14 — all previously processed
                 # videos used CRF 17 for the RIFE frame reassembly intermediate.
                 "-preset", "fast", # temporary intermediate decoded at concat: preset does not affect quality
-                rife_output_file
             ]
+            if context_post:
+                # Drop the frames RIFE produced from the next chunk's first frame;
+                # the frame interpolated towards it is the last one kept.
+                cmd_encode += ["-frames:v", str(2 * (len(in_frames) - context_post))]
+            cmd_encode += [rife_output_file]
             try:
-                with Timer(f"{chunk_name} RIFE Frame Encoding"):
-                    subprocess.run(cmd_encode, check=True, capture_output=True, text=True)
+                with metrics.stage(f"{chunk_name} RIFE Frame Encoding", chunk_name, "encode",
+                                   inputs=[rife_out_frames_dir], outputs=[rife_output_file]) as stage:
+                    run_ffmpeg(cmd_encode, stall_timeout=FFMPEG_STALL_TIMEOUT, progress_callback=stage.on_progress)
             except subprocess.CalledProcessError as e:
                 print(f"\n--- ERROR: FFmpeg frame encoding failed on {chunk_name} ---")
                 print("STDOUT:", e.stdout)
@@ -1421,13 +2413,14 @@ def main(args):
         # and would skew the ETA estimate significantly downward.
         is_full_chunk = not skipped_esrgan and not skipped_frame_extraction
         if is_full_chunk:
-            chunk_durations.append(duration_sec)
+            chunk_durations.append(duration_sec / chunk_fractions[i])
         else:
             skipped_steps = []
             if skipped_esrgan: skipped_steps.append("ESRGAN")
             if skipped_frame_extraction: skipped_steps.append("frame extraction")
             print(f"  > Partial resume (skipped: {', '.join(skipped_steps)}) — "
                   f"chunk time excluded from median ETA.")
+        metrics.record_chunk(chunk_name, duration_sec, is_full_chunk, rife_output_file, chunk_fractions[i])
 
         # Rolling median ETA (stable across noisy chunks)
         if chunk_durations:
@@ -1436,14 +2429,9 @@ def main(args):
             median_sec = duration_sec  # fallback if no full chunks yet
         chunks_remaining = total_chunks - (i + 1)
 
-        # Effective remaining work in full-chunk units:
-        #   (chunks_remaining - 1) full chunks + last_chunk_fraction of a chunk.
-        # When chunks_remaining == 0 this is 0. When the probe failed,
-        # last_chunk_fraction == 1.0 so the formula reduces to chunks_remaining × median.
-        if chunks_remaining > 0:
-            effective_remaining = (chunks_remaining - 1) + last_chunk_fraction
-        else:
-            effective_remaining = 0.0
+        # Effective remaining work in full-chunk units: the sum of the sizes of
+        # the remaining chunks (0 when none remain).
+        effective_remaining = sum(chunk_fractions[i + 1:])
         remaining_sec = median_sec * effective_remaining
         eta_project = local_end + timedelta(seconds=remaining_sec)
 
@@ -1455,6 +2443,9 @@ def main(args):
             print(f"  > Project completion ETA: {eta_project.strftime('%Y-%m-%d %H:%M:%S %Z')} "
                   f"({effective_remaining:.2f}× median {median_sec/3600:.2f}h)")
         
+        if args.preview:
+            update_incremental_preview(PREVIEW_FILE, PREVIEW_STATE_FILE, ORIGINAL_AUDIO_FILE, source_sar)
+
         # --- Runtime Limit Check ---
         if args.max_runtime is not None:
             elapsed_hours = (chunk_end_time - total_start_time) / 3600
@@ -1531,21 +2522,38 @@ def main(args):
 
     print(f"Concatenation list created: {CONCAT_FILE}")
 
-    # Concat: always use plain stream copy, apply SAR after via container tools
+    # Single pass over the chunks: concat (stream copy) + audio mux + SAR +
+    # the source's global metadata and chapters. SAR is written by the mux
+    # itself (see sar_mux_args), so the finished file is not rewritten again.
+    first_chunk = os.path.join(RIFE_CHUNKS_DIR, "chunk_000_rife.mp4")
+    out_width, out_height = get_video_dimensions(first_chunk)
+    source_metadata_file = os.path.join(PROCESSING_DIR, "source_metadata.txt")
     cmd_concat = [
         "ffmpeg", "-y",
         "-f", "concat", "-safe", "0", "-i", CONCAT_FILE,
         "-i", ORIGINAL_AUDIO_FILE,
+    ]
+    if extract_ffmetadata(INPUT_VIDEO, source_metadata_file):
+        cmd_concat += ["-i", source_metadata_file, "-map_metadata", "2", "-map_chapters", "2"]
+    cmd_concat += [
         "-map", "0:v", "-map", "1:a",
         "-c:v", "copy",
         "-c:a", "copy",
+    ] + sar_mux_args(first_chunk, source_sar, out_width, out_height) + [
         "-shortest",
         FINAL_VIDEO_FILE
     ]
 
-    print(f"Running final concatenation and audio muxing...")
+    if source_sar:
+        print(f"SAR {source_sar} is written during the mux (pixel {out_width}x{out_height} -> display "
+              f"{compute_display_width(out_width, out_height, source_sar)}x{out_height}).")
+    else:
+        print(f"Source has square pixels (SAR 1:1) — no SAR correction needed.")
+    print(f"Running final concatenation, audio muxing, SAR and chapters (single pass)...")
     try:
-        subprocess.run(cmd_concat, check=True, capture_output=True, text=True)
+        with metrics.stage("Final concat", "final", "concat",
+                           inputs=final_chunk_files + [ORIGINAL_AUDIO_FILE], outputs=[FINAL_VIDEO_FILE]) as stage:
+            run_ffmpeg(cmd_concat, stall_timeout=FFMPEG_STALL_TIMEOUT, progress_callback=stage.on_progress)
     except subprocess.CalledProcessError as e:
         print(f"\n--- ERROR: Final concatenation failed ---")
         print("STDOUT:", e.stdout)
@@ -1553,13 +2561,18 @@ def main(args):
         print(f"If this is a 'non-monotonic DTS' error, change -c:v copy to -c:v libx264 in the script and re-run.")
         raise
 
-    # Apply SAR to final output using container-native tools (no re-encode)
-    if source_sar:
-        out_width, out_height = get_video_dimensions(FINAL_VIDEO_FILE)
-        print(f"Applying SAR {source_sar} to final output (pixel {out_width}x{out_height} -> display {compute_display_width(out_width, out_height, source_sar)}x{out_height})...")
-        apply_sar_to_file(FINAL_VIDEO_FILE, source_sar, out_width, out_height)
-    else:
-        print(f"Source has square pixels (SAR 1:1) — no SAR correction needed.")
+    # Verify the SAR from the header; fall back to the container tools (header
+    # edit, no re-encode) only if the mux did not carry it through.
+    final_sar = get_video_sar(FINAL_VIDEO_FILE)
+    if final_sar != source_sar:
+        print(f"  ⚠️  Final output SAR is {final_sar or '1:1'}, expected {source_sar or '1:1'} — fixing via container tools.")
+        apply_sar_to_file(FINAL_VIDEO_FILE, source_sar or "1:1", out_width, out_height)
+
+    if args.preview and os.path.exists(PREVIEW_FILE):
+        os.remove(PREVIEW_FILE)
+        if os.path.exists(PREVIEW_STATE_FILE):
+            os.remove(PREVIEW_STATE_FILE)
+        print(f"Removed incremental preview {PREVIEW_FILE} (superseded by the final file).")
 
     # --- Final Cleanup ---
     total_end_time = time.time()
@@ -1584,7 +2597,7 @@ if __name__ == "__main__":
     _resume_cmd: str = " ".join(shlex.quote(arg) for arg in sys.argv)
     try:
         main(args)
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
         print(f"\nA critical command failed. Exiting.")
         sys.exit(1)
     except KeyboardInterrupt: